@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+import logging
+from typing import Optional
+
+from app.core.celery import celery
+from app.schemas.message_schema import IChatQuery
+from app.services.chat_agent.run_queue import agent_worker_loop, arun_queued
+
+logger = logging.getLogger(__name__)
+
+
+@celery.task(name="run_agent", ignore_result=True)
+def run_agent(
+    run_id: str,
+    chat_query: dict,
+    owner: Optional[str] = None,
+    api_key_ref: Optional[str] = None,
+    admission_key: Optional[str] = None,
+) -> None:
+    """
+    Run the agent for a run enqueued by `/chat/agent`, its events are published to the Redis Stream of the run.
+
+    The chat query is sent without its API key, `api_key_ref` is the redis key holding it (see `aenqueue_run`). The
+    per-user admission slot of `admission_key` is released when the run ends.
+    """
+    logger.info(f"Running queued agent run {run_id}")
+    agent_worker_loop.run(
+        arun_queued(run_id, IChatQuery.model_validate(chat_query), owner, api_key_ref, admission_key)
+    )
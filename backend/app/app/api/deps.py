@@ -18,11 +18,15 @@ async def read_users(
     ...
 """
 from collections.abc import AsyncGenerator
+from functools import lru_cache
 
-import redis.asyncio as aioredis
+from fastapi import HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from fastapi_nextauth_jwt import NextAuthJWT
+from fastapi_nextauth_jwt.cookies import extract_token
+from jose import jwt
 from langchain_community.storage import RedisStore
+from pydantic import ValidationError
 from redis import Redis as RedisSync
 from redis.asyncio import Redis
 from sqlmodel.ext.asyncio.session import AsyncSession
@@ -31,38 +35,35 @@ from starlette.requests import Request
 from app.core.config import settings
 from app.db.session import SessionLocal, SessionLocalCelery
 from app.utils.minio_client import MinioClient
+from app.utils.redis_pool import redis_pools
+from app.utils.token_cache import verified_token_cache
 
 reusable_oauth2 = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/login/access-token")
 
 
 def get_redis_store() -> RedisStore:
+    """Returns the RedisStore of the embedding cache, on the shared binary connection pool."""
     store = RedisStore(
-        redis_url=f"redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}",
-        client_kwargs={"db": 2},
+        client=redis_pools.sync_client(db=2, decode_responses=False),
         namespace="embedding_caches",
     )
     return store
 
 
 def get_redis_client_sync() -> RedisSync:
-    """Returns a synchronous Redis client."""
-    return RedisSync(
-        host=settings.REDIS_HOST,
-        port=settings.REDIS_PORT,
-        db=0,
-        decode_responses=True,
-    )
+    """Returns a synchronous Redis client on the shared connection pool."""
+    return redis_pools.sync_client()
 
 
 async def get_redis_client() -> Redis:
-    """Returns an asynchronous Redis client as a coroutine function which should be
-    awaited."""
-    return await aioredis.from_url(
-        f"redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}",
-        max_connections=10,
-        encoding="utf8",
-        decode_responses=True,
-    )
+    """Returns an asynchronous Redis client on the shared connection pool of the event loop as a coroutine function
+    which should be awaited."""
+    return redis_pools.client()
+
+
+async def get_redis_client_binary() -> Redis:
+    """Returns an asynchronous Redis client that does not decode responses, for binary payloads."""
+    return redis_pools.client(decode_responses=False)
 
 
 async def get_db() -> AsyncGenerator[
@@ -95,14 +96,67 @@ def minio_auth() -> MinioClient:
     )
 
 
+async def user_id_identifier(request: Request) -> str:
+    """Identify the user from the request."""
+    if request.scope["type"] == "http":
+        # Retrieve the Authorization header from the request
+        auth_header = request.headers.get("Authorization")
+
+        if auth_header is not None:
+            # Check that the header is in the correct format
+            header_parts = auth_header.split()
+            if len(header_parts) == 2 and header_parts[0].lower() == "bearer":
+                token = header_parts[1]
+                try:
+                    payload = verified_token_cache.get_or_verify(
+                        "jwt",
+                        token,
+                        lambda: jwt.decode(
+                            token,
+                            settings.SECRET_KEY,
+                            algorithms=["HS256"],
+                        ),
+                    )
+                except (
+                    jwt.JWTError,
+                    ValidationError,
+                ):
+                    raise HTTPException(
+                        status_code=status.HTTP_403_FORBIDDEN,
+                        detail="Could not validate credentials",
+                    )
+                user_id = payload["sub"]
+                return user_id
+
+    if request.scope["type"] == "websocket":
+        return request.scope["path"]
+
+    forwarded = request.headers.get("X-Forwarded-For")
+    if forwarded:
+        return forwarded.split(",")[0]
+
+    ip = request.client.host if request.client else ""
+    return ip + ":" + request.scope["path"]
+
+
+@lru_cache(maxsize=1)
+def get_nextauth_jwt() -> NextAuthJWT:
+    """Returns the NextAuthJWT verifier, built once (deriving its key is expensive)."""
+    return NextAuthJWT(
+        secret=settings.NEXTAUTH_SECRET,
+        csrf_prevention_enabled=False,
+    )
+
+
 def get_jwt(req: Request) -> NextAuthJWT:
-    """Returns a NextAuthJWT instance."""
+    """Returns the claims of the NextAuth token of the request, verified tokens are cached until they expire."""
     if not settings.ENABLE_AUTH:
         return None
     if not settings.NEXTAUTH_SECRET:
         raise ValueError("Authentication enabled, but NextAuth secret is not set")
 
-    return NextAuthJWT(
-        secret=settings.NEXTAUTH_SECRET,
-        csrf_prevention_enabled=False,
-    )(req)
+    verifier = get_nextauth_jwt()
+    if verifier.csrf_prevention_enabled:
+        verifier.check_csrf_token(req)  # depends on the request, never cached
+    token = extract_token(req.cookies, verifier.cookie_name)
+    return verified_token_cache.get_or_verify("nextauth", token, lambda: verifier(req))
@@ -1,21 +1,24 @@
 # -*- coding: utf-8 -*-
 import asyncio
 import logging
-from datetime import datetime
-from typing import Annotated
+from typing import Annotated, Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, status
 from fastapi.responses import StreamingResponse
 from langchain.agents import AgentExecutor
 
-from app.api.deps import get_jwt
+from app.api.deps import get_jwt, user_id_identifier
 from app.core.config import settings
 from app.deps import agent_deps
 from app.schemas.message_schema import IChatQuery
-from app.services.chat_agent.helpers.run_helper import is_running, stop_run
-from app.services.chat_agent.meta_agent import get_conv_token_buffer_memory
+from app.services.chat_agent.helpers.run_helper import is_running, run_task_registry, stop_run
+from app.services.chat_agent.run_queue import agent_run_kwargs, arelay_admitted_run
+from app.utils.admission import admission_controller
+from app.utils.fastapi_globals import g
 from app.utils.streaming.callbacks.stream import AsyncIteratorCallbackHandler
-from app.utils.streaming.helpers import event_generator, handle_exceptions
+from app.utils.streaming.helpers import event_generator, handle_admission
+from app.utils.streaming.protocol import negotiate_protocol
+from app.utils.streaming.run_events import arun_events_owner, run_events_exist, sse_run_events
 from app.utils.streaming.StreamingJsonListResponse import StreamingJsonListResponse
 
 router = APIRouter()
@@ -24,7 +27,7 @@ logger = logging.getLogger(__name__)
 
 def get_meta_agent_with_api_key(
     chat: IChatQuery,
-) -> AgentExecutor:
+) -> Optional[AgentExecutor]:
     """
     Returns a MetaAgent instance with the API key specified in the chat query.
 
@@ -32,11 +35,35 @@ def get_meta_agent_with_api_key(
         chat (IChatQuery): The chat query containing the API key.
 
     Returns:
-        MetaAgent: The MetaAgent instance with the specified API key.
+        Optional[MetaAgent]: The MetaAgent instance with the specified API key, None if AGENT_RUN_QUEUE_ENABLED is
+        set (the agent workers build it).
     """
+    if settings.AGENT_RUN_QUEUE_ENABLED:
+        return None
     return agent_deps.get_meta_agent(chat.api_key)
 
 
+def get_run_owner(
+    jwt: Annotated[dict, Depends(get_jwt)],
+) -> Optional[str]:
+    """The user the runs of a request belong to: the JWT subject, None if authentication is disabled."""
+    if jwt:
+        subject = jwt.get("sub") or jwt.get("email")
+        if subject:
+            return str(subject)
+    return None
+
+
+async def get_admission_key(
+    request: Request,
+    run_owner: Annotated[Optional[str], Depends(get_run_owner)],
+) -> str:
+    """The user a run is admitted for: the run owner, or the `user_id_identifier` of the rate limiter."""
+    if run_owner is not None:
+        return run_owner
+    return await user_id_identifier(request)
+
+
 @router.get("/run/{run_id}/status", response_model=bool)
 async def run_status(
     run_id: str,
@@ -52,11 +79,46 @@ async def run_cancel(
     return True
 
 
+@router.get("/run/{run_id}/events")
+async def run_events(
+    run_id: str,
+    run_owner: Annotated[Optional[str], Depends(get_run_owner)],
+    after: str = "0-0",
+    last_event_id: Annotated[Optional[str], Header()] = None,
+) -> StreamingResponse:
+    """
+    Replays the events of a run as server-sent events and tails them until the run ends.
+
+    Requires RUN_EVENTS_STREAM_ENABLED. Each event id is its Redis Stream id, so that a reconnecting client resumes
+    after the last event it received, either with the `after` query parameter or the `Last-Event-ID` header (which
+    takes precedence, browsers send it when an EventSource reconnects).
+
+    Args:
+        run_id (str): The run id (sent in the metadata of the START event).
+        run_owner (Optional[str]): The user of the request, only the user who started the run can read its events.
+        after (str): The stream id after which events are sent. Defaults to all events.
+        last_event_id (Optional[str]): The `Last-Event-ID` header.
+
+    Returns:
+        StreamingResponse: The server-sent events of the run.
+    """
+    if not await run_events_exist(run_id) or await arun_events_owner(run_id) != run_owner:
+        raise HTTPException(status_code=404, detail=f"No events found for run {run_id}")
+    return StreamingResponse(
+        sse_run_events(run_id, last_event_id or after),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
 @router.post("/agent", dependencies=[Depends(agent_deps.set_global_tool_context)])
 async def agent_chat(
     chat: IChatQuery,
     jwt: Annotated[dict, Depends(get_jwt)],
-    meta_agent: AgentExecutor = Depends(get_meta_agent_with_api_key),
+    meta_agent: Optional[AgentExecutor] = Depends(get_meta_agent_with_api_key),
+    x_stream_protocol: Annotated[Optional[str], Header()] = None,
+    admission_key: str = Depends(get_admission_key),
+    run_owner: Optional[str] = Depends(get_run_owner),
 ) -> StreamingResponse:
     """
     This function handles the chat interaction with an agent. It converts the chat
@@ -64,49 +126,62 @@ async def agent_chat(
     a stream handler. It then creates an asyncio task to handle the conversation with
     the agent and returns a streaming response of the conversation.
 
+    If AGENT_RUN_QUEUE_ENABLED is set, the run is enqueued for the agent workers instead
+    and the response relays the events they publish (see `run_queue.py`).
+
+    Runs are admitted by the `admission_controller`: runs over the per-user or per-worker
+    cap wait briefly and stream QUEUED signals with their position, if they can not be
+    queued, the request is rejected with HTTP 429 and a Retry-After header.
+
     Args:
         chat (IChatQuery): The chat query containing the messages and other details.
         jwt (Annotated[dict, Depends(get_jwt)]): The JWT token from the request.
-        meta_agent (AgentExecutor, optional): The MetaAgent instance. Defaults to the one returned by get_
-        meta_agent_with_api_key.
+        meta_agent (Optional[AgentExecutor]): The MetaAgent instance. Defaults to the one returned by get_
+        meta_agent_with_api_key, None if AGENT_RUN_QUEUE_ENABLED is set.
+        x_stream_protocol (Optional[str]): The `X-Stream-Protocol` header, set to "2" to receive the compact
+        wire protocol version 2 (see `app.utils.streaming.protocol`). Defaults to version 1.
+        admission_key (str): The user the run is admitted for.
+        run_owner (Optional[str]): The user the run belongs to, the only one allowed to read its events.
 
     Returns:
         StreamingResponse: The streaming response of the conversation.
     """
     logger.info(f"User JWT from request: {jwt}")
+    protocol = negotiate_protocol(x_stream_protocol)
+
+    admitted = await admission_controller.atry_acquire(admission_key)
+    if not admitted and not admission_controller.can_queue():
+        rejection = admission_controller.reject()
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=rejection.detail,
+            headers={"Retry-After": str(rejection.retry_after)},
+        )
 
-    api_key = chat.api_key
-    if api_key is None or api_key == "":
-        api_key = settings.OPENAI_API_KEY
+    if settings.AGENT_RUN_QUEUE_ENABLED or meta_agent is None:
+        return StreamingJsonListResponse(
+            arelay_admitted_run(g.query_context["run_id"], chat, admission_key, admitted, run_owner),
+            media_type="text/plain",
+            protocol=protocol,
+        )
 
-    chat_messages = [m.to_langchain() for m in chat.messages]
-    memory = get_conv_token_buffer_memory(
-        chat_messages[:-1],  # type: ignore
-        api_key,
-    )
-    stream_handler = AsyncIteratorCallbackHandler()
-    chat_content = chat_messages[-1].content if chat_messages[-1] is not None else ""
-    asyncio.create_task(
-        handle_exceptions(
+    stream_handler = AsyncIteratorCallbackHandler(owner=run_owner)
+    stream_handler.agent_task = asyncio.create_task(
+        handle_admission(
             meta_agent.arun(
-                input=chat_content,
-                chat_history=memory.load_memory_variables({})["chat_history"],
                 callbacks=[stream_handler],
-                user_settings=chat.settings,
-                tags=[
-                    "agent_chat",
-                    f"user_email={chat.user_email}",
-                    f"conversation_id={chat.conversation_id}",
-                    f"message_id={chat.new_message_id}",
-                    f"timestamp={datetime.now()}",
-                    f"version={chat.settings.version if chat.settings is not None else 'N/A'}",
-                ],
+                **agent_run_kwargs(chat),
             ),
             stream_handler,
+            admission_key,
+            admitted,
         )
     )
+    if stream_handler.run_id is not None:
+        run_task_registry.register(stream_handler.run_id, stream_handler.agent_task)
 
     return StreamingJsonListResponse(
         event_generator(stream_handler),
         media_type="text/plain",
+        protocol=protocol,
     )
@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 # mypy: disable-error-code="attr-defined"
-from fastapi import APIRouter
-from fastapi_cache.decorator import cache
+from typing import Annotated, List, Optional
 
+from fastapi import APIRouter, Depends, Query
+
+from app.api.deps import get_jwt
 from app.db.session import sql_tool_db
+from app.db.sql_result_cache import sql_result_cache
 from app.schemas.response_schema import IGetResponseBase, create_response
 from app.schemas.tool_schemas.sql_tool_schema import ExecutionResult
 from app.utils.sql import is_sql_query_safe
@@ -12,7 +15,6 @@ router = APIRouter()
 
 
 @router.get("/execute")
-@cache(expire=600)  # -> Bug on POST requests https://github.com/long2ice/fastapi-cache/issues/113
 async def execute_sql(
     statement: str,
 ) -> IGetResponseBase[ExecutionResult]:
@@ -34,7 +36,7 @@ async def execute_sql(
         (
             columns,
             rows,
-        ) = sql_tool_db.execute(statement)
+        ) = await sql_result_cache.aexecute(sql_tool_db, statement)
         execution_result = ExecutionResult(
             raw_result=[
                 dict(
@@ -58,3 +60,19 @@ async def execute_sql(
         message="Successfully executed SQL query",
         data=execution_result,
     )
+
+
+@router.post("/cache/invalidate", dependencies=[Depends(get_jwt)])
+async def invalidate_sql_cache(
+    tables: Annotated[Optional[List[str]], Query()] = None,
+) -> IGetResponseBase[None]:
+    """
+    Drops the cached results of queries on the given tables (`schema.table` names), or all cached results.
+
+    Call it after the data of tables changes, e.g. at the end of an ETL job.
+    """
+    await sql_result_cache.ainvalidate(tables)
+    return create_response(
+        message=f"Invalidated the cached results of {'all tables' if tables is None else ', '.join(tables)}",
+        data=None,
+    )
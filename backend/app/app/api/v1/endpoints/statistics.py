@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*-
 from os import getenv
-from typing import List
+from typing import Any, Dict, List
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 from langsmith import Client
 from langsmith.schemas import Run
 
+from app.api.deps import get_jwt
 from app.schemas.message_schema import FeedbackLangchain, FeedbackSourceBaseLangchain, IFeedback
+from app.utils.metrics import metrics
 
 router = APIRouter()
 
@@ -49,3 +51,9 @@ async def send_feedback(
         ),
     )
     return feedback_pydanticv2
+
+
+@router.get("/metrics", dependencies=[Depends(get_jwt)])
+async def get_metrics() -> Dict[str, Dict[str, Any]]:
+    """Get the internal metrics (caches, pools, streams) of the worker serving the request."""
+    return metrics.collect()
@@ -19,6 +19,14 @@ class Settings(BaseSettings):
     OPENAI_API_KEY: str
     OPENAI_ORGANIZATION: Optional[str] = None
     OPENAI_API_BASE: Optional[str] = None
+    LLM_CLIENT_CACHE_SIZE: int = 64
+    LLM_CLIENT_CACHE_IDLE_TIMEOUT: float = 900.0  # seconds before idle clients of user API keys are evicted
+    LLM_HTTP_MAX_CONNECTIONS: int = 100
+    LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    LLM_HTTP_KEEPALIVE_EXPIRY: float = 60.0
+    TOKENIZER_THREAD_POOL_SIZE: int = 4
+    TOKENIZER_OFFLOAD_THRESHOLD: int = 20_000  # characters from which texts are tokenized off the event loop
+    TOKENIZER_STATIC_CACHE_SIZE: int = 1024
     DATABASE_USER: str
     DATABASE_PASSWORD: str
     DATABASE_HOST: str
@@ -27,6 +35,8 @@ class Settings(BaseSettings):
     DATABASE_CELERY_NAME: str = "celery_schedule_jobs"
     REDIS_HOST: str
     REDIS_PORT: int
+    REDIS_MAX_CONNECTIONS: int = 256  # per shared connection pool (see `app.utils.redis_pool`)
+    REDIS_SOCKET_TIMEOUT: float = 5.0
     DB_POOL_SIZE: int = 83
     WEB_CONCURRENCY: int = 9
     POOL_SIZE: int = max(
@@ -148,6 +158,8 @@ class Settings(BaseSettings):
 
     ENABLE_AUTH: bool = False
     NEXTAUTH_SECRET: Optional[str] = None
+    JWT_CACHE_SIZE: int = 10_000  # verified tokens cached per worker, 0 disables the cache
+    JWT_CACHE_TTL: float = 300.0  # max seconds a verified token is cached (tokens are never cached past their expiry)
 
     SECRET_KEY: str = secrets.token_urlsafe(32)
     BACKEND_CORS_ORIGINS: list[str] | list[AnyHttpUrl]
@@ -179,6 +191,45 @@ class Settings(BaseSettings):
     PDF_TOOL_EXTRACTION_CONFIG_PATH: str
     AGENT_CONFIG_PATH: str
 
+    ################################
+    # Router agent configuration
+    ################################
+    ROUTER_CACHE_ENABLED: bool = True
+    ROUTER_CACHE_TTL: int = 3600  # seconds
+    ROUTER_CACHE_HISTORY_MESSAGES: int = 4  # number of recent chat messages included in the cache key
+    ROUTER_CLASSIFIER_ENABLED: bool = False
+    ROUTER_CLASSIFIER_EMBEDDING_MODEL: Optional[str] = None
+    ROUTER_CLASSIFIER_THRESHOLD: float = 0.95  # cosine similarity from which the LLM is skipped
+    ROUTER_CLASSIFIER_MAX_EXAMPLES: int = 5000
+    ROUTER_CLASSIFIER_SHADOW_RATE: float = 0.05  # fraction of confident predictions still verified with the LLM
+    SPECULATION_ENABLED: bool = False
+    SPECULATION_MIN_PROBABILITY: float = 0.3  # minimum probability that the selected plan runs the speculative step
+    SPECULATION_MAX_TASKS: int = 2
+    SPECULATION_WASTE_BUDGET: int = 100  # LLM calls of discarded speculative work per window and worker
+    SPECULATION_WASTE_WINDOW: float = 3600.0  # seconds
+    SPECULATION_FREQUENCIES_RELOAD_INTERVAL: float = 300.0  # seconds between reloads of the plan frequencies
+
+    ################################
+    # Streaming configuration
+    ################################
+    STREAM_COALESCE_DELAY: float = 0.0  # seconds to wait for further LLM tokens to merge into one event, 0 disables
+    STREAM_COALESCE_MAX_CHARS: int = 256
+    STREAM_BUFFER_MAX_BYTES: int = 4_000_000  # approximate bytes per stream before LLM tokens are merged, 0 disables
+    STREAM_BUFFER_STALL_TIMEOUT: float = 60.0  # seconds a stream buffer may stay full before the client is dropped
+    RUN_EVENTS_STREAM_ENABLED: bool = False
+    RUN_EVENTS_STREAM_TTL: int = 3600  # seconds after the last event
+    RUN_EVENTS_STREAM_MAX_LEN: int = 10_000  # approximate maximum number of events kept per run
+    RUN_EVENTS_FLUSH_INTERVAL: float = 0.05  # seconds events are batched before they are written to redis
+    AGENT_RUN_QUEUE_ENABLED: bool = False
+    AGENT_RUN_QUEUE: str = "agent_runs"
+    AGENT_RUN_QUEUE_TIMEOUT: float = 60.0  # seconds the API waits for an agent worker to start a queued run
+    ADMISSION_MAX_RUNS_PER_USER: int = 3  # agent runs in flight per user across all API workers, 0 disables
+    ADMISSION_MAX_RUNS_PER_WORKER: int = 50  # agent runs in flight per API worker process, 0 disables
+    ADMISSION_QUEUE_TIMEOUT: float = 10.0  # seconds a run over a limit waits for a slot, 0 rejects immediately
+    ADMISSION_MAX_QUEUED: int = 100  # runs waiting per API worker process before further runs are rejected
+    ADMISSION_RETRY_AFTER: int = 5  # seconds of the Retry-After header of rejected runs
+    RUN_CANCEL_CHANNEL: str = "run_cancel"  # redis pub/sub channel of run cancellations
+
     ################################
     # Tool specific configuration
     ################################
@@ -186,7 +237,25 @@ class Settings(BaseSettings):
     SQL_TOOL_DB_SCHEMAS: list[str] = []
     SQL_TOOL_DB_INFO_PATH: str
     SQL_TOOL_DB_URI: str
-    SQL_TOOL_DB_OVERWRITE_ON_START: bool = True
+    SQL_TOOL_DB_OVERWRITE_ON_START: bool = True  # refresh the schema snapshot on start up (changed tables only)
+    SQL_TOOL_DB_INTROSPECTION_THREADS: int = 8  # threads inspecting the tables of the SQL tool database on start up
+    SQL_TOOL_DB_QUERY_TIMEOUT: float = 30.0  # seconds before a query of the SQL tool or `/sql/execute` is cancelled
+    SQL_TOOL_DB_STATEMENT_TIMEOUTS: dict[str, float] = {}  # query timeouts by dialect, e.g. {"snowflake": 120}
+    SQL_TOOL_DB_ASYNC_ENGINE: bool = True  # run queries on an async engine if the dialect has an async driver
+    SQL_TOOL_DB_MAX_THREADS: int = 8  # threads running the queries of dialects without an async driver
+    SQL_TOOL_DB_COUNT_CAP: int = 100_000  # rows counted for the SQL tool, larger results are "more than" the cap
+    SQL_TOOL_DB_READ_ONLY: bool = True  # connections of the SQL tool run read-only transactions
+    SQL_TOOL_DB_POOL_SIZE: int = 5  # connections kept open per schema (and event loop, for async engines)
+    SQL_TOOL_DB_MAX_OVERFLOW: int = 10  # connections opened beyond the pool size under load
+    SQL_TOOL_DB_POOL_TIMEOUT: float = 30.0  # seconds waiting for a connection of a full pool
+    SQL_TOOL_DB_POOL_RECYCLE: int = 1800  # seconds before a pooled connection is reopened
+    SQL_TOOL_DB_POOL_METRICS: bool = True  # expose the connection pools of the SQL tool at /statistics/metrics
+    SQL_RESULT_CACHE_ENABLED: bool = True
+    SQL_RESULT_CACHE_TTL: int = 600  # seconds results are cached in redis, unless a table has its own TTL
+    SQL_RESULT_CACHE_TABLE_TTLS: dict[str, int] = {}  # seconds by `schema.table` (or `table`), 0 disables caching
+    SQL_RESULT_CACHE_SIZE: int = 256  # results cached per worker process, 0 disables the in-process tier
+    SQL_RESULT_CACHE_LOCAL_TTL: float = 60.0  # max seconds results are cached per worker process
+    SQL_RESULT_CACHE_MAX_ROWS: int = 10_000  # larger results of `/sql/execute` are not cached
 
     @validator(
         "SQL_TOOL_DB_URI",
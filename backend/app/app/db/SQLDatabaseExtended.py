@@ -1,47 +1,351 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import asyncio
+import importlib.util
+import json
 import logging
-from typing import Any, List, Optional, Sequence, Tuple
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, TypeVar
 
 from langchain.utilities.sql_database import SQLDatabase
-from sqlalchemy import create_engine, text
-from sqlalchemy.engine import Engine
+from sqlalchemy import text
+from sqlalchemy.engine import URL, Connection, Engine, make_url
 from sqlalchemy.engine.result import Row
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
 
+from app.core.config import settings
+from app.db.sql_engines import sql_engine_pools
 from app.schemas.tool_schemas.sql_tool_schema import DatabaseInfo
+from app.utils.exceptions.common_exceptions import SQLQueryTimeoutException
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+# async drivers by dialect, and the query parameters of the sync URL they accept (as connect arguments)
+ASYNC_DRIVERS: Dict[str, Tuple[str, Dict[str, Tuple[str, Callable[[Any], Any]]]]] = {
+    "postgresql": ("asyncpg", {"connect_timeout": ("timeout", float)}),
+}
+
+_sql_executor: Optional[ThreadPoolExecutor] = None
+_sql_executor_lock = threading.Lock()
+
+
+def get_sql_executor() -> ThreadPoolExecutor:
+    """The bounded thread pool running the queries of databases without an async driver."""
+    global _sql_executor  # pylint: disable=global-statement
+    with _sql_executor_lock:
+        if _sql_executor is None:
+            _sql_executor = ThreadPoolExecutor(
+                max_workers=settings.SQL_TOOL_DB_MAX_THREADS,
+                thread_name_prefix="sql_tool_db",
+            )
+        return _sql_executor
+
+
+def async_url(
+    url: URL,
+) -> Optional[Tuple[URL, dict]]:
+    """The URL (and connect arguments) of the async driver of a sync database URL, None if there is none."""
+    if url.get_backend_name() not in ASYNC_DRIVERS:
+        return None
+    driver, query_args = ASYNC_DRIVERS[url.get_backend_name()]
+    if importlib.util.find_spec(driver) is None or any(k not in query_args for k in url.query):
+        return None
+    connect_args = {query_args[k][0]: query_args[k][1](v) for k, v in url.query.items()}
+    return url.set(drivername=f"{url.get_backend_name()}+{driver}", query={}), connect_args
+
+
+@dataclass
+class SampledResult:
+    """The first rows of a query result and its (capped) total number of rows."""
+
+    columns: List[str]
+    rows: List[Sequence[Any]]  # `Row`s, or tuples when read from the result cache
+    total_rows: int
+    total_capped: bool = False  # there are more than `total_rows` rows
+
+    def total_str(
+        self,
+    ) -> str:
+        return f"more than {self.total_rows}" if self.total_capped else str(self.total_rows)
+
+
+@dataclass
+class QueryPlanEstimate:
+    """The planner's estimates of a query: the rows it returns and its cost (in the cost units of the dialect)."""
+
+    rows: Optional[float] = None
+    cost: Optional[float] = None
+
+
+def _postgresql_estimate(
+    plan: Any,
+) -> QueryPlanEstimate:
+    plan = json.loads(plan) if isinstance(plan, str) else plan
+    root = plan[0]["Plan"]
+    return QueryPlanEstimate(rows=float(root["Plan Rows"]), cost=float(root["Total Cost"]))
+
+
+def _mysql_estimate(
+    plan: Any,
+) -> QueryPlanEstimate:
+    plan = json.loads(plan) if isinstance(plan, (str, bytes)) else plan
+
+    def scanned_rows(node: Any) -> List[float]:
+        if isinstance(node, dict):
+            rows = [float(node["rows_examined_per_scan"])] if "rows_examined_per_scan" in node else []
+            return rows + [r for value in node.values() for r in scanned_rows(value)]
+        if isinstance(node, list):
+            return [r for value in node for r in scanned_rows(value)]
+        return []
+
+    rows = scanned_rows(plan)
+    cost = plan["query_block"].get("cost_info", {}).get("query_cost")
+    return QueryPlanEstimate(rows=max(rows) if rows else None, cost=float(cost) if cost is not None else None)
+
+
+# the prefix of the EXPLAIN statement of a query, and the parser of its result (a single value), by dialect
+EXPLAIN_STATEMENTS: Dict[str, Tuple[str, Callable[[Any], QueryPlanEstimate]]] = {
+    "postgresql": ("EXPLAIN (FORMAT JSON) ", _postgresql_estimate),
+    "mysql": ("EXPLAIN FORMAT=JSON ", _mysql_estimate),
+}
+
+
+def count_query(
+    command: str,
+) -> str:
+    """A query counting the rows of a query, up to the bound parameter `cap`."""
+    command = command.strip().rstrip(";")
+    return f"SELECT COUNT(*) FROM (SELECT 1 FROM ({command}) AS sampled_query LIMIT :cap) AS capped_query"
+
 
 class SQLDatabaseExtended(SQLDatabase):
-    """SQL database wrapper."""
+    """
+    SQL database wrapper.
+
+    The async variants `aexecute` and `arun_no_str` do not block the event loop: they run on an async engine if the
+    dialect has an installed async driver (see `ASYNC_DRIVERS`), else on a bounded thread pool shared by all databases
+    (SQL_TOOL_DB_MAX_THREADS). Queries time out after `query_timeout` seconds (by dialect in
+    SQL_TOOL_DB_STATEMENT_TIMEOUTS), the server also cancels the statement on PostgreSQL, and on MySQL and Snowflake
+    with engines of `from_uri`.
 
-    db_info: Optional[DatabaseInfo]
+    `explain` and `aexplain` return the planner's row and cost estimates of a query without running it, on the
+    dialects of `EXPLAIN_STATEMENTS`.
+
+    `sample` and `asample` only fetch the first rows of a result (through a server-side cursor where the driver
+    supports one) and count the rest in the database up to `count_cap` rows, so their memory and latency do not grow
+    with the size of the result. Use `execute` and `run_no_str` only where the full result is needed.
+
+    Databases constructed with `from_uri` use the pooled engine of their schema (see `app.db.sql_engines`): the
+    schema, the statement timeout and read-only mode are set once per connection instead of before each statement.
+
+    With `lazy_table_reflection`, constructing the database runs no query: the tables (`include_tables` if given) are
+    listed and reflected on first use (`get_usable_table_names`, `get_table_info`).
+    """
+
+    query_timeout: float = settings.SQL_TOOL_DB_QUERY_TIMEOUT
+    use_async_engine: bool = settings.SQL_TOOL_DB_ASYNC_ENGINE
+    count_cap: int = settings.SQL_TOOL_DB_COUNT_CAP
 
     def __init__(
         self,
         engine: Engine,
         db_info: Optional[DatabaseInfo] = None,
+        query_timeout: Optional[float] = None,
+        use_async_engine: Optional[bool] = None,
+        lazy_table_reflection: bool = False,
+        db_info_loader: Optional[Callable[[], Optional[DatabaseInfo]]] = None,
+        session_state_on_connect: bool = False,
+        read_only: bool = False,
         **kwargs: Any,
     ):
-        """Initialize the SQL database."""
-        super().__init__(
-            engine,
-            **kwargs,
-        )
+        """
+        Initialize the SQL database.
+
+        Args:
+            engine (Engine): The sync engine.
+            db_info (Optional[DatabaseInfo]): The schema information of the tables.
+            query_timeout (Optional[float]): Seconds before async queries time out, defaults to the timeout of the
+                dialect (see `default_query_timeout`).
+            use_async_engine (Optional[bool]): Whether async queries use an async engine where the dialect supports
+                one, defaults to SQL_TOOL_DB_ASYNC_ENGINE.
+            lazy_table_reflection (bool): Whether tables are listed and reflected on first use instead of on
+                construction.
+            db_info_loader (Optional[Callable[[], Optional[DatabaseInfo]]]): Loads the schema information on access
+                instead of `db_info`, e.g. from a snapshot that is refreshed in the background.
+            session_state_on_connect (bool): Whether the engine sets the schema and the statement timeout
+                (`query_timeout`) of its connections (see `configure_session_state`), else they are set before each
+                statement.
+            read_only (bool): Whether transactions are read-only, with `session_state_on_connect`.
+        """
+        self._reflection_kwargs: Optional[Dict[str, Any]] = kwargs if lazy_table_reflection else None
+        self._reflection_lock = threading.RLock()
+        if lazy_table_reflection:
+            # the engine and the schema are needed to run queries before the tables are reflected
+            self._engine = engine
+            self._schema = kwargs.get("schema")
+        else:
+            super().__init__(
+                engine,
+                **kwargs,
+            )
         self.db_info = db_info
+        self._db_info_loader = db_info_loader
+        self.query_timeout = self.default_query_timeout(engine.dialect.name) if query_timeout is None else query_timeout
+        if use_async_engine is not None:
+            self.use_async_engine = use_async_engine
+        self._session_state_on_connect = session_state_on_connect
+        self._connect_timeout = self.query_timeout
+        self._read_only = read_only
+        self._async_engines: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, AsyncEngine
+        ] = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def default_query_timeout(
+        cls,
+        dialect: str,
+    ) -> float:
+        """The query timeout of a dialect in SQL_TOOL_DB_STATEMENT_TIMEOUTS, else `query_timeout`."""
+        return settings.SQL_TOOL_DB_STATEMENT_TIMEOUTS.get(dialect, cls.query_timeout)
+
+    @property
+    def db_info(
+        self,
+    ) -> Optional[DatabaseInfo]:
+        """The schema information of the tables."""
+        loader = getattr(self, "_db_info_loader", None)
+        if loader is not None:
+            return loader()
+        return getattr(self, "_db_info", None)
+
+    @db_info.setter
+    def db_info(
+        self,
+        db_info: Optional[DatabaseInfo],
+    ) -> None:
+        self._db_info = db_info
+        self._db_info_loader = None
+
+    def _reflect_tables(
+        self,
+    ) -> None:
+        """With `lazy_table_reflection`, list and reflect the tables on first use."""
+        with self._reflection_lock:
+            # cleared first, the base class lists the usable tables while it is initialized
+            reflection_kwargs, self._reflection_kwargs = self._reflection_kwargs, None
+            if reflection_kwargs is None:
+                return
+            try:
+                super().__init__(
+                    self._engine,
+                    **reflection_kwargs,
+                )
+            except Exception:
+                self._reflection_kwargs = reflection_kwargs
+                raise
+
+    def get_usable_table_names(
+        self,
+    ) -> Iterable[str]:
+        self._reflect_tables()
+        return super().get_usable_table_names()
+
+    def get_table_info(
+        self,
+        table_names: Optional[List[str]] = None,
+    ) -> str:
+        self._reflect_tables()
+        return super().get_table_info(table_names)
+
+    def _session_statements(
+        self,
+        timeout: Optional[float] = None,
+    ) -> List[str]:
+        """
+        The statements run at the start of each query transaction: the schema and the statement timeout.
+
+        With the session state set on connect, only a timeout other than the one of the connection is set.
+        """
+        statements = []
+        if getattr(self, "_session_state_on_connect", False):
+            if timeout is not None and timeout != self._connect_timeout and self.dialect == "postgresql":
+                statements.append(f"SET LOCAL statement_timeout = {int(timeout * 1000)}")
+            return statements
+        if self._schema is not None:
+            if self.dialect == "snowflake":
+                statements.append(f"ALTER SESSION SET search_path='{self._schema}'")
+            else:
+                statements.append(f"SET search_path TO {self._schema}")
+        if timeout is not None and self.dialect == "postgresql":
+            statements.append(f"SET LOCAL statement_timeout = {int(timeout * 1000)}")
+        return statements
+
+    def _prepare(
+        self,
+        connection: Connection,
+        timeout: Optional[float] = None,
+    ) -> None:
+        for statement in self._session_statements(timeout):
+            connection.exec_driver_sql(statement)
+
+    async def _aprepare(
+        self,
+        connection: AsyncConnection,
+        timeout: Optional[float] = None,
+    ) -> None:
+        for statement in self._session_statements(timeout):
+            await connection.exec_driver_sql(statement)
+
+    def _async_engine(
+        self,
+    ) -> Optional[AsyncEngine]:
+        """The async engine of the running event loop, None if the dialect has no (installed) async driver."""
+        if not self.use_async_engine:
+            return None
+        loop = asyncio.get_running_loop()
+        if loop not in self._async_engines:
+            url_and_args = async_url(self._engine.url)
+            if url_and_args is None:
+                return None
+            url, connect_args = url_and_args
+            if getattr(self, "_session_state_on_connect", False):
+                return sql_engine_pools.async_engine(
+                    url, connect_args, self._schema, self._connect_timeout, self._read_only
+                )
+            self._async_engines[loop] = create_async_engine(url, connect_args=connect_args, pool_pre_ping=True)
+        return self._async_engines[loop]
+
+    async def _arun_with_timeout(
+        self,
+        run_async: Callable[[AsyncEngine, float], Awaitable[T]],
+        run_sync: Callable[[float], T],
+        timeout: Optional[float],
+    ) -> T:
+        timeout = self.query_timeout if timeout is None else timeout
+        engine = self._async_engine()
+        if engine is not None:
+            awaitable = run_async(engine, timeout)
+        else:
+            # an abandoned query keeps its thread until it completes (or the server cancels it)
+            awaitable = asyncio.get_running_loop().run_in_executor(get_sql_executor(), run_sync, timeout)
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError as e:
+            raise SQLQueryTimeoutException(f"The SQL query did not complete within {timeout} seconds") from e
 
     def execute(
         self,
         command: str,
+        timeout: Optional[float] = None,
     ) -> Tuple[list[str], list[Row],]:
         with self._engine.begin() as connection:
-            if self._schema is not None:
-                if self.dialect == "snowflake":
-                    connection.exec_driver_sql(f"ALTER SESSION SET search_path='{self._schema}'")
-                else:
-                    connection.exec_driver_sql(f"SET search_path TO {self._schema}")
+            self._prepare(connection, timeout)
             cursor = connection.execute(text(command))
             columns: List[str] = list(cursor.keys())
             rows: List[Row] = cursor.all()  # type: ignore
@@ -50,10 +354,36 @@ class SQLDatabaseExtended(SQLDatabase):
                 rows,
             )
 
+    async def aexecute(
+        self,
+        command: str,
+        timeout: Optional[float] = None,
+    ) -> Tuple[list[str], list[Row],]:
+        """Async `execute`, raises `SQLQueryTimeoutException` after `timeout` (default `query_timeout`) seconds."""
+
+        async def run_async(
+            engine: AsyncEngine,
+            timeout: float,
+        ) -> Tuple[list[str], list[Row],]:
+            async with engine.begin() as connection:
+                await self._aprepare(connection, timeout)
+                cursor = await connection.execute(text(command))
+                return (
+                    list(cursor.keys()),
+                    cursor.all(),  # type: ignore
+                )
+
+        return await self._arun_with_timeout(
+            run_async,
+            lambda timeout: self.execute(command, timeout),
+            timeout,
+        )
+
     def run_no_str(
         self,
         command: str,
         fetch: str = "all",
+        timeout: Optional[float] = None,
     ) -> Sequence | Row | List[Row] | None:
         """
         Execute a SQL command and return the results.
@@ -62,11 +392,7 @@ class SQLDatabaseExtended(SQLDatabase):
         returns no rows, None is returned.
         """
         with self._engine.begin() as connection:
-            if self._schema is not None:
-                if self.dialect == "snowflake":
-                    connection.exec_driver_sql(f"ALTER SESSION SET search_path='{self._schema}'")
-                else:
-                    connection.exec_driver_sql(f"SET search_path TO {self._schema}")
+            self._prepare(connection, timeout)
             cursor = connection.execute(text(command))
             if cursor.returns_rows:
                 if fetch == "all":
@@ -78,19 +404,158 @@ class SQLDatabaseExtended(SQLDatabase):
                 return result
         return None
 
+    async def arun_no_str(
+        self,
+        command: str,
+        fetch: str = "all",
+        timeout: Optional[float] = None,
+    ) -> Sequence | Row | List[Row] | None:
+        """Async `run_no_str`, raises `SQLQueryTimeoutException` after `timeout` (default `query_timeout`) seconds."""
+        if fetch not in ("all", "one"):
+            raise ValueError("Fetch parameter must be either 'one' or 'all'")
+
+        async def run_async(
+            engine: AsyncEngine,
+            timeout: float,
+        ) -> Sequence | Row | List[Row] | None:
+            async with engine.begin() as connection:
+                await self._aprepare(connection, timeout)
+                cursor = await connection.execute(text(command))
+                if not cursor.returns_rows:
+                    return None
+                return cursor.fetchall() if fetch == "all" else cursor.fetchone()[0]  # type: ignore
+
+        return await self._arun_with_timeout(
+            run_async,
+            lambda timeout: self.run_no_str(command, fetch, timeout),
+            timeout,
+        )
+
+    def sample(
+        self,
+        command: str,
+        nb_rows: int,
+        count_cap: Optional[int] = None,
+        timeout: Optional[float] = None,
+    ) -> Optional[SampledResult]:
+        """
+        Execute a SQL query and return its first rows and its total number of rows, counted up to `count_cap`.
+
+        If the statement returns no rows, None is returned.
+        """
+        count_cap = self.count_cap if count_cap is None else count_cap
+        with self._engine.begin() as connection:
+            self._prepare(connection, timeout)
+            cursor = connection.execution_options(stream_results=True, max_row_buffer=max(nb_rows, 1)).execute(
+                text(command)
+            )
+            if not cursor.returns_rows:
+                return None
+            columns = list(cursor.keys())
+            rows = cursor.fetchmany(nb_rows) if nb_rows > 0 else []
+            cursor.close()
+            total = (
+                len(rows)
+                if 0 < nb_rows and len(rows) < nb_rows
+                else connection.execute(text(count_query(command)), {"cap": count_cap + 1}).scalar_one()
+            )
+        return SampledResult(columns, list(rows), min(total, count_cap), total > count_cap)
+
+    async def asample(
+        self,
+        command: str,
+        nb_rows: int,
+        count_cap: Optional[int] = None,
+        timeout: Optional[float] = None,
+    ) -> Optional[SampledResult]:
+        """Async `sample`, raises `SQLQueryTimeoutException` after `timeout` (default `query_timeout`) seconds."""
+        count_cap = self.count_cap if count_cap is None else count_cap
+
+        async def run_async(
+            engine: AsyncEngine,
+            timeout: float,
+        ) -> Optional[SampledResult]:
+            async with engine.begin() as connection:
+                await self._aprepare(connection, timeout)
+                result = await connection.stream(text(command))
+                columns = list(result.keys())
+                rows = await result.fetchmany(nb_rows) if nb_rows > 0 else []
+                await result.close()
+                if 0 < nb_rows and len(rows) < nb_rows:
+                    total = len(rows)
+                else:
+                    count = await connection.execute(text(count_query(command)), {"cap": count_cap + 1})
+                    total = count.scalar_one()
+            return SampledResult(columns, list(rows), min(total, count_cap), total > count_cap)
+
+        return await self._arun_with_timeout(
+            run_async,
+            lambda timeout: self.sample(command, nb_rows, count_cap, timeout),
+            timeout,
+        )
+
+    def explain(
+        self,
+        command: str,
+        timeout: Optional[float] = None,
+    ) -> Optional[QueryPlanEstimate]:
+        """The planner's estimates of a query (without running it), None if the dialect has no `EXPLAIN_STATEMENTS`."""
+        if self.dialect not in EXPLAIN_STATEMENTS:
+            return None
+        prefix, parse = EXPLAIN_STATEMENTS[self.dialect]
+        return parse(self.run_no_str(prefix + command.strip().rstrip(";"), fetch="one", timeout=timeout))
+
+    async def aexplain(
+        self,
+        command: str,
+        timeout: Optional[float] = None,
+    ) -> Optional[QueryPlanEstimate]:
+        """Async `explain`, raises `SQLQueryTimeoutException` after `timeout` (default `query_timeout`) seconds."""
+        if self.dialect not in EXPLAIN_STATEMENTS:
+            return None
+        prefix, parse = EXPLAIN_STATEMENTS[self.dialect]
+        return parse(await self.arun_no_str(prefix + command.strip().rstrip(";"), fetch="one", timeout=timeout))
+
+    async def aclose(
+        self,
+    ) -> None:
+        """Dispose the async engines of the running event loop."""
+        if getattr(self, "_session_state_on_connect", False):
+            await sql_engine_pools.adispose_async_engines()
+        engine = self._async_engines.pop(asyncio.get_running_loop(), None)
+        if engine is not None:
+            await engine.dispose()
+
     @classmethod
     def from_uri(
         cls,
         database_uri: str,
         engine_args: Optional[dict] = None,
+        read_only: bool = False,
         **kwargs: Any,
     ) -> SQLDatabaseExtended:
-        """Construct a SQLAlchemy engine from URI."""
-        _engine_args = engine_args or {}
-        return cls(
-            create_engine(
-                database_uri,
-                **_engine_args,
+        """
+        Construct the database on the pooled engine of its schema (`kwargs["schema"]`).
+
+        Args:
+            database_uri (str): The URI of the database.
+            engine_args (Optional[dict]): Override the pool arguments of SQL_TOOL_DB_POOL_*.
+            read_only (bool): Whether transactions are read-only.
+        """
+        engine = sql_engine_pools.engine(
+            database_uri,
+            schema=kwargs.get("schema"),
+            statement_timeout=(
+                cls.default_query_timeout(make_url(database_uri).get_backend_name())
+                if kwargs.get("query_timeout") is None
+                else kwargs["query_timeout"]
             ),
+            read_only=read_only,
+            **(engine_args or {}),
+        )
+        return cls(
+            engine,
+            session_state_on_connect=True,
+            read_only=read_only,
             **kwargs,
         )
@@ -1,15 +1,13 @@
 # -*- coding: utf-8 -*-
 import logging
-import os.path
-from typing import List
 
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.core.config import settings
+from app.db.sql_tool_introspection import db_info_snapshot
 from app.db.SQLDatabaseExtended import SQLDatabaseExtended
-from app.schemas.tool_schemas.sql_tool_schema import DatabaseInfo, TableInfo
 
 DB_POOL_SIZE = 83
 WEB_CONCURRENCY = 9
@@ -62,56 +60,20 @@ def _get_local_celery_session() -> sessionmaker:
 
 
 def get_sql_tool_db() -> SQLDatabaseExtended:
-    """Get the SQL database."""
-    if os.path.isfile(settings.SQL_TOOL_DB_INFO_PATH) and settings.SQL_TOOL_DB_OVERWRITE_ON_START is False:
-        db_info = DatabaseInfo.parse_file(settings.SQL_TOOL_DB_INFO_PATH)
-    else:
-        os.makedirs(
-            "app/tool_constants",
-            exist_ok=True,
-        )
-        db_info = _get_table_infos_multi_db(settings.SQL_TOOL_DB_SCHEMAS)
-        with open(
-            settings.SQL_TOOL_DB_INFO_PATH,
-            "w",
-            encoding="utf-8",
-        ) as f:
-            f.write(db_info.model_dump_json(indent=4))
+    """
+    Get the SQL database.
 
+    Construction runs no query: the schema information is loaded lazily from the snapshot at SQL_TOOL_DB_INFO_PATH,
+    which is refreshed in the background on start up (see `app.db.sql_tool_introspection`).
+    """
     return SQLDatabaseExtended.from_uri(
         settings.SQL_TOOL_DB_URI,
-        db_info=db_info,
+        read_only=settings.SQL_TOOL_DB_READ_ONLY,
+        lazy_table_reflection=True,
+        db_info_loader=db_info_snapshot.load,
     )
 
 
-def _get_table_infos_multi_db(
-    schema_names: List[str],
-) -> DatabaseInfo:
-    """Get the table information for multiple databases."""
-    tables = []
-    for schema_name in schema_names:
-        database = SQLDatabaseExtended.from_uri(
-            settings.SQL_TOOL_DB_URI,
-            schema=schema_name,
-        )
-        table_names = list(set(database.get_usable_table_names()))
-        for table_name in table_names:
-            try:
-                table_info = database.get_table_info_no_throw([table_name])
-            except Exception as e:
-                logger.error(f"Failed to get table info for {table_name}: {e}")
-                table_info = f"Failed to get table info for {table_name}: {e}"
-            tables.append(
-                TableInfo(
-                    schema_name=schema_name,
-                    table_name=table_name,
-                    structure=table_info,
-                )
-            )
-
-    return DatabaseInfo(tables=tables)
-
-
 sql_tool_db = get_sql_tool_db() if settings.SQL_TOOL_DB_ENABLED else None
 
 SessionLocal = _get_local_session()
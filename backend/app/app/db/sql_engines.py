@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+Pooled engines of the SQL tool database, one per schema.
+
+The session state of the SQL tool (the schema search path, the statement timeout and read-only transactions) is set
+once per connection, when the pool opens it (`connect` event), instead of in a separate transaction before every
+statement. A connection only carries the state of one schema, so engines are pooled by schema
+(`SQLEnginePools.engine`), with the pool size of SQL_TOOL_DB_POOL_SIZE and SQL_TOOL_DB_MAX_OVERFLOW per engine.
+
+Pools are exposed at `GET /statistics/metrics` under "sql_tool_db_pools" (SQL_TOOL_DB_POOL_METRICS): connections
+in use, idle and overflowing, and the number of connections opened and checked out.
+"""
+import asyncio
+import logging
+import threading
+import weakref
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import URL, Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from app.core.config import settings
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _postgresql_statements(
+    schema: Optional[str],
+    timeout_ms: Optional[int],
+    read_only: bool,
+) -> List[str]:
+    statements = [f"SET search_path TO {schema}"] if schema else []
+    if timeout_ms is not None:
+        statements.append(f"SET statement_timeout = {timeout_ms}")
+    if read_only:
+        statements.append("SET default_transaction_read_only = on")
+    return statements
+
+
+def _snowflake_statements(
+    schema: Optional[str],
+    timeout_ms: Optional[int],
+    _read_only: bool,
+) -> List[str]:
+    # Snowflake has no read-only transactions, grant the role read-only privileges
+    statements = [f"ALTER SESSION SET search_path='{schema}'"] if schema else []
+    if timeout_ms is not None:
+        statements.append(f"ALTER SESSION SET STATEMENT_TIMEOUT_IN_SECONDS = {max(timeout_ms // 1000, 1)}")
+    return statements
+
+
+def _mysql_statements(
+    schema: Optional[str],
+    timeout_ms: Optional[int],
+    read_only: bool,
+) -> List[str]:
+    statements = [f"USE {schema}"] if schema else []
+    if timeout_ms is not None:
+        statements.append(f"SET SESSION MAX_EXECUTION_TIME = {timeout_ms}")
+    if read_only:
+        statements.append("SET SESSION TRANSACTION READ ONLY")
+    return statements
+
+
+def _sqlite_statements(
+    _schema: Optional[str],
+    _timeout_ms: Optional[int],
+    read_only: bool,
+) -> List[str]:
+    return ["PRAGMA query_only = ON"] if read_only else []
+
+
+# statements setting the schema, the statement timeout and read-only mode of a new connection, by dialect
+SESSION_STATEMENTS: Dict[str, Callable[[Optional[str], Optional[int], bool], List[str]]] = {
+    "postgresql": _postgresql_statements,
+    "snowflake": _snowflake_statements,
+    "mysql": _mysql_statements,
+    "sqlite": _sqlite_statements,
+}
+
+# dialects whose session statements enforce read-only transactions
+READ_ONLY_DIALECTS = {"postgresql", "mysql", "sqlite"}
+
+
+def session_statements(
+    dialect: str,
+    schema: Optional[str] = None,
+    statement_timeout: Optional[float] = None,
+    read_only: bool = False,
+) -> List[str]:
+    """The statements setting the session state of a new connection of a dialect, empty for unknown dialects."""
+    if dialect not in SESSION_STATEMENTS:
+        return []
+    timeout_ms = int(statement_timeout * 1000) if statement_timeout is not None else None
+    return SESSION_STATEMENTS[dialect](schema, timeout_ms, read_only)
+
+
+@dataclass
+class PoolStats:
+    """Counters of the connection events of an engine."""
+
+    connects: int = 0
+    checkouts: int = 0
+    invalidations: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def increment(
+        self,
+        counter: str,
+    ) -> None:
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+
+def configure_session_state(
+    engine: Union[Engine, AsyncEngine],
+    schema: Optional[str] = None,
+    statement_timeout: Optional[float] = None,
+    read_only: bool = False,
+    pool_stats: Optional[PoolStats] = None,
+) -> None:
+    """
+    Set the session state of the connections of an engine when they are opened.
+
+    Args:
+        engine (Union[Engine, AsyncEngine]): The engine, owned by the caller: its connections must not be used for
+            other schemas.
+        schema (Optional[str]): The schema of unqualified table names.
+        statement_timeout (Optional[float]): Seconds before the server cancels a statement.
+        read_only (bool): Whether transactions are read-only.
+        pool_stats (Optional[PoolStats]): Counts the connection events of the engine.
+    """
+    sync_engine = engine.sync_engine if isinstance(engine, AsyncEngine) else engine
+    statements = session_statements(sync_engine.dialect.name, schema, statement_timeout, read_only)
+    if read_only and sync_engine.dialect.name not in READ_ONLY_DIALECTS:
+        logger.warning(
+            f"Read-only mode is not enforced on {sync_engine.dialect.name}, "
+            "grant the database user read-only privileges instead"
+        )
+
+    def on_connect(dbapi_connection: Any, _connection_record: Any) -> None:
+        if statements:
+            cursor = dbapi_connection.cursor()
+            try:
+                for statement in statements:
+                    cursor.execute(statement)
+            finally:
+                cursor.close()
+            if sync_engine.dialect.name != "sqlite":
+                # settings of a rolled back transaction are discarded
+                dbapi_connection.commit()
+        if pool_stats is not None:
+            pool_stats.increment("connects")
+
+    event.listen(sync_engine, "connect", on_connect)
+    if pool_stats is not None:
+        event.listen(sync_engine, "checkout", lambda *_: pool_stats.increment("checkouts"))
+        event.listen(sync_engine, "invalidate", lambda *_: pool_stats.increment("invalidations"))
+
+
+def pool_args(
+    url: URL,
+) -> Dict[str, Any]:
+    """The pool arguments of an engine of the SQL tool database (SQL_TOOL_DB_POOL_*)."""
+    if url.get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": settings.SQL_TOOL_DB_POOL_SIZE,
+        "max_overflow": settings.SQL_TOOL_DB_MAX_OVERFLOW,
+        "pool_timeout": settings.SQL_TOOL_DB_POOL_TIMEOUT,
+        "pool_recycle": settings.SQL_TOOL_DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+
+class SQLEnginePools:
+    """Engines of the SQL tool database by URI, schema and session state, shared by the whole process."""
+
+    def __init__(
+        self,
+    ) -> None:
+        self._engines: Dict[Tuple, Tuple[Engine, PoolStats]] = {}
+        self._async_engines: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, Dict[Tuple, Tuple[AsyncEngine, PoolStats]]
+        ] = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def engine(
+        self,
+        database_uri: Union[str, URL],
+        schema: Optional[str] = None,
+        statement_timeout: Optional[float] = None,
+        read_only: bool = False,
+        **engine_args: Any,
+    ) -> Engine:
+        """
+        The pooled engine of a schema, created on first use.
+
+        Args:
+            database_uri (Union[str, URL]): The URI of the database.
+            schema (Optional[str]): The schema of unqualified table names.
+            statement_timeout (Optional[float]): Seconds before the server cancels a statement.
+            read_only (bool): Whether transactions are read-only.
+            engine_args: Override the pool arguments of SQL_TOOL_DB_POOL_*.
+        """
+        url = make_url(database_uri)
+        key = (url.render_as_string(hide_password=False), schema, statement_timeout, read_only, repr(engine_args))
+        with self._lock:
+            if key not in self._engines:
+                engine = create_engine(url, **{**pool_args(url), **engine_args})
+                stats = PoolStats()
+                configure_session_state(engine, schema, statement_timeout, read_only, stats)
+                self._engines[key] = (engine, stats)
+            return self._engines[key][0]
+
+    def async_engine(
+        self,
+        url: URL,
+        connect_args: Dict[str, Any],
+        schema: Optional[str] = None,
+        statement_timeout: Optional[float] = None,
+        read_only: bool = False,
+    ) -> AsyncEngine:
+        """The pooled async engine of a schema on the running event loop (async engines cannot be shared by loops)."""
+        key = (url.render_as_string(hide_password=False), schema, statement_timeout, read_only)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            engines = self._async_engines.setdefault(loop, {})
+            if key not in engines:
+                engine = create_async_engine(url, connect_args=connect_args, **pool_args(url))
+                stats = PoolStats()
+                configure_session_state(engine, schema, statement_timeout, read_only, stats)
+                engines[key] = (engine, stats)
+            return engines[key][0]
+
+    async def adispose_async_engines(
+        self,
+    ) -> None:
+        """Dispose the async engines of the running event loop."""
+        with self._lock:
+            engines = self._async_engines.pop(asyncio.get_running_loop(), {})
+        for engine, _ in engines.values():
+            await engine.dispose()
+
+    def dispose(
+        self,
+    ) -> None:
+        """Close the connections of all sync engines, they reconnect on next use."""
+        with self._lock:
+            engines = [engine for engine, _ in self._engines.values()]
+        for engine in engines:
+            engine.dispose()
+
+    def stats(
+        self,
+    ) -> Dict[str, Any]:
+        with self._lock:
+            engines = [(key[1], engine, s, "") for key, (engine, s) in self._engines.items()] + [
+                (key[1], engine.sync_engine, s, ":async")
+                for loop_engines in self._async_engines.values()
+                for key, (engine, s) in loop_engines.items()
+            ]
+        stats: Dict[str, Any] = {}
+        for schema, engine, pool_stats, suffix in engines:
+            pool = engine.pool
+            name = f"{engine.dialect.name}:{schema or 'default'}{suffix}"
+            entry = stats.setdefault(name, {"engines": 0, "connects": 0, "checkouts": 0, "invalidations": 0})
+            entry["engines"] += 1
+            entry["connects"] += pool_stats.connects
+            entry["checkouts"] += pool_stats.checkouts
+            entry["invalidations"] += pool_stats.invalidations
+            for gauge in ("size", "checkedin", "checkedout", "overflow"):
+                if hasattr(pool, gauge):
+                    entry[gauge] = entry.get(gauge, 0) + getattr(pool, gauge)()
+        return stats
+
+
+sql_engine_pools = SQLEnginePools()
+if settings.SQL_TOOL_DB_POOL_METRICS:
+    metrics.register("sql_tool_db_pools", sql_engine_pools.stats)
@@ -0,0 +1,496 @@
+# -*- coding: utf-8 -*-
+"""
+Cache of SQL query results, shared by the `/sql/execute` endpoint and the SQL tool.
+
+Results are keyed by the normalized query (`normalize_sql`) and a fingerprint of the database and its schema
+(`schema_fingerprint`), so that cached results are dropped when the schema changes. There are two tiers:
+1. A size-bounded LRU of decoded results in each worker process (SQL_RESULT_CACHE_SIZE), whose entries live at most
+   SQL_RESULT_CACHE_LOCAL_TTL seconds.
+2. Redis, shared by all workers: zlib-compressed JSON, with type tags for the values JSON has no type for (decimals,
+   dates, bytes, ...).
+
+The TTL of a result is the smallest TTL of the tables the query references (SQL_RESULT_CACHE_TABLE_TTLS, defaulting to
+SQL_RESULT_CACHE_TTL), a TTL of 0 disables caching for a table. Queries that reference no known table (e.g.
+`SELECT now()`) are not cached. Call `ainvalidate` (or `POST /sql/cache/invalidate`)
+when the data of tables changes, the local tier of other workers may serve their results up to
+SQL_RESULT_CACHE_LOCAL_TTL seconds longer.
+"""
+import asyncio
+import base64
+import datetime
+import decimal
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+import weakref
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from app.api.deps import get_redis_client_binary
+from app.core.config import settings
+from app.db.SQLDatabaseExtended import SampledResult, SQLDatabaseExtended
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SQL_RESULT_NAMESPACE = "sql_result"
+
+_LITERALS = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+_COMMENTS = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_PUNCTUATION_SPACES = re.compile(r"\s*([(),=])\s*")
+_IDENTIFIERS = re.compile(r"[\w$]+(?:\.[\w$]+)*")
+
+
+def normalize_sql(
+    query: str,
+) -> str:
+    """
+    Normalize a SQL query for the cache key: comments and redundant whitespace are removed and everything outside of
+    quoted literals and identifiers is lowercased, so that queries only differing in formatting share their results.
+    """
+    parts = _LITERALS.split(query)
+    for i in range(0, len(parts), 2):
+        code = " ".join(_COMMENTS.sub(" ", parts[i]).lower().split())
+        parts[i] = _PUNCTUATION_SPACES.sub(r"\1", code)
+    normalized = "".join(parts).strip()
+    while normalized.endswith(";"):
+        normalized = normalized[:-1].rstrip()
+    return normalized
+
+
+def referenced_tables(
+    normalized_query: str,
+    table_names: Iterable[str],
+) -> FrozenSet[str]:
+    """The tables (`schema.table` names, lowercase) of `table_names` a normalized query references."""
+    identifiers = set()
+    for i, part in enumerate(_LITERALS.split(normalized_query)):
+        if i % 2 == 0:
+            identifiers.update(_IDENTIFIERS.findall(part))
+        elif part.startswith('"'):
+            identifiers.add(part[1:-1].replace('""', '"').lower())
+    bare_identifiers = {identifier.rsplit(".", 1)[-1] for identifier in identifiers}
+    tables = set()
+    for name in table_names:
+        name = name.lower()
+        if name in identifiers or name.rsplit(".", 1)[-1] in bare_identifiers:
+            tables.add(name)
+    return frozenset(tables)
+
+
+def schema_fingerprint(
+    db: SQLDatabaseExtended,
+) -> str:
+    """Digest of the database URL, its schema and the structure of its tables."""
+    digest = hashlib.sha256()
+    engine = getattr(db, "_engine", None)
+    if engine is not None:
+        digest.update(engine.url.render_as_string(hide_password=True).encode("utf-8"))
+    digest.update(f"\0{getattr(db, '_schema', None)}\0".encode("utf-8"))
+    db_info = getattr(db, "db_info", None)
+    for table in sorted(db_info.tables if db_info is not None else [], key=lambda t: t.name):
+        digest.update(f"{table.name}\0{table.structure}\0".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def _encode_value(
+    value: Any,
+) -> Any:
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, decimal.Decimal):
+        return {"$type": "decimal", "value": str(value)}
+    if isinstance(value, datetime.datetime):
+        return {"$type": "datetime", "value": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {"$type": "date", "value": value.isoformat()}
+    if isinstance(value, datetime.time):
+        return {"$type": "time", "value": value.isoformat()}
+    if isinstance(value, datetime.timedelta):
+        return {"$type": "timedelta", "value": value.total_seconds()}
+    if isinstance(value, uuid.UUID):
+        return {"$type": "uuid", "value": str(value)}
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"$type": "bytes", "value": base64.b64encode(bytes(value)).decode("ascii")}
+    if isinstance(value, (list, tuple)):
+        return [_encode_value(v) for v in value]
+    if isinstance(value, dict):
+        return {"$type": "dict", "value": {str(k): _encode_value(v) for k, v in value.items()}}
+    return str(value)
+
+
+_DECODERS: Dict[str, Callable[[Any], Any]] = {
+    "decimal": decimal.Decimal,
+    "datetime": datetime.datetime.fromisoformat,
+    "date": datetime.date.fromisoformat,
+    "time": datetime.time.fromisoformat,
+    "timedelta": lambda seconds: datetime.timedelta(seconds=seconds),
+    "uuid": uuid.UUID,
+    "bytes": base64.b64decode,
+}
+
+
+def _decode_value(
+    value: Any,
+) -> Any:
+    if isinstance(value, list):
+        return [_decode_value(v) for v in value]
+    if isinstance(value, dict):
+        if value["$type"] == "dict":
+            return {k: _decode_value(v) for k, v in value["value"].items()}
+        return _DECODERS[value["$type"]](value["value"])
+    return value
+
+
+def encode_result(
+    columns: List[str],
+    rows: List[Any],
+    total_rows: Optional[int] = None,
+    total_capped: bool = False,
+) -> bytes:
+    """Compressed, type-tagged JSON payload of a query result."""
+    payload = {
+        "columns": list(columns),
+        "rows": [[_encode_value(value) for value in row] for row in rows],
+        "total_rows": total_rows,
+        "total_capped": total_capped,
+    }
+    return zlib.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+
+
+def decode_result(
+    data: bytes,
+) -> Dict[str, Any]:
+    """Decode a payload of `encode_result`, rows are returned as tuples."""
+    payload = json.loads(zlib.decompress(data))
+    payload["rows"] = [tuple(_decode_value(value) for value in row) for row in payload["rows"]]
+    return payload
+
+
+@dataclass
+class _CachedResult:
+    value: Any
+    tables: FrozenSet[str]
+    expires_at: float
+
+
+class SQLResultCache:
+    """Two-tier (in-process LRU and redis) cache of query results, see the module docstring."""
+
+    def __init__(
+        self,
+        max_size: int,
+        local_ttl: float,
+        ttl: int,
+        table_ttls: Optional[Dict[str, int]] = None,
+        max_rows: int = 10_000,
+        namespace: str = SQL_RESULT_NAMESPACE,
+        use_redis: bool = True,
+    ) -> None:
+        """
+        Args:
+            max_size (int): Maximum number of results kept in process, 0 disables the in-process tier.
+            local_ttl (float): Maximum seconds a result is kept in process.
+            ttl (int): Seconds results are cached by default.
+            table_ttls (Optional[Dict[str, int]]): Seconds the results of queries on a table (`schema.table` or
+                `table`) are cached, 0 disables caching.
+            max_rows (int): Results with more rows are not cached.
+            namespace (str): Prefix of the redis keys.
+            use_redis (bool): Whether results are shared through redis.
+        """
+        self.max_size = max_size
+        self.local_ttl = local_ttl
+        self.ttl = ttl
+        self.table_ttls = {name.lower(): table_ttl for name, table_ttl in (table_ttls or {}).items()}
+        self.max_rows = max_rows
+        self.namespace = namespace
+        self.use_redis = use_redis
+        self._results: OrderedDict[str, _CachedResult] = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._fingerprints: weakref.WeakKeyDictionary[
+            SQLDatabaseExtended, Tuple[Any, str]
+        ] = weakref.WeakKeyDictionary()
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.shared = 0
+        self.misses = 0
+        self.uncacheable = 0
+        self.invalidations = 0
+
+    def _fingerprint(
+        self,
+        db: SQLDatabaseExtended,
+    ) -> str:
+        db_info = getattr(db, "db_info", None)
+        cached = self._fingerprints.get(db)
+        if cached is None or cached[0] is not db_info:
+            cached = (db_info, schema_fingerprint(db))
+            self._fingerprints[db] = cached
+        return cached[1]
+
+    def _entry_ttl(
+        self,
+        tables: FrozenSet[str],
+    ) -> int:
+        """The TTL of the results of a query on the tables, 0 (not cached) if it references no known table."""
+        if not tables:
+            return 0
+        ttls = [self.table_ttls.get(t, self.table_ttls.get(t.rsplit(".", 1)[-1], self.ttl)) for t in tables]
+        return min(ttls)
+
+    def _key(
+        self,
+        db: SQLDatabaseExtended,
+        kind: str,
+        normalized_query: str,
+    ) -> str:
+        digest = hashlib.sha256(normalized_query.encode("utf-8")).hexdigest()
+        return f"{self.namespace}:{self._fingerprint(db)}:{kind}:{digest}"
+
+    def _get_local(
+        self,
+        key: str,
+    ) -> Optional[_CachedResult]:
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is None:
+                return None
+            if time.monotonic() >= cached.expires_at:
+                del self._results[key]
+                return None
+            self._results.move_to_end(key)
+            return cached
+
+    def _set_local(
+        self,
+        key: str,
+        value: Any,
+        tables: FrozenSet[str],
+        ttl: float,
+    ) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._results[key] = _CachedResult(value, tables, time.monotonic() + min(ttl, self.local_ttl))
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+
+    async def _aget_redis(
+        self,
+        key: str,
+    ) -> Optional[bytes]:
+        if not self.use_redis:
+            return None
+        try:
+            redis_client = await get_redis_client_binary()
+            return await redis_client.get(key)
+        except Exception as e:
+            logger.warning(f"SQL result cache lookup failed: {e!r}")
+            return None
+
+    async def _aset_redis(
+        self,
+        key: str,
+        payload: bytes,
+        tables: FrozenSet[str],
+        ttl: int,
+    ) -> None:
+        if not self.use_redis:
+            return
+        try:
+            redis_client = await get_redis_client_binary()
+            max_ttl = max([self.ttl, *self.table_ttls.values()])
+            async with redis_client.pipeline(transaction=False) as pipeline:
+                pipeline.set(key, payload, ex=ttl)
+                for table in tables:  # the keys of a table, for `ainvalidate`
+                    pipeline.sadd(f"{self.namespace}:table:{table}", key)
+                    pipeline.expire(f"{self.namespace}:table:{table}", max_ttl)
+                await pipeline.execute()
+        except Exception as e:
+            logger.warning(f"SQL result cache update failed: {e!r}")
+
+    async def _aget_or_run(
+        self,
+        db: SQLDatabaseExtended,
+        kind: str,
+        command: str,
+        run: Callable[[], Awaitable[Any]],
+        encode: Callable[[Any], Optional[bytes]],
+        decode: Callable[[bytes], Any],
+    ) -> Any:
+        normalized_query = normalize_sql(command)
+        db_info = getattr(db, "db_info", None)
+        tables = referenced_tables(normalized_query, [t.name for t in db_info.tables] if db_info is not None else [])
+        ttl = self._entry_ttl(tables)
+        if ttl <= 0:
+            self.uncacheable += 1
+            return await run()
+
+        key = self._key(db, kind, normalized_query)
+        cached = self._get_local(key)
+        if cached is not None:
+            self.local_hits += 1
+            return cached.value
+
+        # identical queries in flight on this event loop share the execution (or redis lookup)
+        inflight = self._inflight.get(key)
+        if inflight is not None and inflight.get_loop() is asyncio.get_running_loop():
+            self.shared += 1
+            # unlike awaiting it, waiting for the shared execution does not cancel it when this task is cancelled
+            await asyncio.wait({inflight})
+            if inflight.cancelled():  # cancelled with the request that ran it, run it in this one
+                return await self._aget_or_run(db, kind, command, run, encode, decode)
+            return inflight.result()
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            payload = await self._aget_redis(key)
+            if payload is not None:
+                self.redis_hits += 1
+                value = decode(payload)
+                self._set_local(key, value, tables, ttl)
+            else:
+                self.misses += 1
+                value = await run()
+                payload = encode(value)
+                if payload is None:
+                    self.uncacheable += 1
+                else:
+                    self._set_local(key, value, tables, ttl)
+                    await self._aset_redis(key, payload, tables, ttl)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # retrieved, waiters re-raise it
+            raise
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    async def aexecute(
+        self,
+        db: SQLDatabaseExtended,
+        command: str,
+        timeout: Optional[float] = None,
+    ) -> Tuple[List[str], List[Any]]:
+        """Cached `SQLDatabaseExtended.aexecute`, rows are tuples."""
+
+        def encode(result: Tuple[List[str], List[Any]]) -> Optional[bytes]:
+            columns, rows = result
+            return encode_result(columns, rows) if len(rows) <= self.max_rows else None
+
+        def decode(data: bytes) -> Tuple[List[str], List[Any]]:
+            payload = decode_result(data)
+            return payload["columns"], payload["rows"]
+
+        async def run() -> Tuple[List[str], List[Any]]:
+            columns, rows = await db.aexecute(command, timeout)
+            return columns, [tuple(row) for row in rows]
+
+        return await self._aget_or_run(db, "execute", command, run, encode, decode)
+
+    async def asample(
+        self,
+        db: SQLDatabaseExtended,
+        command: str,
+        nb_rows: int,
+        count_cap: Optional[int] = None,
+        timeout: Optional[float] = None,
+    ) -> Optional[SampledResult]:
+        """Cached `SQLDatabaseExtended.asample`, rows are tuples. Statements returning no rows are not cached."""
+
+        def encode(result: Optional[SampledResult]) -> Optional[bytes]:
+            if result is None:
+                return None
+            return encode_result(result.columns, result.rows, result.total_rows, result.total_capped)
+
+        def decode(data: bytes) -> SampledResult:
+            payload = decode_result(data)
+            return SampledResult(payload["columns"], payload["rows"], payload["total_rows"], payload["total_capped"])
+
+        async def run() -> Optional[SampledResult]:
+            result = await db.asample(command, nb_rows, count_cap, timeout)
+            if result is not None:
+                result.rows = [tuple(row) for row in result.rows]
+            return result
+
+        kind = f"sample:{nb_rows}:{db.count_cap if count_cap is None else count_cap}"
+        return await self._aget_or_run(db, kind, command, run, encode, decode)
+
+    async def ainvalidate(
+        self,
+        tables: Optional[Iterable[str]] = None,
+    ) -> None:
+        """
+        Drop the cached results of queries on `tables` (`schema.table` names), or all cached results.
+
+        Call it after the data of tables changes (e.g. at the end of an ETL job).
+        """
+        self.invalidations += 1
+        table_set = None if tables is None else {table.lower() for table in tables}
+        with self._lock:
+            if table_set is None:
+                self._results.clear()
+            else:
+                for key in [k for k, cached in self._results.items() if cached.tables & table_set]:
+                    del self._results[key]
+        if not self.use_redis:
+            return
+        try:
+            redis_client = await get_redis_client_binary()
+            if table_set is None:
+                keys = [key async for key in redis_client.scan_iter(match=f"{self.namespace}:*")]
+            else:
+                keys = []
+                for table in table_set:
+                    table_key = f"{self.namespace}:table:{table}"
+                    keys.extend([table_key, *await redis_client.smembers(table_key)])
+            if keys:
+                await redis_client.delete(*keys)
+        except Exception as e:
+            logger.warning(f"SQL result cache invalidation failed: {e!r}")
+
+    def clear(
+        self,
+    ) -> None:
+        """Drop the in-process tier."""
+        with self._lock:
+            self._results.clear()
+
+    def stats(
+        self,
+    ) -> Dict[str, Any]:
+        lookups = self.local_hits + self.redis_hits + self.shared + self.misses
+        return {
+            "size": len(self._results),
+            "max_size": self.max_size,
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "shared": self.shared,
+            "misses": self.misses,
+            "uncacheable": self.uncacheable,
+            "invalidations": self.invalidations,
+            "hit_rate": (self.local_hits + self.redis_hits + self.shared) / lookups if lookups else 0.0,
+        }
+
+
+sql_result_cache = SQLResultCache(
+    max_size=settings.SQL_RESULT_CACHE_SIZE,
+    local_ttl=settings.SQL_RESULT_CACHE_LOCAL_TTL,
+    ttl=settings.SQL_RESULT_CACHE_TTL if settings.SQL_RESULT_CACHE_ENABLED else 0,
+    table_ttls=settings.SQL_RESULT_CACHE_TABLE_TTLS if settings.SQL_RESULT_CACHE_ENABLED else None,
+    max_rows=settings.SQL_RESULT_CACHE_MAX_ROWS,
+)
+metrics.register("sql_result_cache", sql_result_cache.stats)
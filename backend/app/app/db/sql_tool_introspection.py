@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+Schema introspection of the SQL tool database.
+
+The schema information of the SQL tool (`DatabaseInfo`: the `CREATE TABLE` statement and sample rows of each table)
+is kept in a snapshot at SQL_TOOL_DB_INFO_PATH. Workers load the snapshot lazily on first access and reload it when
+it changes (`DBInfoSnapshot`), they never introspect the database on import.
+
+On start up (`SQLToolIntrospection.start`, in the `lifespan` hook) the snapshot is refreshed in the background, by
+one worker process at a time (file lock):
+1. The columns of all tables of a schema are fingerprinted with a single catalog query per schema, schemas in
+   parallel (`table_fingerprints`).
+2. Tables whose fingerprint is unchanged since the snapshot are reused, the new and changed tables are inspected on a
+   thread pool (SQL_TOOL_DB_INTROSPECTION_THREADS), one table per task (`introspect_database`).
+
+Sample rows of unchanged tables are not refreshed. Delete the snapshot to inspect all tables again, with
+SQL_TOOL_DB_OVERWRITE_ON_START=false an existing snapshot is used as is.
+"""
+import asyncio
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.engine import Engine
+
+from app.core.config import settings
+from app.db.SQLDatabaseExtended import SQLDatabaseExtended
+from app.schemas.tool_schemas.sql_tool_schema import DatabaseInfo, TableInfo
+from app.utils.metrics import metrics
+from app.utils.startup_timing import startup_timings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class IntrospectionReport:
+    """Timings and table counts of a snapshot refresh."""
+
+    status: str = "pending"  # pending, running, refreshed, unchanged, skipped, loaded or failed
+    schemas: int = 0
+    tables: int = 0
+    reused: int = 0
+    inspected: int = 0
+    failed: int = 0
+    fingerprint_seconds: float = 0.0
+    inspect_seconds: float = 0.0
+    total_seconds: float = 0.0
+
+    def __str__(
+        self,
+    ) -> str:
+        return (
+            f"SQL tool schema introspection {self.status} in {self.total_seconds:.2f}s: {self.tables} tables in "
+            f"{self.schemas} schemas, {self.reused} reused, {self.inspected} inspected ({self.failed} failed), "
+            f"fingerprints {self.fingerprint_seconds:.2f}s, inspection {self.inspect_seconds:.2f}s"
+        )
+
+
+def table_fingerprints(
+    engine: Engine,
+    schema: str,
+) -> Dict[str, str]:
+    """Digest of the columns (names, types, nullability and defaults) of each table of a schema."""
+    columns_by_table = inspect(engine).get_multi_columns(schema=schema)
+    fingerprints = {}
+    for (_, table_name), columns in columns_by_table.items():
+        description = [
+            [column["name"], repr(column["type"]), column.get("nullable"), str(column.get("default"))]
+            for column in columns
+        ]
+        fingerprints[table_name] = hashlib.sha256(json.dumps(description).encode("utf-8")).hexdigest()[:16]
+    return fingerprints
+
+
+def _inspect_table(
+    engine: Engine,
+    schema_name: str,
+    table_name: str,
+    fingerprint: str,
+) -> Tuple[TableInfo, bool]:
+    try:
+        database = SQLDatabaseExtended(
+            engine,
+            schema=schema_name,
+            include_tables=[table_name],
+            lazy_table_reflection=True,
+        )
+        table_info = database.get_table_info_no_throw([table_name])
+        failed = False
+    except Exception as e:
+        logger.error(f"Failed to get table info for {table_name}: {e}")
+        table_info = f"Failed to get table info for {table_name}: {e}"
+        failed = True
+    return (
+        TableInfo(
+            schema_name=schema_name,
+            table_name=table_name,
+            structure=table_info,
+            fingerprint="" if failed else fingerprint,
+        ),
+        failed,
+    )
+
+
+def introspect_database(
+    engine: Engine,
+    schema_names: List[str],
+    previous: Optional[DatabaseInfo] = None,
+    max_workers: int = 8,
+) -> Tuple[DatabaseInfo, IntrospectionReport]:
+    """
+    Get the table information of multiple schemas, reusing the tables of `previous` whose columns did not change.
+
+    Args:
+        engine (Engine): The engine of the database.
+        schema_names (List[str]): The schemas.
+        previous (Optional[DatabaseInfo]): The table information of the previous introspection.
+        max_workers (int): The number of threads fingerprinting schemas and inspecting tables.
+    """
+    report = IntrospectionReport(status="running", schemas=len(schema_names))
+    start = time.perf_counter()
+    previous_tables = {(t.schema_name, t.table_name): t for t in previous.tables} if previous is not None else {}
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1), thread_name_prefix="sql_tool_introspection") as executor:
+        fingerprints_by_schema = dict(
+            zip(schema_names, executor.map(lambda schema: table_fingerprints(engine, schema), schema_names))
+        )
+        report.fingerprint_seconds = time.perf_counter() - start
+
+        tables: Dict[Tuple[str, str], Any] = {}
+        for schema_name in schema_names:
+            for table_name, fingerprint in sorted(fingerprints_by_schema[schema_name].items()):
+                previous_table = previous_tables.get((schema_name, table_name))
+                if previous_table is not None and previous_table.fingerprint == fingerprint:
+                    tables[(schema_name, table_name)] = previous_table
+                    report.reused += 1
+                else:
+                    tables[(schema_name, table_name)] = executor.submit(
+                        _inspect_table, engine, schema_name, table_name, fingerprint
+                    )
+        inspect_start = time.perf_counter()
+        for key, table in tables.items():
+            if not isinstance(table, TableInfo):
+                tables[key], failed = table.result()
+                report.inspected += 1
+                report.failed += int(failed)
+        report.inspect_seconds = time.perf_counter() - inspect_start
+
+    report.tables = len(tables)
+    report.total_seconds = time.perf_counter() - start
+    report.status = "refreshed" if report.inspected else "unchanged"
+    return DatabaseInfo(tables=list(tables.values())), report
+
+
+class DBInfoSnapshot:
+    """The `DatabaseInfo` snapshot file, loaded lazily and reloaded when the file changes."""
+
+    def __init__(
+        self,
+        path: str,
+    ) -> None:
+        self.path = path
+        self._db_info: Optional[DatabaseInfo] = None
+        self._mtime_ns: Optional[int] = None
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def load(
+        self,
+    ) -> Optional[DatabaseInfo]:
+        """The table information of the snapshot, None if there is no snapshot yet."""
+        try:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return self._db_info
+        if mtime_ns == self._mtime_ns:
+            return self._db_info
+        with self._lock:
+            if mtime_ns != self._mtime_ns:
+                try:
+                    with open(self.path, encoding="utf-8") as f:
+                        self._db_info = DatabaseInfo.model_validate_json(f.read())
+                    self.loads += 1
+                except (OSError, ValueError) as e:
+                    logger.error(f"Failed to load the SQL tool schema snapshot {self.path}: {e!r}")
+                self._mtime_ns = mtime_ns
+        return self._db_info
+
+    def write(
+        self,
+        db_info: DatabaseInfo,
+    ) -> None:
+        """Replace the snapshot atomically, readers never see a partially written file."""
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(db_info.model_dump_json(indent=4))
+        os.replace(tmp_path, self.path)
+
+    def refresh(
+        self,
+        database_uri: str,
+        schema_names: List[str],
+        overwrite: bool = True,
+        max_workers: int = 8,
+    ) -> IntrospectionReport:
+        """
+        Refresh the snapshot from the database, unless another process is refreshing it.
+
+        Args:
+            database_uri (str): The URI of the database.
+            schema_names (List[str]): The schemas to introspect.
+            overwrite (bool): Whether an existing snapshot is refreshed, else it is used as is.
+            max_workers (int): The number of threads fingerprinting schemas and inspecting tables.
+        """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(f"{self.path}.lock", "w", encoding="utf-8") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return IntrospectionReport(status="skipped")
+            try:
+                previous = self.load()
+                if previous is not None and not overwrite:
+                    return IntrospectionReport(status="loaded", tables=len(previous.tables))
+                engine = create_engine(database_uri, pool_size=max(max_workers, 5))
+                try:
+                    db_info, report = introspect_database(engine, schema_names, previous, max_workers)
+                finally:
+                    engine.dispose()
+                if report.status == "refreshed" or previous is None or len(db_info.tables) != len(previous.tables):
+                    self.write(db_info)
+                    report.status = "refreshed"
+                return report
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class SQLToolIntrospection:
+    """Refreshes the snapshot of the SQL tool database in the background of the event loop."""
+
+    def __init__(
+        self,
+        snapshot: DBInfoSnapshot,
+    ) -> None:
+        self.snapshot = snapshot
+        self.report = IntrospectionReport()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(
+        self,
+    ) -> None:
+        """Start refreshing the snapshot on a thread, the SQL tool uses the current snapshot meanwhile."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._arefresh())
+
+    async def _arefresh(
+        self,
+    ) -> IntrospectionReport:
+        self.report = IntrospectionReport(status="running")
+        try:
+            self.report = await asyncio.to_thread(
+                self.snapshot.refresh,
+                settings.SQL_TOOL_DB_URI,
+                settings.SQL_TOOL_DB_SCHEMAS,
+                settings.SQL_TOOL_DB_OVERWRITE_ON_START,
+                settings.SQL_TOOL_DB_INTROSPECTION_THREADS,
+            )
+            logger.info(str(self.report))
+        except Exception as e:
+            self.report.status = "failed"
+            logger.error(f"SQL tool schema introspection failed: {e!r}")
+        startup_timings.record("sql_tool_introspection", self.report.total_seconds)
+        return self.report
+
+    async def await_refresh(
+        self,
+    ) -> IntrospectionReport:
+        """Wait for the refresh started by `start`."""
+        if self._task is not None:
+            await asyncio.shield(self._task)
+        return self.report
+
+    async def aclose(
+        self,
+    ) -> None:
+        """Stop waiting for the refresh, the thread finishes on its own."""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    def stats(
+        self,
+    ) -> Dict[str, Any]:
+        return {**asdict(self.report), "snapshot_loads": self.snapshot.loads}
+
+
+db_info_snapshot = DBInfoSnapshot(settings.SQL_TOOL_DB_INFO_PATH)
+sql_tool_introspection = SQLToolIntrospection(db_info_snapshot)
+metrics.register("sql_tool_introspection", sql_tool_introspection.stats)
@@ -23,6 +23,9 @@ async def set_global_tool_context() -> None:
 def get_meta_agent(
     api_key: Optional[str] = None,
 ) -> AgentExecutor:
-    agent_config = get_agent_config()
-    agent_config.api_key = api_key
-    return create_meta_agent(agent_config)
+    agent_config = get_agent_config().copy(update={"api_key": api_key})
+    query_context = g.query_context or {}
+    return create_meta_agent(
+        agent_config,
+        run_id=query_context.get("run_id"),
+    )
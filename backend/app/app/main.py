@@ -4,7 +4,7 @@ import logging
 from contextlib import asynccontextmanager
 from typing import AsyncGenerator, Dict
 
-from fastapi import FastAPI, HTTPException, Request, status
+from fastapi import FastAPI, Request, status
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 from fastapi_async_sqlalchemy import SQLAlchemyMiddleware
@@ -12,90 +12,71 @@ from fastapi_cache import FastAPICache
 from fastapi_cache.backends.redis import RedisBackend
 from fastapi_limiter import FastAPILimiter
 from fastapi_pagination import add_pagination
-from jose import jwt
 from langchain.cache import RedisCache
 from langchain.globals import set_llm_cache
-from pydantic import ValidationError
 from starlette.middleware.cors import CORSMiddleware
 
-from app.api.deps import get_redis_client, get_redis_client_sync
+from app.api.deps import get_redis_client, get_redis_client_sync, user_id_identifier
 from app.api.v1.api import api_router as api_router_v1
 from app.core.config import settings, yaml_configs
 from app.core.fastapi import FastAPIWithInternalModels
+from app.db.session import sql_tool_db
+from app.db.sql_tool_introspection import sql_tool_introspection
+from app.services.chat_agent.helpers.llm import aclose_llm_clients
+from app.services.chat_agent.helpers.run_helper import run_cancellation_listener
+from app.services.chat_agent.helpers.tokenizer import tokenizer_service
+from app.services.chat_agent.tools.tools import clear_tool_registry, init_tool_registry
 from app.utils.config_loader import load_agent_config, load_ingestion_configs
 from app.utils.fastapi_globals import GlobalsMiddleware, g
-
-
-async def user_id_identifier(request: Request) -> str:
-    """Identify the user from the request."""
-    if request.scope["type"] == "http":
-        # Retrieve the Authorization header from the request
-        auth_header = request.headers.get("Authorization")
-
-        if auth_header is not None:
-            # Check that the header is in the correct format
-            header_parts = auth_header.split()
-            if len(header_parts) == 2 and header_parts[0].lower() == "bearer":
-                token = header_parts[1]
-                try:
-                    payload = jwt.decode(
-                        token,
-                        settings.SECRET_KEY,
-                        algorithms=["HS256"],
-                    )
-                except (
-                    jwt.JWTError,
-                    ValidationError,
-                ):
-                    raise HTTPException(
-                        status_code=status.HTTP_403_FORBIDDEN,
-                        detail="Could not validate credentials",
-                    )
-                user_id = payload["sub"]
-                print(
-                    "here2",
-                    user_id,
-                )
-                return user_id
-
-    if request.scope["type"] == "websocket":
-        return request.scope["path"]
-
-    forwarded = request.headers.get("X-Forwarded-For")
-    if forwarded:
-        return forwarded.split(",")[0]
-
-    ip = request.client.host if request.client else ""
-    return ip + ":" + request.scope["path"]
+from app.utils.redis_pool import redis_pools
+from app.utils.startup_timing import startup_timings
 
 
 @asynccontextmanager
 async def lifespan(_app: FastAPI) -> AsyncGenerator[None, None]:
     """Start up and shutdown tasks."""
     # startup
-    yaml_configs["agent_config"] = load_agent_config()
-    yaml_configs["ingestion_config"] = load_ingestion_configs()
-
-    redis_client = await get_redis_client()
-
-    if settings.ENABLE_LLM_CACHE:
-        set_llm_cache(RedisCache(redis_=get_redis_client_sync()))
-
-    FastAPICache.init(
-        RedisBackend(redis_client),
-        prefix="fastapi-cache",
-    )
-    await FastAPILimiter.init(
-        redis_client,
-        identifier=user_id_identifier,
-    )
+    with startup_timings.measure("configs"):
+        yaml_configs["agent_config"] = load_agent_config()
+        yaml_configs["ingestion_config"] = load_ingestion_configs()
+    with startup_timings.measure("tool_registry"):
+        init_tool_registry(yaml_configs["agent_config"])
+
+    with startup_timings.measure("redis"):
+        redis_pools.open()
+        redis_client = await get_redis_client()
+
+        if settings.ENABLE_LLM_CACHE:
+            set_llm_cache(RedisCache(redis_=get_redis_client_sync()))
+
+        FastAPICache.init(
+            RedisBackend(redis_client),
+            prefix="fastapi-cache",
+        )
+        await FastAPILimiter.init(
+            redis_client,
+            identifier=user_id_identifier,
+        )
+
+    run_cancellation_listener.start()
+    if sql_tool_db is not None:
+        sql_tool_introspection.start()
 
     logging.info("Start up FastAPI [Full dev mode]")
+    logging.info(startup_timings.report())
     yield
 
     # shutdown
     await FastAPICache.clear()
     await FastAPILimiter.close()
+    await run_cancellation_listener.aclose()
+    await sql_tool_introspection.aclose()
+    await redis_pools.aclose()
+    if sql_tool_db is not None:
+        await sql_tool_db.aclose()
+    clear_tool_registry()
+    await aclose_llm_clients()
+    tokenizer_service.shutdown()
     g.cleanup()
     gc.collect()
     yaml_configs.clear()
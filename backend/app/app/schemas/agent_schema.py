@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 from typing import Dict, Optional
 
-from pydantic.v1 import BaseModel  # TODO: Remove this line when langchain upgrades to pydantic v2
+from pydantic.v1 import BaseModel, root_validator  # TODO: Remove this line when langchain upgrades to pydantic v2
 
 from app.schemas.tool_schema import LLMType, ToolsLibrary
 
@@ -10,6 +10,25 @@ class ActionPlan(BaseModel):
     name: str
     description: str
     actions: list[list[str]]
+    # tool -> tools of earlier steps whose outputs it consumes, by default a tool consumes all tools of the
+    # previous step ("memory" is not a tool run, it can neither depend nor be depended on)
+    dependencies: Dict[str, list[str]] = {}
+
+    @root_validator(skip_on_failure=True)
+    def check_dependencies(
+        cls,
+        values: dict,
+    ) -> dict:
+        if "memory" in values["dependencies"] or any("memory" in d for d in values["dependencies"].values()):
+            raise ValueError("memory is not a tool run, it cannot be used in the dependencies of an action plan")
+        earlier_tools: set[str] = set()
+        for step in values["actions"]:
+            for tool in step:
+                unknown = set(values["dependencies"].get(tool, [])) - earlier_tools
+                if unknown:
+                    raise ValueError(f"{tool} depends on {sorted(unknown)}, which do not run in an earlier step")
+            earlier_tools.update(step)
+        return values
 
 
 class ActionPlans(BaseModel):
@@ -18,6 +18,7 @@ class StreamingSignalsEnum(Enum):
     END = "END"
     TOOL_END = "TOOL_END"
     LLM_END = "LLM_END"
+    QUEUED = "QUEUED"
 
 
 class StreamingData(BaseModel):
@@ -38,6 +38,16 @@ class SqlToolConfig(ToolConfig):
     validate_empty_results: bool
     validate_with_llm: bool
     always_limit_query: bool
+    table_index_enabled: bool = False
+    table_index_top_k: int = 5
+    table_index_rerank_margin: float = 0.0
+    table_index_embedding_model: Optional[str] = None
+    schema_token_budget: int = 0
+    prompt_rerank: Optional[str] = None
+    cost_guard_max_rows: Optional[float] = None
+    cost_guard_max_cost: Optional[float] = None
+    cost_guard_action: Literal["reject", "limit", "refine"] = "refine"
+    cost_guard_limit: int = 1000
 
 
 class ToolsLibrary(BaseModel):
@@ -1,10 +1,177 @@
 # -*- coding: utf-8 -*-
-from typing import Any, List
+import re
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 from app.schemas.common_schema import QueryBase
 
+TokenCounter = Callable[[List[str]], List[int]]  # token counts of a batch of texts
+
+_CONSTRAINT_NAME = re.compile(r'^CONSTRAINT\s+("[^"]*"|\S+)\s+', re.IGNORECASE)
+_CONSTRAINT_KEYWORDS = ("constraint", "primary key", "foreign key", "unique", "check")
+_KEY_COLUMNS = re.compile(r"KEY\s*\(([^)]*)\)", re.IGNORECASE)
+_WORDS = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+
+
+def _identifier(
+    text: str,
+) -> str:
+    return text.strip().strip('`"[]')
+
+
+def _words(
+    text: str,
+) -> List[str]:
+    """Lowercase words of a text or identifier, split at camel case and underscores."""
+    return [w.lower() for w in _WORDS.findall(text) if len(w) > 2]
+
+
+@dataclass
+class TableSnippet:
+    """
+    Compact rendering of a table structure (as rendered by langchain: a `CREATE TABLE` statement and sample rows).
+
+    The parts of the snippet have their own token counts, so that `render` can prune columns and sample rows to fit a
+    token budget without tokenizing again. Structures that cannot be parsed are rendered verbatim.
+    """
+
+    name: str
+    table: str = ""
+    columns: List[str] = field(default_factory=list)  # column names
+    definitions: List[str] = field(default_factory=list)  # column definitions
+    constraints: List[str] = field(default_factory=list)
+    key_columns: List[str] = field(default_factory=list)  # columns of primary and foreign keys
+    sample_title: str = ""
+    sample_columns: List[str] = field(default_factory=list)
+    sample_rows: List[List[str]] = field(default_factory=list)
+    raw: Optional[str] = None
+    base_tokens: Optional[int] = None
+    column_tokens: List[int] = field(default_factory=list)
+    sample_tokens: int = 0
+
+    @classmethod
+    def parse(
+        cls,
+        name: str,
+        structure: str,
+    ) -> "TableSnippet":
+        start = structure.find("(")
+        end = structure.find("\n)", start)
+        if not structure.lstrip().upper().startswith("CREATE TABLE") or start == -1 or end == -1:
+            return cls(name=name, raw=" ".join(structure.split()))
+        snippet = cls(name=name, table=" ".join(structure[:start].split()[2:]))
+        for line in structure[start + 1 : end].split("\n"):
+            line = " ".join(line.split()).rstrip(",")
+            if not line:
+                continue
+            if line.lower().startswith(_CONSTRAINT_KEYWORDS):
+                constraint = _CONSTRAINT_NAME.sub("", line)
+                snippet.constraints.append(constraint)
+                for columns in _KEY_COLUMNS.findall(constraint.split("REFERENCES")[0]):
+                    snippet.key_columns.extend(_identifier(c) for c in columns.split(","))
+            else:
+                snippet.columns.append(_identifier(line.split(" ", 1)[0]))
+                snippet.definitions.append(line)
+
+        sample = structure[end + 2 :].strip()
+        if sample.startswith("/*") and sample.endswith("*/"):
+            lines = [line for line in sample[2:-2].strip().split("\n") if line.strip()]
+            if len(lines) >= 2:
+                snippet.sample_title = lines[0].strip()
+                snippet.sample_columns = lines[1].split("\t")
+                snippet.sample_rows = [line.split("\t") for line in lines[2:]]
+        return snippet
+
+    def count_tokens(
+        self,
+        count_tokens: TokenCounter,
+    ) -> None:
+        """Count the tokens of the parts of the snippet, once."""
+        if self.base_tokens is not None:
+            return
+        if self.raw is not None:
+            self.base_tokens = count_tokens([self.render()])[0]
+            return
+        counts = count_tokens([self._render(set(), False), self._render_sample(self.columns), *self.definitions])
+        self.base_tokens, self.sample_tokens, self.column_tokens = counts[0], counts[1], counts[2:]
+
+    def tokens(
+        self,
+        columns: Optional[Iterable[str]] = None,
+        sample_rows: bool = True,
+    ) -> int:
+        """The (approximate) number of tokens of `render(columns, sample_rows)`, see `count_tokens`."""
+        if self.base_tokens is None:
+            raise ValueError("The tokens of the snippet are not counted")
+        kept = self._kept(columns)
+        tokens = self.base_tokens + sum(t for c, t in zip(self.columns, self.column_tokens) if c in kept)
+        if sample_rows and self.sample_rows and self.columns:
+            tokens += self.sample_tokens * len(kept) // len(self.columns)
+        return tokens
+
+    def relevant_columns(
+        self,
+        question: str,
+    ) -> List[str]:
+        """The key columns and the columns sharing a word with the question."""
+        question_words = set(_words(question))
+        return [
+            c
+            for c in self.columns
+            if c in self.key_columns
+            or any(w in question_words or any(q.startswith(w) for q in question_words) for w in _words(c))
+        ]
+
+    def _kept(
+        self,
+        columns: Optional[Iterable[str]],
+    ) -> set:
+        return set(self.columns) if columns is None else set(columns) | set(self.key_columns)
+
+    def _render_sample(
+        self,
+        columns: Iterable[str],
+    ) -> str:
+        kept = set(columns)
+        indices = [i for i, c in enumerate(self.sample_columns) if c in kept]
+        if not self.sample_rows or not indices:
+            return ""
+        rows = [self.sample_columns, *self.sample_rows]
+        lines = ["\t".join(row[i] for i in indices if i < len(row)) for row in rows]
+        return f" /* {self.sample_title} " + " | ".join(lines) + " */"
+
+    def render(
+        self,
+        columns: Optional[Iterable[str]] = None,
+        sample_rows: bool = True,
+    ) -> str:
+        """
+        Render the snippet.
+
+        Args:
+            columns (Optional[Iterable[str]]): The columns to render (key columns are always rendered), all if None.
+            sample_rows (bool): Whether the sample rows are rendered.
+        """
+        return self._render(self._kept(columns), sample_rows)
+
+    def _render(
+        self,
+        kept: set,
+        sample_rows: bool,
+    ) -> str:
+        if self.raw is not None:
+            structure = self.raw
+        else:
+            parts = [d for c, d in zip(self.columns, self.definitions) if c in kept] + self.constraints
+            if len(kept & set(self.columns)) < len(self.columns):
+                parts.append("...")
+            structure = f"CREATE TABLE {self.table} ({', '.join(parts)})"
+            if sample_rows:
+                structure += self._render_sample(kept)
+        return f"DB.TABLE name: {self.name}, Table structure: {structure}"
+
 
 class TableInfo(BaseModel):
     """Table information."""
@@ -12,6 +179,10 @@ class TableInfo(BaseModel):
     schema_name: str
     table_name: str
     structure: str
+    description: str = ""
+    fingerprint: str = ""  # digest of the columns when the structure was inspected, see `sql_tool_introspection`
+
+    _snippet: Optional[TableSnippet] = PrivateAttr(default=None)
 
     @property
     def name(
@@ -19,12 +190,98 @@ class TableInfo(BaseModel):
     ) -> str:
         return self.schema_name + "." + self.table_name
 
+    @property
+    def snippet(
+        self,
+    ) -> TableSnippet:
+        """The compact rendering of the table structure, parsed once."""
+        if self._snippet is None:
+            self._snippet = TableSnippet.parse(self.name, self.structure)
+        return self._snippet
+
 
 class DatabaseInfo(BaseModel):
     """Database information."""
 
     tables: List[TableInfo]
 
+    _tables_by_name: Optional[Dict[str, TableInfo]] = PrivateAttr(default=None)
+
+    def get_table(
+        self,
+        name: str,
+    ) -> Optional[TableInfo]:
+        """The table with a (case-insensitive) `schema.table` name."""
+        if self._tables_by_name is None:
+            self._tables_by_name = {table.name.lower(): table for table in self.tables}
+        return self._tables_by_name.get(name.strip().lower())
+
+    def get_tables(
+        self,
+        names: Iterable[str],
+    ) -> List[TableInfo]:
+        """The known tables of `names`, in order and without duplicates."""
+        tables: List[TableInfo] = []
+        for name in names:
+            table = self.get_table(name)
+            if table is not None and table not in tables:
+                tables.append(table)
+        return tables
+
+    def count_tokens(
+        self,
+        count_tokens: TokenCounter,
+    ) -> None:
+        """Count the tokens of the snippets of all tables ahead of `render_schemas` with a token budget."""
+        for table in self.tables:
+            table.snippet.count_tokens(count_tokens)
+
+    def render_schemas(
+        self,
+        names: Iterable[str],
+        token_budget: int = 0,
+        count_tokens: Optional[TokenCounter] = None,
+        question: str = "",
+    ) -> str:
+        """
+        Render the schemas of tables for a prompt, within a token budget.
+
+        Over budget, the tables are pruned from the last (least relevant) one: first their sample rows, then their
+        columns that are neither keys nor share a word with the question. Tables that still do not fit are dropped,
+        except the first one.
+
+        Args:
+            names (Iterable[str]): The names of the tables, the most relevant first.
+            token_budget (int): The maximum (approximate) number of tokens, 0 for no limit.
+            count_tokens (Optional[TokenCounter]): Counts the tokens of texts, required with a token budget.
+            question (str): The question the tables are selected for.
+        """
+        snippets = [table.snippet for table in self.get_tables(names)]
+        if token_budget <= 0 or not snippets:
+            return "\n".join(snippet.render() for snippet in snippets)
+        if count_tokens is None:
+            raise ValueError("count_tokens is required with a token budget")
+        for snippet in snippets:
+            snippet.count_tokens(count_tokens)
+
+        columns: List[Optional[List[str]]] = [None] * len(snippets)
+        sample_rows = [True] * len(snippets)
+
+        def total() -> int:
+            return sum(s.tokens(c, r) for s, c, r in zip(snippets, columns, sample_rows))
+
+        for i in reversed(range(len(snippets))):
+            if total() <= token_budget:
+                break
+            sample_rows[i] = False
+        for i in reversed(range(len(snippets))):
+            if total() <= token_budget:
+                break
+            columns[i] = snippets[i].relevant_columns(question)
+        while len(snippets) > 1 and total() > token_budget:
+            snippets, columns, sample_rows = snippets[:-1], columns[:-1], sample_rows[:-1]
+        return "\n".join(s.render(c, r) for s, c, r in zip(snippets, columns, sample_rows))
+
 
 class ExecutionResult(QueryBase):
     raw_result: List[
@@ -2,15 +2,24 @@
 # mypy: disable-error-code="call-arg"
 # TODO: Change langchain param names to match the new langchain version
 
+import hashlib
 import logging
-from typing import Optional
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
 
-import tiktoken
+import httpx
+import openai
 from langchain.base_language import BaseLanguageModel
 from langchain_openai import AzureChatOpenAI, ChatOpenAI
 
 from app.core.config import settings
 from app.schemas.tool_schema import LLMType
+from app.services.chat_agent.helpers.tokenizer import tokenizer_service
+from app.utils.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -20,43 +29,228 @@ def get_token_length(
     model: str = "gpt-4",
 ) -> int:
     """Get the token length of a string."""
-    enc = tiktoken.encoding_for_model(model)
-    encoded = enc.encode(string)
-    return len(encoded)
+    return tokenizer_service.count(string, model)
+
+
+LLMClientKey = Tuple[str, str, bool]
+
+
+@dataclass
+class _CachedLLMClient:
+    llm: BaseLanguageModel
+    default_key: bool
+    last_used: float
+
+
+class LLMClientCache:
+    """
+    Bounded LRU cache of LLM clients keyed by (LLMType, api key hash, streaming flag).
+
+    Clients built with the default API key are kept until they are pushed out by the size bound, clients for
+    user-provided API keys are also evicted once they have been idle for `idle_timeout` seconds.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        idle_timeout: float,
+    ) -> None:
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._clients: OrderedDict[LLMClientKey, _CachedLLMClient] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(
+        llm: LLMType,
+        api_key: str,
+        streaming: bool,
+    ) -> LLMClientKey:
+        """The cache key, API keys are only kept as a hash."""
+        return (
+            llm,
+            hashlib.sha256(api_key.encode("utf-8")).hexdigest(),
+            streaming,
+        )
+
+    def get_or_create(
+        self,
+        key: LLMClientKey,
+        factory: Callable[[], BaseLanguageModel],
+        default_key: bool = False,
+    ) -> BaseLanguageModel:
+        """Get the cached client for the key, or create and cache it with the factory."""
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            cached = self._clients.get(key)
+            if cached is not None:
+                self.hits += 1
+                cached.last_used = now
+                self._clients.move_to_end(key)
+                return cached.llm
+            self.misses += 1
+
+        # Build outside the lock, a concurrent miss for the same key builds twice but both clients are valid
+        llm = factory()
+        with self._lock:
+            self._clients[key] = _CachedLLMClient(llm=llm, default_key=default_key, last_used=now)
+            self._clients.move_to_end(key)
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+                self.evictions += 1
+        return llm
+
+    def _evict_idle(
+        self,
+        now: float,
+    ) -> None:
+        idle_keys = [k for k, c in self._clients.items() if not c.default_key and now - c.last_used > self.idle_timeout]
+        for k in idle_keys:
+            del self._clients[k]
+            self.evictions += 1
+
+    def clear(
+        self,
+    ) -> None:
+        with self._lock:
+            self._clients.clear()
+
+    def stats(
+        self,
+    ) -> Dict[str, Any]:
+        """Hit/miss counters and current size of the cache."""
+        with self._lock:
+            return {
+                "size": len(self._clients),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+llm_client_cache = LLMClientCache(
+    max_size=settings.LLM_CLIENT_CACHE_SIZE,
+    idle_timeout=settings.LLM_CLIENT_CACHE_IDLE_TIMEOUT,
+)
+metrics.register("llm_client_cache", llm_client_cache.stats)
+
+_sync_http_client: Optional[httpx.Client] = None
+_async_http_client: Optional[httpx.AsyncClient] = None
+_http_clients_lock = threading.Lock()
+
+
+def _http_client_args() -> Dict[str, Any]:
+    return {
+        "limits": httpx.Limits(
+            max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.LLM_HTTP_KEEPALIVE_EXPIRY,
+        ),
+        "timeout": httpx.Timeout(timeout=600.0, connect=5.0),
+        "follow_redirects": True,
+    }
+
+
+def _get_sync_http_client() -> httpx.Client:
+    """Process-wide httpx client, so all sync OpenAI clients share one keep-alive connection pool."""
+    global _sync_http_client  # pylint: disable=global-statement
+    with _http_clients_lock:
+        if _sync_http_client is None:
+            _sync_http_client = httpx.Client(**_http_client_args())
+        return _sync_http_client
+
+
+def _get_async_http_client() -> httpx.AsyncClient:
+    """Process-wide httpx client, so all async OpenAI clients share one keep-alive connection pool."""
+    global _async_http_client  # pylint: disable=global-statement
+    with _http_clients_lock:
+        if _async_http_client is None:
+            _async_http_client = httpx.AsyncClient(**_http_client_args())
+        return _async_http_client
+
+
+def _openai_clients(api_key: str) -> Dict[str, Any]:
+    """OpenAI clients for ChatOpenAI, with the same parameters ChatOpenAI would use but the shared pools."""
+    client_params: Dict[str, Any] = {
+        "api_key": api_key,
+        "organization": settings.OPENAI_ORGANIZATION or os.getenv("OPENAI_ORG_ID"),
+        "base_url": os.getenv("OPENAI_API_BASE"),
+        "max_retries": 2,
+    }
+    return {
+        "client": openai.OpenAI(**client_params, http_client=_get_sync_http_client()).chat.completions,
+        "async_client": openai.AsyncOpenAI(**client_params, http_client=_get_async_http_client()).chat.completions,
+    }
+
+
+async def aclose_llm_clients() -> None:
+    """Close the shared connection pools and drop all cached clients."""
+    global _sync_http_client, _async_http_client  # pylint: disable=global-statement
+    llm_client_cache.clear()
+    with _http_clients_lock:
+        sync_client, async_client = _sync_http_client, _async_http_client
+        _sync_http_client, _async_http_client = None, None
+    if sync_client is not None:
+        sync_client.close()
+    if async_client is not None:
+        await async_client.aclose()
 
 
 def get_llm(
     llm: LLMType,
     api_key: Optional[str] = settings.OPENAI_API_KEY,
+    streaming: bool = True,
+) -> BaseLanguageModel:
+    """Get the (cached) LLM instance for the given LLM type."""
+    api_key = api_key if api_key is not None else settings.OPENAI_API_KEY
+    return llm_client_cache.get_or_create(
+        LLMClientCache.make_key(llm, api_key, streaming),
+        lambda: _create_llm(llm, api_key, streaming),
+        default_key=api_key == settings.OPENAI_API_KEY,
+    )
+
+
+def _create_llm(
+    llm: LLMType,
+    api_key: str,
+    streaming: bool,
 ) -> BaseLanguageModel:
-    """Get the LLM instance for the given LLM type."""
+    """Create the LLM instance for the given LLM type."""
     match llm:
         case "azure-3.5":
             if settings.OPENAI_API_BASE is None:
                 raise ValueError("OPENAI_API_BASE must be set to use Azure LLM")
+            # the Azure client always builds its own OpenAI clients, so it keeps a pool per cached instance
             return AzureChatOpenAI(
                 openai_api_base=settings.OPENAI_API_BASE,
                 openai_api_version="2023-03-15-preview",
                 deployment_name="rnd-gpt-35-turbo",
-                openai_api_key=api_key if api_key is not None else settings.OPENAI_API_KEY,
+                openai_api_key=api_key,
                 openai_api_type="azure",
-                streaming=True,
+                streaming=streaming,
             )
         case "gpt-3.5-turbo":
             return ChatOpenAI(
                 temperature=0,
                 model_name="gpt-3.5-turbo",
                 openai_organization=settings.OPENAI_ORGANIZATION,
-                openai_api_key=api_key if api_key is not None else settings.OPENAI_API_KEY,
-                streaming=True,
+                openai_api_key=api_key,
+                streaming=streaming,
+                **_openai_clients(api_key),
             )
         case "gpt-4":
             return ChatOpenAI(
                 temperature=0,
                 model_name="gpt-4",
                 openai_organization=settings.OPENAI_ORGANIZATION,
-                openai_api_key=api_key if api_key is not None else settings.OPENAI_API_KEY,
-                streaming=True,
+                openai_api_key=api_key,
+                streaming=streaming,
+                **_openai_clients(api_key),
             )
         # If an exact match is not confirmed, this last case will be used if provided
         case _:
@@ -66,5 +260,6 @@ def get_llm(
                 model_name="gpt-4",
                 openai_organization=settings.OPENAI_ORGANIZATION,
                 openai_api_key=settings.OPENAI_API_KEY,
-                streaming=True,
+                streaming=streaming,
+                **_openai_clients(settings.OPENAI_API_KEY),
             )
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List
+
+import tiktoken
+from langchain.schema import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from app.schemas.tool_schema import LLMType
+from app.services.chat_agent.helpers.tokenizer import tokenizer_service
+
+
+def _tiktoken_model(llm: LLMType) -> str:
+    """The model ChatOpenAI.get_num_tokens_from_messages counts tokens with for the LLM returned by get_llm."""
+    match llm:
+        case "gpt-3.5-turbo" | "azure-3.5":
+            return "gpt-3.5-turbo-0301"
+        case _:
+            return "gpt-4-0314"
+
+
+def _message_role(message: BaseMessage) -> str:
+    if isinstance(message, HumanMessage):
+        return "user"
+    if isinstance(message, AIMessage):
+        return "assistant"
+    if isinstance(message, SystemMessage):
+        return "system"
+    raise ValueError(f"Unsupported message type {type(message)}")
+
+
+class MessageTokenCounter:
+    """
+    Counts chat message tokens the same way as `ChatOpenAI.get_num_tokens_from_messages`.
+
+    Each message is tokenized once, the count is cached by a hash of its role and content (bounded LRU), so
+    the turns of a conversation that is sent again with every new message are not tokenized again.
+    """
+
+    # every reply is primed with <im_start>assistant
+    reply_tokens = 3
+
+    def __init__(
+        self,
+        llm: LLMType,
+        max_size: int = 10_000,
+    ) -> None:
+        self.model = _tiktoken_model(llm)
+        # gpt-3.5-turbo-0301: every message follows <im_start>{role/name}\n{content}<im_end>\n
+        self.tokens_per_message = 4 if self.model.startswith("gpt-3.5-turbo-0301") else 3
+        self.max_size = max_size
+        self._counts: OrderedDict[bytes, int] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def encoding(
+        self,
+    ) -> tiktoken.Encoding:
+        return tokenizer_service.encoding(self.model)
+
+    def count(
+        self,
+        message: BaseMessage,
+    ) -> int:
+        """Number of tokens of a single message, excluding the reply priming tokens."""
+        role = _message_role(message)
+        content = str(message.content)
+        key = hashlib.blake2b(f"{role}\0{content}".encode("utf-8"), digest_size=16).digest()
+        with self._lock:
+            count = self._counts.get(key)
+            if count is not None:
+                self._counts.move_to_end(key)
+                return count
+
+        count = self.tokens_per_message + len(self.encoding.encode(role)) + len(self.encoding.encode(content))
+        with self._lock:
+            self._counts[key] = count
+            if len(self._counts) > self.max_size:
+                self._counts.popitem(last=False)
+        return count
+
+
+_token_counters: dict[str, MessageTokenCounter] = {}
+
+
+def get_message_token_counter(llm: LLMType) -> MessageTokenCounter:
+    """Process-wide token counter for the tokenizer of the LLM."""
+    model = _tiktoken_model(llm)
+    if model not in _token_counters:
+        _token_counters[model] = MessageTokenCounter(llm)
+    return _token_counters[model]
+
+
+def _to_buffer_messages(
+    chat_messages: List[AIMessage | HumanMessage],
+) -> List[BaseMessage]:
+    """Pair the chat messages into human/AI turns like ConversationTokenBufferMemory.save_context does."""
+    buffer: List[BaseMessage] = []
+    i = 0
+    while i < len(chat_messages):
+        if isinstance(
+            chat_messages[i],
+            HumanMessage,
+        ):
+            if isinstance(
+                chat_messages[i + 1],
+                AIMessage,
+            ):
+                buffer.append(HumanMessage(content=chat_messages[i].content))
+                buffer.append(AIMessage(content=chat_messages[i + 1].content))
+                i += 1
+        else:
+            buffer.append(HumanMessage(content=chat_messages[i].content))
+            buffer.append(AIMessage(content=""))
+        i += 1
+    return buffer
+
+
+def build_token_buffer_history(
+    chat_messages: List[AIMessage | HumanMessage],
+    max_token_limit: int,
+    token_counter: MessageTokenCounter,
+) -> List[BaseMessage]:
+    """
+    Get the most recent chat history that fits into the token limit.
+
+    The result is identical to replaying the conversation through `ConversationTokenBufferMemory.save_context`
+    (which drops the oldest messages until the buffer fits), but walks backwards from the newest message and
+    tokenizes each message at most once.
+
+    Args:
+        chat_messages (List[Union[AIMessage, HumanMessage]]): The list of chat messages.
+        max_token_limit (int): The maximum number of tokens of the history.
+        token_counter (MessageTokenCounter): The token counter of the LLM.
+
+    Returns:
+        List[BaseMessage]: The chat history.
+    """
+    buffer = _to_buffer_messages(chat_messages)
+    total_tokens = token_counter.reply_tokens
+    start = len(buffer)
+    for idx in range(len(buffer) - 1, -1, -1):
+        total_tokens += token_counter.count(buffer[idx])
+        if total_tokens > max_token_limit:
+            break
+        start = idx
+    return buffer[start:]
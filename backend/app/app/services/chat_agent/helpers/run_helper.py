@@ -1,8 +1,26 @@
 # -*- coding: utf-8 -*-
-from typing import Optional
+"""
+Run state and cancellation.
+
+A run is running while its redis key exists. `stop_run` deletes the key and publishes the cancellation on the redis
+channel RUN_CANCEL_CHANNEL. Every API worker (and agent worker) listens to the channel (`RunCancellationListener`,
+started in the `lifespan` hook) and cancels the agent task of the run if it holds it (`RunTaskRegistry`), so the
+cancellation interrupts the LLM calls and tools in flight instead of waiting for the next `is_running` check between
+plan steps.
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
 
 from app.api.deps import get_redis_client
+from app.core.config import settings
 from app.utils.fastapi_globals import g
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
 
 
 async def is_running(run_id: Optional[str] = None) -> bool:
@@ -13,5 +31,147 @@ async def is_running(run_id: Optional[str] = None) -> bool:
 
 
 async def stop_run(run_id: str) -> None:
+    requested_at = time.time()
+    run_task_registry.cancel(run_id, requested_at)  # no round trip if this worker holds the run
     redis_client = await get_redis_client()
-    await redis_client.delete(run_id)
+    async with redis_client.pipeline(transaction=False) as pipeline:
+        pipeline.delete(run_id)
+        pipeline.publish(
+            settings.RUN_CANCEL_CHANNEL,
+            json.dumps({"run_id": run_id, "requested_at": requested_at}),
+        )
+        await pipeline.execute()
+
+
+class RunTaskRegistry:
+    """The agent tasks of the runs of this worker process, so that a cancelled run is interrupted immediately."""
+
+    def __init__(
+        self,
+        latency_window: int = 1000,
+    ) -> None:
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._cancel_requested_at: Dict[str, float] = {}
+        self._latencies: Deque[float] = deque(maxlen=latency_window)
+        self.cancelled = 0
+
+    def register(
+        self,
+        run_id: str,
+        task: asyncio.Task,
+    ) -> None:
+        """Register the task running the agent of a run until it is done."""
+        self._tasks[run_id] = task
+        task.add_done_callback(lambda t: self._on_done(run_id, t))
+
+    def _on_done(
+        self,
+        run_id: str,
+        task: asyncio.Task,
+    ) -> None:
+        if self._tasks.get(run_id) is task:
+            del self._tasks[run_id]
+        requested_at = self._cancel_requested_at.pop(run_id, None)
+        if requested_at is not None:
+            self._latencies.append(max(time.time() - requested_at, 0.0))
+
+    def cancel(
+        self,
+        run_id: str,
+        requested_at: Optional[float] = None,
+    ) -> bool:
+        """
+        Cancel the task of a run if this worker holds it.
+
+        Args:
+            run_id (str): The run to cancel.
+            requested_at (Optional[float]): When the cancellation was requested (unix time), for the cancel-to-stop
+                latency. Defaults to now.
+
+        Returns:
+            bool: Whether the run was held by this worker and is being cancelled.
+        """
+        task = self._tasks.get(run_id)
+        if task is None or task.done() or run_id in self._cancel_requested_at:
+            return False
+        self._cancel_requested_at[run_id] = requested_at or time.time()
+        self.cancelled += 1
+        task.get_loop().call_soon_threadsafe(task.cancel)
+        return True
+
+    def stats(
+        self,
+    ) -> Dict[str, Any]:
+        latencies = sorted(self._latencies)
+        return {
+            "running": len(self._tasks),
+            "cancelled": self.cancelled,
+            "cancel_to_stop_p50_ms": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+            "cancel_to_stop_p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 1) if latencies else None,
+            "cancel_to_stop_max_ms": round(latencies[-1] * 1000, 1) if latencies else None,
+        }
+
+
+class RunCancellationListener:
+    """Subscribes to RUN_CANCEL_CHANNEL and cancels the runs this worker holds, reconnecting on redis errors."""
+
+    def __init__(
+        self,
+        registry: RunTaskRegistry,
+        channel: str = settings.RUN_CANCEL_CHANNEL,
+        reconnect_delay: float = 1.0,
+    ) -> None:
+        self.registry = registry
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self._task: Optional[asyncio.Task] = None
+
+    def start(
+        self,
+    ) -> None:
+        """Start listening on the running event loop."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._alisten())
+
+    async def aclose(
+        self,
+    ) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _on_message(
+        self,
+        data: str,
+    ) -> None:
+        try:
+            message = json.loads(data)
+            self.registry.cancel(message["run_id"], message.get("requested_at"))
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring invalid run cancellation {data!r}: {e!r}")
+
+    async def _alisten(
+        self,
+    ) -> None:
+        while True:
+            try:
+                redis_client = await get_redis_client()
+                pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+                await pubsub.subscribe(self.channel)
+                try:
+                    async for message in pubsub.listen():
+                        self._on_message(message["data"])
+                finally:
+                    await pubsub.reset()
+            except Exception as e:
+                logger.warning(f"Run cancellation listener failed, reconnecting: {e!r}")
+                await asyncio.sleep(self.reconnect_delay)
+
+
+run_task_registry = RunTaskRegistry()
+run_cancellation_listener = RunCancellationListener(run_task_registry)
+metrics.register("run_cancellation", run_task_registry.stats)
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Process-wide tokenizer service.
+
+Encoders are loaded once per process and model, counts of static strings (system contexts, prompt templates)
+are memoized, and large or batched inputs are tokenized on a thread pool (tiktoken releases the GIL while encoding),
+so long tool inputs do not block the event loop.
+"""
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+import tiktoken
+from langchain.schema import BaseMessage
+
+from app.core.config import settings
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOKENIZER_MODEL = "gpt-4"
+
+
+class TokenizerService:
+    """Cached tiktoken encoders with memoized counts for static strings and thread pool offloading."""
+
+    def __init__(
+        self,
+        max_workers: int,
+        offload_threshold: int,
+        static_cache_size: int,
+    ) -> None:
+        """
+        Args:
+            max_workers (int): Size of the thread pool for large and batched inputs.
+            offload_threshold (int): Number of characters from which a text is tokenized on the thread pool.
+            static_cache_size (int): Maximum number of memoized static strings.
+        """
+        self.max_workers = max_workers
+        self.offload_threshold = offload_threshold
+        self.static_cache_size = static_cache_size
+        self._encodings: Dict[str, tiktoken.Encoding] = {}
+        self._static_counts: OrderedDict[tuple[str, str], int] = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.static_hits = 0
+        self.static_misses = 0
+        self.offloaded = 0
+
+    @property
+    def executor(
+        self,
+    ) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="tokenizer")
+        return self._executor
+
+    def encoding(
+        self,
+        model: str = DEFAULT_TOKENIZER_MODEL,
+    ) -> tiktoken.Encoding:
+        """The encoder of a model, loaded once per process."""
+        enc = self._encodings.get(model)
+        if enc is None:
+            enc = tiktoken.encoding_for_model(model)
+            with self._lock:
+                self._encodings[model] = enc
+        return enc
+
+    def count(
+        self,
+        text: str,
+        model: str = DEFAULT_TOKENIZER_MODEL,
+    ) -> int:
+        """Number of tokens of a text."""
+        return len(self.encoding(model).encode(text))
+
+    def count_static(
+        self,
+        text: str,
+        model: str = DEFAULT_TOKENIZER_MODEL,
+    ) -> int:
+        """Number of tokens of a text that is reused across requests (e.g. a system context), memoized."""
+        key = (model, text)
+        with self._lock:
+            count = self._static_counts.get(key)
+            if count is not None:
+                self.static_hits += 1
+                self._static_counts.move_to_end(key)
+                return count
+            self.static_misses += 1
+        count = self.count(text, model)
+        with self._lock:
+            self._static_counts[key] = count
+            if len(self._static_counts) > self.static_cache_size:
+                self._static_counts.popitem(last=False)
+        return count
+
+    def count_batch(
+        self,
+        texts: List[str],
+        model: str = DEFAULT_TOKENIZER_MODEL,
+    ) -> List[int]:
+        """Number of tokens of each text, encoded in the calling thread."""
+        enc = self.encoding(model)
+        return [len(enc.encode(text)) for text in texts]
+
+    async def acount(
+        self,
+        text: str,
+        model: str = DEFAULT_TOKENIZER_MODEL,
+    ) -> int:
+        """Number of tokens of a text, large texts are tokenized on the thread pool."""
+        if len(text) < self.offload_threshold:
+            return self.count(text, model)
+        self.offloaded += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.count, text, model)
+
+    async def acount_batch(
+        self,
+        texts: List[str],
+        model: str = DEFAULT_TOKENIZER_MODEL,
+    ) -> List[int]:
+        """Number of tokens of each text, encoded in parallel on the thread pool if the batch is large."""
+        if sum(len(t) for t in texts) < self.offload_threshold:
+            return self.count_batch(texts, model)
+        self.offloaded += 1
+        loop = asyncio.get_running_loop()
+        return list(await asyncio.gather(*(loop.run_in_executor(self.executor, self.count, t, model) for t in texts)))
+
+    async def acount_messages(
+        self,
+        messages: List[BaseMessage],
+        static_contents: Iterable[str] = (),
+        model: str = DEFAULT_TOKENIZER_MODEL,
+    ) -> int:
+        """
+        Number of tokens of the contents of a list of messages.
+
+        Messages whose content is one of `static_contents` (e.g. the system context of a tool) use the memoized
+        count, so only the variable part of the prompt is tokenized.
+        """
+        static = set(static_contents)
+        contents = [m.content if isinstance(m.content, str) else "" for m in messages]
+        variable = [c for c in contents if c not in static]
+        return sum(self.count_static(c, model) for c in contents if c in static) + sum(
+            await self.acount_batch(variable, model)
+        )
+
+    def stats(
+        self,
+    ) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "encodings_loaded": len(self._encodings),
+                "static_cache_size": len(self._static_counts),
+                "static_hits": self.static_hits,
+                "static_misses": self.static_misses,
+                "offloaded": self.offloaded,
+            }
+
+    def shutdown(
+        self,
+    ) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+tokenizer_service = TokenizerService(
+    max_workers=settings.TOKENIZER_THREAD_POOL_SIZE,
+    offload_threshold=settings.TOKENIZER_OFFLOAD_THRESHOLD,
+    static_cache_size=settings.TOKENIZER_STATIC_CACHE_SIZE,
+)
+metrics.register("tokenizer", tokenizer_service.stats)
@@ -3,91 +3,63 @@ from typing import Callable, List, Optional
 
 from langchain.agents import AgentExecutor
 from langchain.base_language import BaseLanguageModel
-from langchain.memory import ChatMessageHistory, ConversationTokenBufferMemory
-from langchain.schema import AIMessage, HumanMessage
+from langchain.schema import AIMessage, BaseMessage, HumanMessage
 
 from app.core.config import settings
 from app.schemas.agent_schema import AgentConfig
 from app.schemas.tool_schema import LLMType
 from app.services.chat_agent.helpers.llm import get_llm
+from app.services.chat_agent.helpers.memory import build_token_buffer_history, get_message_token_counter
+from app.services.chat_agent.router_agent.ActionPlanExecutor import ActionPlanExecutor
 from app.services.chat_agent.router_agent.SimpleRouterAgent import SimpleRouterAgent
-from app.services.chat_agent.tools.tools import get_tools
+from app.services.chat_agent.tools.tools import ToolRegistry, get_tool_registry
 from app.utils.config_loader import get_agent_config
 
 
-def get_conv_token_buffer_memory(
+def get_chat_history(
     chat_messages: List[AIMessage | HumanMessage],
-    api_key: str,
-) -> ConversationTokenBufferMemory:
+) -> List[BaseMessage]:
     """
-    Get a ConversationTokenBufferMemory from a list of chat messages.
+    Get the chat history passed to the meta agent from a list of chat messages.
 
-    This function takes a list of chat messages and returns a ConversationTokenBufferMemory object.
-    It first gets the agent configuration and the language model, and then creates a ConversationTokenBufferMemory
-    object. It then iterates over the chat messages, saving the context of the conversation to the memory.
+    The most recent messages are kept, up to `max_token_length` tokens of the agent configuration. Token counts are
+    computed with the tokenizer of the agent LLM and cached per message, see `build_token_buffer_history`.
 
     Args:
         chat_messages (List[Union[AIMessage, HumanMessage]]): The list of chat messages.
-        api_key (str): The API key.
 
     Returns:
-        ConversationTokenBufferMemory: The ConversationTokenBufferMemory object.
+        List[BaseMessage]: The chat history.
     """
     agent_config = get_agent_config()
-    llm = get_llm(
-        agent_config.common.llm,
-        api_key=api_key,
-    )
-    chat_history = ChatMessageHistory()
-    memory = ConversationTokenBufferMemory(
-        memory_key="chat_history",
-        return_messages=True,
+    return build_token_buffer_history(
+        chat_messages,
         max_token_limit=agent_config.common.max_token_length,
-        llm=llm,
-        chat_memory=chat_history,
+        token_counter=get_message_token_counter(agent_config.common.llm),
     )
 
-    i = 0
-    while i < len(chat_messages):
-        if isinstance(
-            chat_messages[i],
-            HumanMessage,
-        ):
-            if isinstance(
-                chat_messages[i + 1],
-                AIMessage,
-            ):
-                memory.save_context(
-                    inputs={"input": chat_messages[i].content},
-                    outputs={"output": chat_messages[i + 1].content},  # type: ignore
-                )
-                i += 1
-        else:
-            memory.save_context(
-                inputs={"input": chat_messages[i].content},
-                outputs={"output": ""},
-            )
-        i += 1
-
-    return memory
-
 
 def create_meta_agent(
     agent_config: AgentConfig,
     get_llm_hook: Callable[[LLMType, Optional[str]], BaseLanguageModel] = get_llm,
+    tool_registry: Optional[ToolRegistry] = None,
+    run_id: Optional[str] = None,
 ) -> AgentExecutor:
     """
     Create a meta agent from a config.
 
     This function takes an AgentConfig object and creates a MetaAgent.
-    It retrieves the language models and the list tools, with which a SimpleRouterAgent is created.
-    Then, it returns an AgentExecutor.
+    It retrieves the language models and binds the prebuilt tools of the tool registry to this run, with which a
+    SimpleRouterAgent is created. Then, it returns an ActionPlanExecutor, which runs the selected action plan.
 
     Args:
         agent_config (AgentConfig): The AgentConfig object.
+        get_llm_hook (Callable): Hook to create the router LLM.
+        tool_registry (Optional[ToolRegistry]): The registry to take the tools from, defaults to the process-wide one.
+        run_id (Optional[str]): The run id the tools are bound to.
 
     Returns:
-        AgentExecutor: The AgentExecutor object.
+        AgentExecutor: The ActionPlanExecutor object.
     """
     api_key = agent_config.api_key
     if api_key is None or api_key == "":
@@ -98,7 +70,11 @@ def create_meta_agent(
         api_key,
     )
 
-    tools = get_tools(tools=agent_config.tools)
+    tools = (tool_registry or get_tool_registry()).bind(
+        agent_config.tools,
+        api_key=api_key,
+        run_id=run_id,
+    )
     simple_router_agent = SimpleRouterAgent.from_llm_and_tools(
         tools=tools,
         llm=llm,
@@ -106,7 +82,7 @@ def create_meta_agent(
         system_context=agent_config.system_context,
         action_plans=agent_config.action_plans,
     )
-    return AgentExecutor.from_agent_and_tools(
+    return ActionPlanExecutor.from_agent_and_tools(
         agent=simple_router_agent,
         tools=tools,
         verbose=True,
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from langchain.agents import AgentExecutor
+from langchain.agents.tools import InvalidTool
+from langchain.callbacks.manager import AsyncCallbackManagerForChainRun
+from langchain.schema import AgentAction
+from langchain.tools import BaseTool
+from langchain.utilities.asyncio import asyncio_timeout
+from langchain_core.agents import AgentStep
+from langchain_core.utils.input import get_color_mapping
+
+from app.schemas.agent_schema import ActionPlan
+from app.services.chat_agent.helpers.run_helper import is_running
+from app.services.chat_agent.router_agent.SimpleRouterAgent import SimpleRouterAgent
+from app.services.chat_agent.router_agent.speculation import speculative_run_scope
+from app.utils.exceptions.common_exceptions import AgentCancelledException
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ActionNode:
+    """A single tool run of an action plan."""
+
+    index: int  # position of the tool in the action plan, intermediate steps are ordered by it
+    step: int  # index of the action plan step of the tool
+    tool: str
+    step_actions: List[str]
+    dependencies: List[int]
+    upstream: Set[int] = field(default_factory=set)  # transitive dependencies
+
+
+def build_action_graph(action_plan: ActionPlan) -> List[ActionNode]:
+    """
+    Build the dependency graph of the tool runs of an action plan.
+
+    A tool listed in `action_plan.dependencies` depends on the latest earlier run of each of the listed tools, all
+    other tools depend on every tool of the previous step (the sequential semantics of the action plan steps).
+
+    Args:
+        action_plan (ActionPlan): The action plan.
+
+    Returns:
+        List[ActionNode]: The tool runs in action plan order.
+    """
+    nodes: List[ActionNode] = []
+    latest_node: Dict[str, int] = {}
+    previous_step: List[int] = []
+    for step_index, step_actions in enumerate(action_plan.actions):
+        step: List[int] = []
+        for tool in step_actions:
+            if tool == "memory":
+                continue
+            if tool in action_plan.dependencies:
+                dependencies = [latest_node[d] for d in action_plan.dependencies[tool]]
+            else:
+                dependencies = list(previous_step)
+            node = ActionNode(
+                index=len(nodes),
+                step=step_index,
+                tool=tool,
+                step_actions=step_actions,
+                dependencies=dependencies,
+            )
+            node.upstream = set(dependencies).union(*[nodes[d].upstream for d in dependencies])
+            nodes.append(node)
+            step.append(node.index)
+        for index in step:
+            latest_node[nodes[index].tool] = index
+        if step:
+            previous_step = step
+    return nodes
+
+
+class ActionPlanExecutor(AgentExecutor):
+    """
+    Executes the action plan selected by a `SimpleRouterAgent` as a dependency graph.
+
+    Instead of running the action plan step by step, every tool starts as soon as the tools it depends on (see
+    `ActionPlan.dependencies`) are done, so independent tools overlap across steps. The tool inputs, the returned
+    intermediate steps and the streamed callback events are the same as for the step by step `AgentExecutor` loop.
+
+    As in that loop, each action plan step counts as one iteration: if the plan has `max_iterations` steps or more,
+    only the first `max_iterations` steps run and the agent returns its stopped response.
+    """
+
+    async def _acall(
+        self,
+        inputs: Dict[str, str],
+        run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+    ) -> Dict[str, str]:
+        """Run text through and get agent response."""
+        with speculative_run_scope():
+            return await self._acall_action_graph(inputs, run_manager=run_manager)
+
+    async def _acall_action_graph(
+        self,
+        inputs: Dict[str, str],
+        run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+    ) -> Dict[str, str]:
+        if not isinstance(self.agent, SimpleRouterAgent):
+            return await super()._acall(inputs, run_manager=run_manager)
+
+        name_to_tool_map = {tool.name: tool for tool in self.tools}
+        color_mapping = get_color_mapping([tool.name for tool in self.tools], excluded_colors=["green"])
+        results: Dict[int, AgentStep] = {}
+        stopped = False
+        try:
+            async with asyncio_timeout(self.max_execution_time):
+                if not await is_running():
+                    raise AgentCancelledException("The agent is cancelled.")
+                if self.agent.action_plan is None:
+                    self.agent.action_plan = await self.agent.aselect_action_plan(**inputs)
+
+                nodes = build_action_graph(self.agent.action_plan)
+                # the step by step loop also spends an iteration on returning the final answer
+                if self.max_iterations is not None and len(self.agent.action_plan.actions) >= self.max_iterations:
+                    stopped = True
+                    nodes = [node for node in nodes if node.step < self.max_iterations]
+                tasks: Dict[int, asyncio.Task] = {}
+                for node in nodes:
+                    tasks[node.index] = asyncio.create_task(
+                        self._arun_node(
+                            node,
+                            [tasks[d] for d in node.dependencies],
+                            results,
+                            name_to_tool_map,
+                            color_mapping,
+                            inputs,
+                            run_manager,
+                        )
+                    )
+                try:
+                    await asyncio.gather(*tasks.values())
+                finally:
+                    for task in tasks.values():
+                        task.cancel()
+                    # wait for the cancelled tools, so none of their callbacks run after the executor returned
+                    await asyncio.gather(*tasks.values(), return_exceptions=True)
+        except (TimeoutError, asyncio.TimeoutError):
+            stopped = True
+
+        if stopped:
+            # stop early when interrupted by the async timeout or out of iterations
+            output = self.agent.return_stopped_response(
+                self.early_stopping_method, self._completed_steps(results), **inputs
+            )
+            return await self._areturn(output, self._completed_steps(results), run_manager=run_manager)
+
+        intermediate_steps = self._completed_steps(results)
+        return await self._areturn(
+            self.agent.finish(intermediate_steps),
+            intermediate_steps,
+            run_manager=run_manager,
+        )
+
+    @staticmethod
+    def _completed_steps(results: Dict[int, AgentStep]) -> List[Tuple[AgentAction, str]]:
+        return [(results[i].action, results[i].observation) for i in sorted(results)]
+
+    async def _arun_node(
+        self,
+        node: ActionNode,
+        dependencies: List[asyncio.Task],
+        results: Dict[int, AgentStep],
+        name_to_tool_map: Dict[str, BaseTool],
+        color_mapping: Dict[str, str],
+        inputs: Dict[str, Any],
+        run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+    ) -> AgentStep:
+        """Run a tool once the tools it depends on are done."""
+        if dependencies:
+            await asyncio.gather(*dependencies)
+        if not await is_running():
+            raise AgentCancelledException("The agent is cancelled.")
+
+        upstream_steps = [(results[i].action, results[i].observation) for i in sorted(node.upstream)]
+        agent_action = AgentAction(
+            tool=node.tool,
+            tool_input=SimpleRouterAgent.tool_input(node.step_actions, upstream_steps, **inputs),
+            log="",
+        )
+        logger.info(f"Running {node.tool} (depends on {[results[i].action.tool for i in node.dependencies]})")
+        results[node.index] = await self._aperform_agent_action(
+            agent_action,
+            name_to_tool_map,
+            color_mapping,
+            run_manager,
+        )
+        return results[node.index]
+
+    async def _aperform_agent_action(
+        self,
+        agent_action: AgentAction,
+        name_to_tool_map: Dict[str, BaseTool],
+        color_mapping: Dict[str, str],
+        run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+    ) -> AgentStep:
+        """Run the tool of an agent action, like `AgentExecutor._aiter_next_step` does."""
+        if run_manager:
+            await run_manager.on_agent_action(agent_action, verbose=self.verbose, color="green")
+        tool_run_kwargs = self.agent.tool_run_logging_kwargs()
+        if agent_action.tool in name_to_tool_map:
+            observation = await name_to_tool_map[agent_action.tool].arun(
+                agent_action.tool_input,
+                verbose=self.verbose,
+                color=color_mapping[agent_action.tool],
+                callbacks=run_manager.get_child() if run_manager else None,
+                **tool_run_kwargs,
+            )
+        else:
+            observation = await InvalidTool().arun(
+                {
+                    "requested_tool_name": agent_action.tool,
+                    "available_tool_names": list(name_to_tool_map.keys()),
+                },
+                verbose=self.verbose,
+                color=None,
+                callbacks=run_manager.get_child() if run_manager else None,
+                **tool_run_kwargs,
+            )
+        return AgentStep(action=agent_action, observation=observation)
@@ -19,9 +19,12 @@ from langchain.prompts.chat import (
 from langchain.schema import AgentAction, AgentFinish, BaseMessage
 from langchain.tools import BaseTool
 
+from app.core.config import settings
 from app.schemas.agent_schema import ActionPlan, ActionPlans
 from app.schemas.tool_schema import ToolInputSchema, UserSettings
 from app.services.chat_agent.helpers.run_helper import is_running
+from app.services.chat_agent.router_agent.router_cache import action_plan_router
+from app.services.chat_agent.router_agent.speculation import get_speculative_run, speculator
 from app.utils.exceptions.common_exceptions import AgentCancelledException
 
 logger = logging.getLogger(__name__)
@@ -102,40 +105,14 @@ class SimpleRouterAgent(BaseMultiActionAgent):
             raise AgentCancelledException("The agent is cancelled.")
 
         # Router agent makes initial template
-        retries = 0
-        while self.action_plan is None:
-            try:
-                full_output = await self.llm_chain.apredict(**kwargs)
-                action_plan = ActionPlan(**self.action_plans.action_plans[full_output].dict())
-                self.action_plan = action_plan
-                logger.info(f"Action plan selected: {full_output}, {str(action_plan)}")
-            except openai.AuthenticationError as e:
-                retries += 1
-                if retries > 3:
-                    raise ValueError(
-                        "Oops! It seems like your OPENAPI key is invalid. Please check your Settings."
-                    ) from e
-            except Exception as e:
-                retries += 1
-                if retries > 3:
-                    raise ValueError(f"Invalid action plan selected ({retries}x)") from e
+        if self.action_plan is None:
+            self.action_plan = await self.aselect_action_plan(**kwargs)
 
         # Router agent follows action plan
         if len(self.action_plan.actions) > 0:
             logger.info(f"Next action plan step ({len(self.action_plan.actions)} remaining)")
             next_actions = self.action_plan.actions.pop(0)
-            tool_input = ToolInputSchema(
-                latest_human_message=kwargs["input"],
-                chat_history=[],
-                user_settings=UserSettings(**kwargs["user_settings"].dict()) if kwargs["user_settings"] else None,
-                intermediate_steps={},
-            )
-            if len(intermediate_steps) > 0:
-                tool_input.intermediate_steps = {step[0].tool: step[1] for step in intermediate_steps}
-            elif "memory" in next_actions and "chat_history" in kwargs:
-                tool_input.chat_history = kwargs["chat_history"]
-
-            tool_input_str = tool_input.json()  # pydantic v2: model_dump_json
+            tool_input_str = self.tool_input(next_actions, intermediate_steps, **kwargs)
             actions = [
                 AgentAction(
                     tool=a,
@@ -147,12 +124,123 @@ class SimpleRouterAgent(BaseMultiActionAgent):
             ]
             return actions
         # Router agent is done
+        return self.finish(intermediate_steps)
+
+    @staticmethod
+    def finish(
+        intermediate_steps: List[Tuple[AgentAction, str]],
+    ) -> AgentFinish:
+        """Finish the run with the outputs of all tools of the action plan."""
         output = "\n\n".join([f"{step[0].tool}:\n{step[1]}" for step in intermediate_steps])
         return AgentFinish(
             return_values={"output": output},
             log="",
         )
 
+    @staticmethod
+    def tool_input(
+        next_actions: List[str],
+        intermediate_steps: List[Tuple[AgentAction, str]],
+        **kwargs: Any,
+    ) -> str:
+        """Build the serialized tool input of an action plan step."""
+        tool_input = ToolInputSchema(
+            latest_human_message=kwargs["input"],
+            chat_history=[],
+            user_settings=UserSettings(**kwargs["user_settings"].dict()) if kwargs.get("user_settings") else None,
+            intermediate_steps={},
+        )
+        if len(intermediate_steps) > 0:
+            tool_input.intermediate_steps = {step[0].tool: step[1] for step in intermediate_steps}
+        elif "memory" in next_actions and "chat_history" in kwargs:
+            tool_input.chat_history = kwargs["chat_history"]
+
+        return tool_input.json()  # pydantic v2: model_dump_json
+
+    async def aselect_action_plan(
+        self,
+        **kwargs: Any,
+    ) -> ActionPlan:
+        """
+        Select the action plan for the user input.
+
+        The decision is taken from the router cache or the nearest-neighbour classifier if possible (see
+        `ActionPlanRouter`), otherwise from the router LLM.
+
+        Args:
+            **kwargs: User inputs.
+
+        Returns:
+            ActionPlan: A copy of the selected action plan.
+        """
+        plan_id = await action_plan_router.aselect(
+            question=kwargs["input"],
+            chat_history=kwargs.get("chat_history") or [],
+            action_plans=self.action_plans,
+            predict=lambda: self._apredict_action_plan_speculatively(**kwargs),
+            prompt=self.llm_chain.prompt.format(input="", chat_history=[]),
+        )
+        action_plan = ActionPlan(**self.action_plans.action_plans[plan_id].dict())
+        logger.info(f"Action plan selected: {plan_id}, {str(action_plan)}")
+        if settings.SPECULATION_ENABLED:
+            speculative_run = get_speculative_run()
+            if speculative_run is not None:
+                first_step = action_plan.actions[0] if action_plan.actions else []
+                tool_input = self.tool_input(first_step, [], **kwargs)
+                speculative_run.resolve({(tool, tool_input) for tool in first_step})
+            await speculator.frequencies.arecord(plan_id)
+        return action_plan
+
+    async def _apredict_action_plan_speculatively(
+        self,
+        **kwargs: Any,
+    ) -> str:
+        """
+        Select the id of the action plan with the router LLM.
+
+        If speculative execution is enabled, the first step of the most probable plans is started while the router
+        LLM decides (see `speculation.py`).
+        """
+        if settings.SPECULATION_ENABLED:
+            try:
+                await speculator.astart(
+                    self.tools,
+                    self.action_plans,
+                    lambda first_step: self.tool_input(first_step, [], **kwargs),
+                )
+            except Exception as e:
+                logger.warning(f"Starting speculative execution failed: {repr(e)}")
+        try:
+            return await self._apredict_action_plan(**kwargs)
+        except BaseException:
+            speculative_run = get_speculative_run()
+            if speculative_run is not None:
+                speculative_run.resolve(set())
+            raise
+
+    async def _apredict_action_plan(
+        self,
+        **kwargs: Any,
+    ) -> str:
+        """Select the id of the action plan with the router LLM."""
+        retries = 0
+        while True:
+            try:
+                full_output = await self.llm_chain.apredict(**kwargs)
+                if full_output not in self.action_plans.action_plans:
+                    raise KeyError(full_output)
+                return full_output
+            except openai.AuthenticationError as e:
+                retries += 1
+                if retries > 3:
+                    raise ValueError(
+                        "Oops! It seems like your OPENAPI key is invalid. Please check your Settings."
+                    ) from e
+            except Exception as e:
+                retries += 1
+                if retries > 3:
+                    raise ValueError(f"Invalid action plan selected ({retries}x)") from e
+
     @classmethod
     def create_prompt(
         cls,
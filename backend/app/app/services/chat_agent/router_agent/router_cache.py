@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+"""
+Router decisions without an LLM round-trip.
+
+`ActionPlanRouter` selects the action plan of a question in three tiers:
+1. `RouterDecisionCache`: the plan selected before for the same normalized question, recent chat history and router
+   prompt (redis, with a TTL).
+2. `NearestNeighbourRouter` (optional): the plan of the most similar past question, if the cosine similarity of the
+   question embeddings is above a threshold.
+3. The router LLM, whose decisions populate both tiers above.
+"""
+import base64
+import hashlib
+import json
+import logging
+import random
+import re
+import threading
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain.schema import BaseMessage
+from langchain_core.embeddings import Embeddings
+
+from app.api.deps import get_redis_client
+from app.core.config import settings
+from app.schemas.agent_schema import ActionPlans
+from app.services.chat_agent.helpers.embedding_models import get_embedding_model
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+ROUTER_DECISION_NAMESPACE = "router_decision"
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase the question and strip punctuation and redundant whitespace."""
+    return " ".join(re.sub(r"[^\w\s]", " ", question.lower()).split())
+
+
+def history_digest(
+    chat_history: List[BaseMessage],
+    n_messages: int,
+) -> str:
+    """Digest of the `n_messages` most recent chat messages."""
+    digest = hashlib.sha256()
+    for message in chat_history[-n_messages:] if n_messages > 0 else []:
+        digest.update(f"{message.type}\0{message.content}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def action_plans_digest(action_plans: ActionPlans) -> str:
+    """Digest of the action plans, cached decisions are invalidated when the plans change."""
+    return hashlib.sha256(json.dumps(action_plans.dict(), sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+class RouterDecisionCache:
+    """
+    Redis cache of the selected action plan, keyed by the normalized question and digests of the history and the
+    router prompt (so editing the prompt or the action plans does not serve stale decisions).
+    """
+
+    def __init__(
+        self,
+        ttl: int,
+        history_messages: int,
+        namespace: str = ROUTER_DECISION_NAMESPACE,
+    ) -> None:
+        self.ttl = ttl
+        self.history_messages = history_messages
+        self.namespace = namespace
+
+    def key(
+        self,
+        question: str,
+        chat_history: List[BaseMessage],
+        action_plans: ActionPlans,
+        prompt: str = "",
+    ) -> str:
+        """The key of a decision, relative to the namespace of the cache."""
+        digest = hashlib.sha256(
+            "\0".join(
+                [
+                    normalize_question(question),
+                    history_digest(chat_history, self.history_messages),
+                    prompt,
+                ]
+            ).encode("utf-8")
+        ).hexdigest()
+        return f"{action_plans_digest(action_plans)}:{digest}"
+
+    def _redis_key(
+        self,
+        key: str,
+    ) -> str:
+        return f"{self.namespace}:{key}"
+
+    async def aget(
+        self,
+        key: str,
+    ) -> Optional[str]:
+        try:
+            redis_client = await get_redis_client()
+            plan_id = await redis_client.get(self._redis_key(key))
+            return plan_id if isinstance(plan_id, str) else None
+        except Exception as e:
+            logger.warning(f"Router cache lookup failed: {repr(e)}")
+            return None
+
+    async def aset(
+        self,
+        key: str,
+        plan_id: str,
+    ) -> None:
+        try:
+            redis_client = await get_redis_client()
+            await redis_client.set(self._redis_key(key), plan_id, ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"Router cache update failed: {repr(e)}")
+
+
+class NearestNeighbourRouter:
+    """
+    Nearest-neighbour classifier over the embeddings of past questions and the action plans selected for them.
+
+    The examples are kept in a fixed size ring buffer of L2-normalized embeddings, so a prediction is a single
+    matrix-vector product. Examples are shared between workers through a capped redis list and loaded lazily.
+    Examples of another embedding dimension (e.g. stored before the embedding model changed) are discarded.
+    """
+
+    def __init__(
+        self,
+        threshold: float,
+        max_examples: int,
+        namespace: str = ROUTER_DECISION_NAMESPACE,
+    ) -> None:
+        self.threshold = threshold
+        self.max_examples = max_examples
+        self.examples_key = f"{namespace}:examples"
+        self._embeddings: Optional[np.ndarray] = None
+        self._plan_ids: List[Optional[str]] = [None] * max_examples
+        self._size = 0
+        self._next = 0
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    @property
+    def size(
+        self,
+    ) -> int:
+        return self._size
+
+    def add(
+        self,
+        embedding: np.ndarray,
+        plan_id: str,
+    ) -> bool:
+        """Add an example, returns False if an identical example is already known."""
+        embedding = _normalize(embedding)
+        prediction = self.predict(embedding)
+        if prediction is not None and prediction[0] == plan_id and prediction[1] > 0.999:
+            return False
+        with self._lock:
+            if self._embeddings is not None and self._embeddings.shape[1] != embedding.shape[0]:
+                logger.warning(
+                    f"Discarding {self._size} router examples of dimension {self._embeddings.shape[1]}, "
+                    f"the embeddings now have dimension {embedding.shape[0]}"
+                )
+                self._embeddings = None
+                self._plan_ids = [None] * self.max_examples
+                self._size = 0
+                self._next = 0
+            if self._embeddings is None:
+                self._embeddings = np.zeros((self.max_examples, embedding.shape[0]), dtype=np.float32)
+            self._embeddings[self._next] = embedding
+            self._plan_ids[self._next] = plan_id
+            self._next = (self._next + 1) % self.max_examples
+            self._size = min(self._size + 1, self.max_examples)
+        return True
+
+    def predict(
+        self,
+        embedding: np.ndarray,
+    ) -> Optional[Tuple[str, float]]:
+        """The action plan of the most similar example and its cosine similarity."""
+        with self._lock:
+            if self._embeddings is None or self._size == 0 or self._embeddings.shape[1] != embedding.shape[0]:
+                return None
+            similarities = self._embeddings[: self._size] @ _normalize(embedding)
+            idx = int(np.argmax(similarities))
+            plan_id = self._plan_ids[idx]
+        return (plan_id, float(similarities[idx])) if plan_id is not None else None
+
+    async def aload(
+        self,
+        dimension: int,
+    ) -> None:
+        """
+        Load the examples stored by other workers, once (retried on the next call if it failed).
+
+        Args:
+            dimension (int): The dimension of the embeddings of the current embedding model, examples of another
+                dimension are discarded.
+        """
+        if self._loaded:
+            return
+        try:
+            redis_client = await get_redis_client()
+            examples = await redis_client.lrange(self.examples_key, 0, self.max_examples - 1)
+        except Exception as e:
+            logger.warning(f"Loading router examples failed: {repr(e)}")
+            return
+        self._loaded = True
+        discarded = 0
+        for example in reversed(examples or []):
+            example = json.loads(example)
+            embedding = np.frombuffer(base64.b64decode(example["embedding"]), dtype=np.float32)
+            if embedding.shape[0] != dimension:
+                discarded += 1
+                continue
+            self.add(embedding, example["plan_id"])
+        if discarded:
+            logger.warning(f"Discarded {discarded} stored router examples whose dimension is not {dimension}")
+
+    async def apersist(
+        self,
+        embedding: np.ndarray,
+        plan_id: str,
+    ) -> None:
+        try:
+            redis_client = await get_redis_client()
+            example = json.dumps(
+                {
+                    "plan_id": plan_id,
+                    "embedding": base64.b64encode(_normalize(embedding).tobytes()).decode("ascii"),
+                }
+            )
+            async with redis_client.pipeline(transaction=False) as pipeline:
+                pipeline.lpush(self.examples_key, example)
+                pipeline.ltrim(self.examples_key, 0, self.max_examples - 1)
+                await pipeline.execute()
+        except Exception as e:
+            logger.warning(f"Storing router example failed: {repr(e)}")
+
+
+def _normalize(embedding: np.ndarray) -> np.ndarray:
+    embedding = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(embedding)
+    return embedding / norm if norm > 0 else embedding
+
+
+class ActionPlanRouter:
+    """Selects action plans from the router cache, the nearest-neighbour classifier or the router LLM."""
+
+    def __init__(
+        self,
+        cache: Optional[RouterDecisionCache] = None,
+        classifier: Optional[NearestNeighbourRouter] = None,
+        embedding_model: Optional[str] = None,
+        shadow_rate: float = 0.0,
+    ) -> None:
+        self.cache = cache
+        self.classifier = classifier
+        self.embedding_model = embedding_model
+        self.shadow_rate = shadow_rate
+        self._embeddings: Optional[Embeddings] = None
+        self.requests = 0
+        self.cache_hits = 0
+        self.classifier_hits = 0
+        self.llm_calls = 0
+        self.comparisons = 0
+        self.agreements = 0
+        self.confident_comparisons = 0
+        self.confident_agreements = 0
+
+    async def _aembed(
+        self,
+        question: str,
+    ) -> Optional[np.ndarray]:
+        try:
+            if self._embeddings is None:
+                self._embeddings = get_embedding_model(self.embedding_model)
+            return np.asarray(await self._embeddings.aembed_query(normalize_question(question)), dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"Embedding the question for the router failed: {repr(e)}")
+            return None
+
+    async def aselect(
+        self,
+        question: str,
+        chat_history: List[BaseMessage],
+        action_plans: ActionPlans,
+        predict: Callable[[], Awaitable[str]],
+        prompt: str = "",
+    ) -> str:
+        """
+        Select the action plan for a question.
+
+        Args:
+            question (str): The latest human message.
+            chat_history (List[BaseMessage]): The chat history passed to the router LLM.
+            action_plans (ActionPlans): The available action plans.
+            predict (Callable[[], Awaitable[str]]): Selects the action plan with the router LLM.
+            prompt (str): The prompt of the router LLM, part of the cache key.
+
+        Returns:
+            str: The id of the selected action plan.
+        """
+        self.requests += 1
+        cache, classifier = self.cache, self.classifier
+        key = None
+        if cache is not None:
+            key = cache.key(question, chat_history, action_plans, prompt)
+            plan_id = await cache.aget(key)
+            if plan_id in action_plans.action_plans:
+                self.cache_hits += 1
+                return plan_id
+
+        embedding = None
+        prediction = None
+        if classifier is not None:
+            embedding = await self._aembed(question)
+            if embedding is not None:
+                await classifier.aload(embedding.shape[0])
+                prediction = classifier.predict(embedding)
+            if (
+                prediction is not None
+                and prediction[1] >= classifier.threshold
+                and prediction[0] in action_plans.action_plans
+                and random.random() >= self.shadow_rate
+            ):
+                self.classifier_hits += 1
+                if cache is not None and key is not None:
+                    await cache.aset(key, prediction[0])
+                return prediction[0]
+
+        self.llm_calls += 1
+        plan_id = await predict()
+
+        if classifier is not None and prediction is not None:
+            self.comparisons += 1
+            self.agreements += int(prediction[0] == plan_id)
+            if prediction[1] >= classifier.threshold:
+                self.confident_comparisons += 1
+                self.confident_agreements += int(prediction[0] == plan_id)
+        if cache is not None and key is not None:
+            await cache.aset(key, plan_id)
+        if classifier is not None and embedding is not None and classifier.add(embedding, plan_id):
+            await classifier.apersist(embedding, plan_id)
+        return plan_id
+
+    def stats(
+        self,
+    ) -> Dict[str, float]:
+        return {
+            "requests": self.requests,
+            "cache_hits": self.cache_hits,
+            "classifier_hits": self.classifier_hits,
+            "llm_calls": self.llm_calls,
+            "hit_rate": (self.cache_hits + self.classifier_hits) / self.requests if self.requests else 0.0,
+            "classifier_examples": self.classifier.size if self.classifier is not None else 0,
+            "classifier_comparisons": self.comparisons,
+            "classifier_agreement": self.agreements / self.comparisons if self.comparisons else 0.0,
+            "classifier_confident_comparisons": self.confident_comparisons,
+            "classifier_confident_agreement": (
+                self.confident_agreements / self.confident_comparisons if self.confident_comparisons else 0.0
+            ),
+        }
+
+
+action_plan_router = ActionPlanRouter(
+    cache=RouterDecisionCache(
+        ttl=settings.ROUTER_CACHE_TTL,
+        history_messages=settings.ROUTER_CACHE_HISTORY_MESSAGES,
+    )
+    if settings.ROUTER_CACHE_ENABLED
+    else None,
+    classifier=NearestNeighbourRouter(
+        threshold=settings.ROUTER_CLASSIFIER_THRESHOLD,
+        max_examples=settings.ROUTER_CLASSIFIER_MAX_EXAMPLES,
+    )
+    if settings.ROUTER_CLASSIFIER_ENABLED
+    else None,
+    embedding_model=settings.ROUTER_CLASSIFIER_EMBEDDING_MODEL,
+    shadow_rate=settings.ROUTER_CLASSIFIER_SHADOW_RATE,
+)
+metrics.register("router", action_plan_router.stats)
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+Speculative execution of the first action plan step.
+
+While the router LLM selects the action plan, the first stage of the tools in the first step of the most probable
+plans (e.g. the PDF retrieval or the SQL table selection, see `ExtendedBaseTool.aprefetch`) is started in the
+background. Once the plan is selected, the speculative results of the selected step are adopted by the tools and
+all others are cancelled. The LLM calls of discarded speculative work are capped by a per-worker budget.
+
+Plan probabilities are the historical frequencies of the selected plans (shared between workers in redis and
+reloaded every SPECULATION_FREQUENCIES_RELOAD_INTERVAL seconds), with a uniform prior over the plans of the
+`action_plans` config.
+
+The speculative run is scoped to the agent executor (`speculative_run_scope`), so the router of a nested agent (e.g.
+the chain tool) does not replace the speculative run of the outer agent.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Any, Callable, Deque, Dict, Iterator, List, Optional, Set, Tuple
+
+from langchain.tools import BaseTool
+
+from app.api.deps import get_redis_client
+from app.core.config import settings
+from app.schemas.agent_schema import ActionPlans
+from app.utils.metrics import metrics
+
+if TYPE_CHECKING:
+    from app.services.chat_agent.tools.ExtendedBaseTool import ExtendedBaseTool
+
+logger = logging.getLogger(__name__)
+
+PLAN_FREQUENCIES_KEY = "router_decision:plan_frequencies"
+
+SpeculationKey = Tuple[str, str]  # (tool name, tool input)
+
+
+class PlanFrequencies:
+    """How often each action plan was selected, with a uniform prior."""
+
+    def __init__(
+        self,
+        key: str = PLAN_FREQUENCIES_KEY,
+        reload_interval: float = settings.SPECULATION_FREQUENCIES_RELOAD_INTERVAL,
+    ) -> None:
+        self.key = key
+        self.reload_interval = reload_interval
+        self._counts: Dict[str, int] = {}
+        self._loaded_at: Optional[float] = None
+
+    async def aload(
+        self,
+    ) -> None:
+        """Load the frequencies recorded by all workers, at most once per `reload_interval` seconds."""
+        now = time.monotonic()
+        if self._loaded_at is not None and now - self._loaded_at < self.reload_interval:
+            return
+        self._loaded_at = now
+        try:
+            redis_client = await get_redis_client()
+            counts = await redis_client.hgetall(self.key)
+            self._counts = {k: int(v) for k, v in (counts or {}).items()}
+        except Exception as e:
+            logger.warning(f"Loading action plan frequencies failed: {repr(e)}")
+
+    async def arecord(
+        self,
+        plan_id: str,
+    ) -> None:
+        self._counts[plan_id] = self._counts.get(plan_id, 0) + 1
+        try:
+            redis_client = await get_redis_client()
+            await redis_client.hincrby(self.key, plan_id, 1)
+        except Exception as e:
+            logger.warning(f"Recording action plan frequency failed: {repr(e)}")
+
+    def probabilities(
+        self,
+        action_plans: ActionPlans,
+    ) -> Dict[str, float]:
+        counts = {plan_id: self._counts.get(plan_id, 0) + 1 for plan_id in action_plans.action_plans}
+        total = sum(counts.values())
+        return {plan_id: count / total for plan_id, count in counts.items()}
+
+
+class SpeculationBudget:
+    """Sliding window cap on the LLM calls of discarded speculative work."""
+
+    def __init__(
+        self,
+        max_wasted_llm_calls: int,
+        window: float,
+    ) -> None:
+        self.max_wasted_llm_calls = max_wasted_llm_calls
+        self.window = window
+        self._wasted: Deque[float] = deque()
+        self._lock = threading.Lock()
+
+    def remaining(
+        self,
+    ) -> int:
+        with self._lock:
+            cutoff = time.monotonic() - self.window
+            while self._wasted and self._wasted[0] < cutoff:
+                self._wasted.popleft()
+            return self.max_wasted_llm_calls - len(self._wasted)
+
+    def charge(
+        self,
+        llm_calls: int,
+    ) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._wasted.extend([now] * llm_calls)
+
+
+class SpeculativeRun:
+    """The speculative tasks of a single agent run."""
+
+    def __init__(
+        self,
+        owner: Speculator,
+    ) -> None:
+        self.speculator = owner
+        self._tasks: Dict[SpeculationKey, Tuple[asyncio.Task, int]] = {}
+
+    def start(
+        self,
+        tool: ExtendedBaseTool,
+        tool_input: str,
+    ) -> None:
+        llm_calls = tool.prefetch_llm_calls
+        self._tasks[(tool.name, tool_input)] = (asyncio.create_task(tool.aprefetch(tool_input)), llm_calls)
+        self.speculator.started += 1
+
+    def resolve(
+        self,
+        keep: Set[SpeculationKey],
+    ) -> None:
+        """Keep the tasks the selected plan agrees with, cancel the others."""
+        for key in [k for k in self._tasks if k not in keep]:
+            task, llm_calls = self._tasks.pop(key)
+            task.cancel()
+            self.speculator.discard(llm_calls)
+
+    async def atake(
+        self,
+        tool_name: str,
+        tool_input: str,
+    ) -> Optional[Any]:
+        """The result of the speculative task for the tool input, None if there is none or it failed."""
+        entry = self._tasks.pop((tool_name, tool_input), None)
+        if entry is None:
+            return None
+        try:
+            result = await entry[0]
+        except Exception as e:
+            logger.warning(f"Speculative execution of {tool_name} failed: {repr(e)}")
+            self.speculator.discard(entry[1])
+            return None
+        self.speculator.adopted += 1
+        return result
+
+
+class Speculator:
+    """Starts and tracks the speculative execution of the first action plan step."""
+
+    def __init__(
+        self,
+        min_probability: float,
+        max_tasks: int,
+        budget: SpeculationBudget,
+    ) -> None:
+        self.min_probability = min_probability
+        self.max_tasks = max_tasks
+        self.budget = budget
+        self.frequencies = PlanFrequencies()
+        self.started = 0
+        self.adopted = 0
+        self.discarded = 0
+        self.wasted_llm_calls = 0
+        self.skipped_budget = 0
+
+    def discard(
+        self,
+        llm_calls: int,
+    ) -> None:
+        self.discarded += 1
+        self.wasted_llm_calls += llm_calls
+        self.budget.charge(llm_calls)
+
+    async def astart(
+        self,
+        tools: List[BaseTool],
+        action_plans: ActionPlans,
+        first_step_input: Callable[[List[str]], str],
+    ) -> Optional[SpeculativeRun]:
+        """
+        Start the first stage of the tools in the first step of the most probable action plans.
+
+        Args:
+            tools (List[BaseTool]): The tools of the agent.
+            action_plans (ActionPlans): The available action plans.
+            first_step_input (Callable[[List[str]], str]): Builds the tool input of the first step of a plan.
+
+        Returns:
+            Optional[SpeculativeRun]: The speculative run, also the speculative run of the current scope.
+        """
+        from app.services.chat_agent.tools.ExtendedBaseTool import (  # pylint: disable=import-outside-toplevel
+            ExtendedBaseTool,
+        )
+
+        await self.frequencies.aload()
+        tools_by_name = {t.name: t for t in tools if isinstance(t, ExtendedBaseTool) and t.supports_prefetch}
+        candidates: Dict[SpeculationKey, float] = {}
+        for plan_id, probability in self.frequencies.probabilities(action_plans).items():
+            actions = action_plans.action_plans[plan_id].actions
+            if not actions:
+                continue
+            tool_input = first_step_input(actions[0])
+            for tool_name in actions[0]:
+                if tool_name in tools_by_name:
+                    key = (tool_name, tool_input)
+                    candidates[key] = candidates.get(key, 0.0) + probability
+
+        speculative_run = SpeculativeRun(self)
+        for (tool_name, tool_input), probability in sorted(candidates.items(), key=lambda c: -c[1])[: self.max_tasks]:
+            if probability < self.min_probability:
+                break
+            tool = tools_by_name[tool_name]
+            if tool.prefetch_llm_calls > self.budget.remaining():
+                self.skipped_budget += 1
+                continue
+            speculative_run.start(tool, tool_input)
+
+        _speculative_run.set(speculative_run)
+        return speculative_run
+
+    def stats(
+        self,
+    ) -> Dict[str, Any]:
+        return {
+            "started": self.started,
+            "adopted": self.adopted,
+            "discarded": self.discarded,
+            "skipped_budget": self.skipped_budget,
+            "wasted_llm_calls": self.wasted_llm_calls,
+            "budget_remaining": self.budget.remaining(),
+        }
+
+
+_speculative_run: ContextVar[Optional[SpeculativeRun]] = ContextVar("speculative_run", default=None)
+
+
+def get_speculative_run() -> Optional[SpeculativeRun]:
+    """The speculative run of the current agent executor, if any."""
+    return _speculative_run.get()
+
+
+@contextmanager
+def speculative_run_scope() -> Iterator[None]:
+    """
+    Scope the speculative run to an agent executor.
+
+    Tasks created in the scope (e.g. the tool runs) see the speculative run started in it, a nested executor starts
+    its own. Speculative tasks that were not adopted when the scope exits are cancelled.
+    """
+    token = _speculative_run.set(None)
+    try:
+        yield
+    finally:
+        speculative_run = _speculative_run.get()
+        if speculative_run is not None:
+            speculative_run.resolve(set())
+        _speculative_run.reset(token)
+
+
+speculator = Speculator(
+    min_probability=settings.SPECULATION_MIN_PROBABILITY,
+    max_tasks=settings.SPECULATION_MAX_TASKS,
+    budget=SpeculationBudget(
+        max_wasted_llm_calls=settings.SPECULATION_WASTE_BUDGET,
+        window=settings.SPECULATION_WASTE_WINDOW,
+    ),
+)
+metrics.register("speculation", speculator.stats)
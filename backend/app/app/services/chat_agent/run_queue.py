@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Run queue between the API and dedicated agent workers.
+
+If `AGENT_RUN_QUEUE_ENABLED` is set, `/chat/agent` does not run the agent in the API process: it enqueues the run as
+the Celery task `run_agent` (`app.api.celery_task`) on the `AGENT_RUN_QUEUE` queue and relays the events the agent
+worker appends to the Redis Stream of the run (`app.utils.streaming.run_events`). The API tier then only relays
+streams, and both tiers are scaled independently. Start agent workers with e.g.:
+```
+celery -A app.core.celery.celery worker -Q agent_runs --pool threads --concurrency 32
+```
+All runs of a worker process share one persistent event loop (see `AgentWorkerLoop`), so that the shared LLM http
+clients, which are bound to an event loop, are reused across runs.
+
+The API key of the user is never sent through the broker: it is kept in redis (`agent_run_api_key:<run_id>`) until
+the worker starts the run, for at most AGENT_RUN_QUEUE_TIMEOUT seconds, and the task only carries that redis key.
+
+The per-user admission slot of a queued run is released by the agent worker when the run ends, so a client that
+disconnects and reconnects can not exceed ADMISSION_MAX_RUNS_PER_USER while its runs are still running. The API
+worker only releases its per-worker slot once it stops relaying the run.
+"""
+import asyncio
+import logging
+import math
+import threading
+from collections.abc import Coroutine
+from datetime import datetime
+from typing import Any, AsyncIterator, Optional
+
+from langchain.cache import RedisCache
+from langchain.globals import set_llm_cache
+
+from app.api.deps import get_redis_client, get_redis_client_sync
+from app.core.celery import celery
+from app.core.config import settings
+from app.deps import agent_deps
+from app.schemas.message_schema import IChatQuery
+from app.schemas.streaming_schema import StreamingData, StreamingDataTypeEnum, StreamingSignalsEnum
+from app.services.chat_agent.helpers.run_helper import run_cancellation_listener, run_task_registry
+from app.services.chat_agent.meta_agent import get_chat_history
+from app.utils.admission import admission_controller
+from app.utils.exceptions.common_exceptions import AdmissionRejectedException
+from app.utils.fastapi_globals import g
+from app.utils.streaming.callbacks.stream import AsyncIteratorCallbackHandler
+from app.utils.streaming.helpers import handle_exceptions
+from app.utils.streaming.run_events import aread_run_events
+
+logger = logging.getLogger(__name__)
+
+
+def agent_run_kwargs(
+    chat: IChatQuery,
+) -> dict[str, Any]:
+    """The arguments of `meta_agent.arun` for a chat query (without the callbacks)."""
+    chat_messages = [m.to_langchain() for m in chat.messages]
+    chat_history = get_chat_history(
+        chat_messages[:-1],  # type: ignore
+    )
+    chat_content = chat_messages[-1].content if chat_messages[-1] is not None else ""
+    return {
+        "input": chat_content,
+        "chat_history": chat_history,
+        "user_settings": chat.settings,
+        "tags": [
+            "agent_chat",
+            f"user_email={chat.user_email}",
+            f"conversation_id={chat.conversation_id}",
+            f"message_id={chat.new_message_id}",
+            f"timestamp={datetime.now()}",
+            f"version={chat.settings.version if chat.settings is not None else 'N/A'}",
+        ],
+    }
+
+
+def run_api_key_key(
+    run_id: str,
+) -> str:
+    return f"agent_run_api_key:{run_id}"
+
+
+async def aenqueue_run(
+    run_id: str,
+    chat: IChatQuery,
+    owner: Optional[str] = None,
+    admission_key: Optional[str] = None,
+) -> None:
+    """
+    Enqueue a run for the agent workers (the Celery task `run_agent`), the API key of the chat query is passed as a
+    redis reference.
+    """
+    api_key_ref = None
+    if chat.api_key is not None:
+        api_key_ref = run_api_key_key(run_id)
+        redis_client = await get_redis_client()
+        await redis_client.set(api_key_ref, chat.api_key, ex=math.ceil(settings.AGENT_RUN_QUEUE_TIMEOUT))
+    await asyncio.to_thread(
+        celery.send_task,
+        "run_agent",
+        args=[run_id, chat.model_dump(mode="json", exclude={"api_key"}), owner, api_key_ref, admission_key],
+        queue=settings.AGENT_RUN_QUEUE,
+    )
+
+
+async def atake_api_key(
+    api_key_ref: str,
+) -> Optional[str]:
+    """Read and delete the API key of a queued run, None if it expired."""
+    redis_client = await get_redis_client()
+    return await redis_client.getdel(api_key_ref)
+
+
+async def arelay_run(
+    run_id: str,
+) -> AsyncIterator[StreamingData]:
+    """Relay the events of a queued run, waiting up to AGENT_RUN_QUEUE_TIMEOUT seconds for a worker to start it."""
+    async for _, event in aread_run_events(run_id, start_timeout=settings.AGENT_RUN_QUEUE_TIMEOUT):
+        yield StreamingData.model_validate_json(event)
+
+
+async def arelay_admitted_run(
+    run_id: str,
+    chat: IChatQuery,
+    admission_key: str,
+    admitted: bool,
+    owner: Optional[str] = None,
+) -> AsyncIterator[StreamingData]:
+    """
+    Wait for the admission of a run (streaming its queue position), enqueue it and relay it.
+
+    Once the run is enqueued, the agent worker releases its per-user slot and this only releases the per-worker slot.
+    """
+    query_context = g.query_context or {}
+    waiter: Optional[asyncio.Task] = None
+    enqueued = False
+    try:
+        if not admitted:
+            positions: list[int] = []
+            waiter = asyncio.create_task(admission_controller.await_admission(admission_key, positions.append))
+            while not waiter.done():
+                await asyncio.wait({waiter}, timeout=admission_controller.poll_interval)
+                while positions:
+                    yield StreamingData(
+                        data=StreamingSignalsEnum.QUEUED.value,
+                        data_type=StreamingDataTypeEnum.SIGNAL,
+                        metadata={"position": positions.pop(0), **query_context},
+                    )
+            try:
+                waiter.result()
+            except AdmissionRejectedException as e:
+                yield StreamingData(
+                    data=repr(e),
+                    data_type=StreamingDataTypeEnum.LLM,
+                    metadata={"error": "too_many_requests", "retry_after": e.retry_after, **query_context},
+                )
+                return
+        await aenqueue_run(run_id, chat, owner, admission_key)
+        enqueued = True
+        async for item in arelay_run(run_id):
+            yield item
+    finally:
+        if waiter is not None and not waiter.done():
+            waiter.cancel()  # the client left while the run was queued
+        elif waiter is None or (not waiter.cancelled() and waiter.exception() is None):
+            if enqueued:
+                admission_controller.release_worker_slot()
+            else:
+                await admission_controller.arelease(admission_key)
+
+
+async def arun_queued(
+    run_id: str,
+    chat: IChatQuery,
+    owner: Optional[str] = None,
+    api_key_ref: Optional[str] = None,
+    admission_key: Optional[str] = None,
+) -> None:
+    """Run the agent for a queued run, publishing its events to the Redis Stream of the run."""
+    try:
+        await _arun_queued(run_id, chat, owner, api_key_ref)
+    finally:
+        if admission_key is not None:
+            await admission_controller.arelease_user_slot(admission_key)
+
+
+async def _arun_queued(
+    run_id: str,
+    chat: IChatQuery,
+    owner: Optional[str],
+    api_key_ref: Optional[str],
+) -> None:
+    if api_key_ref is not None:
+        api_key = await atake_api_key(api_key_ref)
+        if api_key is None:
+            # the API stopped waiting for the run before the key expired, nobody relays it anymore
+            logger.warning(f"The API key of queued run {run_id} expired, the run is dropped")
+            return
+        chat = chat.model_copy(update={"api_key": api_key})
+    g.tool_context = {}
+    g.query_context = {
+        "run_id": run_id,
+    }
+    stream_handler = AsyncIteratorCallbackHandler(publish=True, local_stream=False, owner=owner)
+    meta_agent = agent_deps.get_meta_agent(chat.api_key)
+    stream_handler.agent_task = asyncio.create_task(
+        handle_exceptions(
+            meta_agent.arun(callbacks=[stream_handler], **agent_run_kwargs(chat)),
+            stream_handler,
+        )
+    )
+    run_task_registry.register(run_id, stream_handler.agent_task)
+    try:
+        await stream_handler.agent_task
+    finally:
+        await stream_handler.aclose_publisher()
+
+
+class AgentWorkerLoop:
+    """
+    A persistent event loop in a background thread of an agent worker process.
+
+    Celery tasks are synchronous, running every run in a new event loop (`asyncio.run`) would bind (and break) the
+    shared http clients of the LLMs to a loop per run. Instead, tasks submit their run to this loop and wait for it,
+    so that a worker with a thread pool runs many runs concurrently on one loop.
+    """
+
+    def __init__(
+        self,
+    ) -> None:
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    def _start(
+        self,
+    ) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="agent-worker-loop", daemon=True).start()
+                if settings.ENABLE_LLM_CACHE:
+                    set_llm_cache(RedisCache(redis_=get_redis_client_sync()))
+                self._loop.call_soon_threadsafe(run_cancellation_listener.start)
+                logger.info("Agent worker event loop started")
+            return self._loop
+
+    def run(
+        self,
+        coroutine: Coroutine,
+    ) -> Any:
+        """Run a coroutine on the worker loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._start()).result()
+
+
+agent_worker_loop = AgentWorkerLoop()
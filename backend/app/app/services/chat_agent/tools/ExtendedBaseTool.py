@@ -12,7 +12,9 @@ from langchain.tools import BaseTool
 
 from app.schemas.agent_schema import AgentAndToolsConfig
 from app.schemas.tool_schema import ToolConfig
-from app.services.chat_agent.helpers.llm import get_llm, get_token_length
+from app.services.chat_agent.helpers.llm import get_llm
+from app.services.chat_agent.helpers.tokenizer import tokenizer_service
+from app.services.chat_agent.router_agent.speculation import get_speculative_run
 
 
 class ExtendedBaseTool(BaseTool):
@@ -40,6 +42,10 @@ class ExtendedBaseTool(BaseTool):
 
     additional: Optional[Box] = None
 
+    # speculative execution of the first stage of the tool, see `aprefetch`
+    supports_prefetch: bool = False
+    prefetch_llm_calls: int = 0
+
     @classmethod
     def from_config(
         cls,
@@ -104,6 +110,22 @@ class ExtendedBaseTool(BaseTool):
             else None,
         )
 
+    @property
+    def static_contents(
+        self,
+    ) -> List[str]:
+        """The system contexts of the tool, their token counts are memoized across requests."""
+        return [
+            c
+            for c in (
+                self.system_context,
+                self.system_context_selection,
+                self.system_context_validation,
+                self.system_context_refinement,
+            )
+            if c
+        ]
+
     async def _agenerate_response(
         self,
         messages: List[BaseMessage],
@@ -115,14 +137,37 @@ class ExtendedBaseTool(BaseTool):
             raise ValueError("fast_llm_token_limit must be set in the config, current value `None`")
         llm = (
             self.fast_llm
-            if get_token_length("".join([m.content if isinstance(m.content, str) else "" for m in messages]))
+            if not discard_fast_llm
+            and await tokenizer_service.acount_messages(messages, static_contents=self.static_contents)
             < self.fast_llm_token_limit
-            and not discard_fast_llm
             else self.llm
         )
         llm_response = await llm.agenerate([messages], callbacks=run_manager.get_child() if run_manager else None)
         return llm_response.generations[0][0].text
 
+    async def aprefetch(
+        self,
+        tool_input: str,
+    ) -> Any:
+        """
+        Run the first, side-effect free stage of the tool ahead of time.
+
+        Started speculatively while the router LLM selects the action plan (see `speculation.py`), the tool adopts
+        the result with `atake_prefetched` if the selected plan runs it with the same input. Tools that support it
+        set `supports_prefetch` and the number of LLM calls of the stage (`prefetch_llm_calls`).
+        """
+        raise NotImplementedError(f"{self.name} does not support prefetching")
+
+    async def atake_prefetched(
+        self,
+        tool_input: str,
+    ) -> Optional[Any]:
+        """The result of `aprefetch` for the tool input if it was started speculatively, None otherwise."""
+        speculative_run = get_speculative_run()
+        if speculative_run is None:
+            return None
+        return await speculative_run.atake(self.name, tool_input)
+
     def _run(
         self,
         *args: Any,
@@ -3,25 +3,36 @@
 import logging
 from typing import Any, Optional
 
-from langchain.agents import AgentExecutor
 from langchain.base_language import BaseLanguageModel
-from langchain.callbacks.manager import AsyncCallbackManagerForToolRun, CallbackManagerForToolRun
+from langchain.callbacks.manager import AsyncCallbackManagerForToolRun, CallbackManagerForToolRun, Callbacks
 from langchain.chains.base import Chain
 
 from app.schemas.agent_schema import ActionPlan, ActionPlans, AgentAndToolsConfig, AgentConfig
 from app.schemas.streaming_schema import StreamingDataTypeEnum
 from app.schemas.tool_schema import ToolConfig
 from app.services.chat_agent.helpers.llm import get_llm
+from app.services.chat_agent.router_agent.ActionPlanExecutor import ActionPlanExecutor
 from app.services.chat_agent.router_agent.SimpleRouterAgent import SimpleRouterAgent
 from app.services.chat_agent.tools.ExtendedBaseTool import ExtendedBaseTool
-from app.services.chat_agent.tools.tools import get_tools
+from app.services.chat_agent.tools.tools import get_tool_registry
 from app.utils.config_loader import load_agent_config_override
 
 
-def get_chain(llm: BaseLanguageModel, config: AgentConfig) -> Chain:
+def get_chain(
+    llm: BaseLanguageModel,
+    config: AgentConfig,
+    api_key: Optional[str] = None,
+    callbacks: Callbacks = None,
+    run_id: Optional[str] = None,
+) -> Chain:
     """create an agent executor to run a SimpleRouterAgent (similar to
-    create_meta_agent)"""
-    tools = get_tools(tools=config.tools, load_nested=False)
+    create_meta_agent), the nested tools are bound to the api key, callbacks and run id of the chain tool"""
+    tools = get_tool_registry().bind(
+        config.tools,
+        api_key=api_key,
+        callbacks=callbacks,
+        run_id=run_id,
+    )
     agent = SimpleRouterAgent.from_llm_and_tools(
         tools=tools,
         llm=llm,
@@ -29,7 +40,7 @@ def get_chain(llm: BaseLanguageModel, config: AgentConfig) -> Chain:
         system_context=config.system_context,
         action_plans=config.action_plans,
     )
-    executor = AgentExecutor.from_agent_and_tools(
+    executor = ActionPlanExecutor.from_agent_and_tools(
         agent=agent,  # conv_agent,
         tools=tools,
         verbose=True,
@@ -48,6 +59,7 @@ class ChainTool(ExtendedBaseTool):
     name = "chain_tool"
     appendix_title = "Chain Appendix"
     agent_config: AgentConfig
+    api_key: Optional[str] = None  # the API key of the run, set by `ToolRegistry.bind`
 
     @classmethod
     def from_config(
@@ -110,7 +122,13 @@ class ChainTool(ExtendedBaseTool):
                     "chain_action", data_type=StreamingDataTypeEnum.ACTION, tool=self.name, step=1
                 )
 
-            chain = get_chain(llm=self.llm, config=self.agent_config)
+            chain = get_chain(
+                llm=self.llm,
+                config=self.agent_config,
+                api_key=self.api_key,
+                callbacks=self.callbacks,
+                run_id=(self.metadata or {}).get("run_id"),
+            )
 
             response = await chain.acall(
                 {
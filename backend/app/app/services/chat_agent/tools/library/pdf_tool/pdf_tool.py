@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import asyncio
 import csv
 import datetime
 import logging
@@ -8,7 +9,7 @@ import os
 from typing import Any, List, Optional
 
 from langchain.callbacks.manager import AsyncCallbackManagerForToolRun, CallbackManagerForToolRun
-from langchain.schema import HumanMessage, SystemMessage
+from langchain.schema import Document, HumanMessage, SystemMessage
 
 from app.core.config import settings
 from app.db.vector_db_pdf_ingestion import PDFExtractionPipeline, get_pdf_pipeline
@@ -29,6 +30,7 @@ class PDFTool(ExtendedBaseTool):
     name = "pdf_tool"
     appendix_title = "PDF Appendix"
     pdf_pipeline: PDFExtractionPipeline
+    supports_prefetch = True
 
     @classmethod
     def from_config(
@@ -141,22 +143,16 @@ class PDFTool(ExtendedBaseTool):
         **kwargs: Any,
     ) -> str:
         """Use the tool asynchronously."""
-        query = kwargs.get(
+        tool_input = kwargs.get(
             "query",
             args[0],
         )
         # Use standard query formatting
-        query = standard_query_format(ToolInputSchema.parse_raw(query))
+        query = standard_query_format(ToolInputSchema.parse_raw(tool_input))
         try:
-            logger.info("Filtering relevant documents")
-            db_pdf_docs = self.pdf_pipeline.run(load_index=True)
-
-            logger.info("Filtering DB for relevant info...")
-            docs = db_pdf_docs.as_retriever(
-                search_kwargs={
-                    "k": 4,
-                }  # tbd search_kwargs
-            ).get_relevant_documents(query)
+            docs = await self.atake_prefetched(tool_input)
+            if docs is None:
+                docs = self._retrieve_docs(query)
             retrieved_docs = "\n".join([doc.page_content for doc in docs])
 
             result = await self._aqa_pdf_chunks(
@@ -190,6 +186,29 @@ class PDFTool(ExtendedBaseTool):
                 return repr(e)
             raise e
 
+    def _retrieve_docs(
+        self,
+        query: str,
+    ) -> List[Document]:
+        """Retrieve the PDF chunks relevant to the query."""
+        logger.info("Filtering relevant documents")
+        db_pdf_docs = self.pdf_pipeline.run(load_index=True)
+
+        logger.info("Filtering DB for relevant info...")
+        return db_pdf_docs.as_retriever(
+            search_kwargs={
+                "k": 4,
+            }  # tbd search_kwargs
+        ).get_relevant_documents(query)
+
+    async def aprefetch(
+        self,
+        tool_input: str,
+    ) -> List[Document]:
+        """Retrieve the relevant PDF chunks (no LLM calls) in a thread."""
+        query = standard_query_format(ToolInputSchema.parse_raw(tool_input))
+        return await asyncio.to_thread(self._retrieve_docs, query)
+
     @staticmethod
     def appendix_context(
         documents: List[str],
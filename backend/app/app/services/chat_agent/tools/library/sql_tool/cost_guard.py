@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Cost guard of the SQL queries written by the SQL tool.
+
+Before a generated query runs, the planner estimates the rows it returns and its cost (`EXPLAIN`, see
+`SQLDatabaseExtended.aexplain`). A query over `max_rows` or `max_cost` is handled by the `action` of the guard:
+- "refine": the query is not run, the estimate is sent back to the refinement loop as the complaint.
+- "limit": the query is wrapped with a LIMIT and planned again, it is refined if it is still over the thresholds
+  (e.g. a sort over a cross join is as expensive with a LIMIT).
+- "reject": the tool fails with `SQLQueryCostException`.
+
+Queries of dialects without an `EXPLAIN` statement, or whose plan fails, are not guarded.
+"""
+import logging
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, Literal, Optional
+
+from app.db.SQLDatabaseExtended import QueryPlanEstimate, SQLDatabaseExtended
+from app.utils.exceptions.common_exceptions import SQLQueryCostException
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CostGuardAction = Literal["reject", "limit", "refine"]
+
+_LIMIT = re.compile(r"\blimit\s+\d+\s*(offset\s+\d+\s*)?;?\s*$", re.IGNORECASE)
+
+_counters: Dict[str, int] = {"checks": 0, "unavailable": 0, "limited": 0, "refined": 0, "rejected": 0}
+
+
+def limit_query(
+    query: str,
+    limit: int,
+) -> str:
+    """The query wrapped to return at most `limit` rows."""
+    return f"SELECT * FROM ({query.strip().rstrip(';')}) AS limited_query LIMIT {limit}"
+
+
+@dataclass
+class CostGuardResult:
+    """The query to run (possibly limited), or why it should be refined."""
+
+    query: str
+    complaint: Optional[str] = None
+    estimate: Optional[QueryPlanEstimate] = None
+    limited: bool = False
+
+
+class SQLCostGuard:
+    """Thresholds of the planner's estimates of a query, and the action over them."""
+
+    def __init__(
+        self,
+        max_rows: Optional[float] = None,
+        max_cost: Optional[float] = None,
+        action: CostGuardAction = "refine",
+        limit: int = 1000,
+        timeout: Optional[float] = None,
+    ) -> None:
+        """
+        Initialize the cost guard.
+
+        Args:
+            max_rows (Optional[float]): The maximum estimated rows of a query, None for no limit.
+            max_cost (Optional[float]): The maximum estimated cost of a query (in the cost units of the dialect),
+                None for no limit.
+            action (CostGuardAction): What to do with a query over the thresholds.
+            limit (int): The LIMIT of queries over the thresholds with the "limit" action, at most `max_rows`.
+            timeout (Optional[float]): Seconds before planning a query times out, the query timeout if None.
+        """
+        self.max_rows = max_rows
+        self.max_cost = max_cost
+        self.action = action
+        self.limit = limit
+        self.timeout = timeout
+
+    def exceeded(
+        self,
+        estimate: QueryPlanEstimate,
+    ) -> Optional[str]:
+        """The thresholds exceeded by an estimate, None if it is within them."""
+        exceeded = []
+        if self.max_rows is not None and estimate.rows is not None and estimate.rows > self.max_rows:
+            exceeded.append(f"{estimate.rows:,.0f} rows (max {self.max_rows:,.0f})")
+        if self.max_cost is not None and estimate.cost is not None and estimate.cost > self.max_cost:
+            exceeded.append(f"a cost of {estimate.cost:,.0f} (max {self.max_cost:,.0f})")
+        return " and ".join(exceeded) if exceeded else None
+
+    async def _aestimate(
+        self,
+        db: SQLDatabaseExtended,
+        query: str,
+    ) -> Optional[QueryPlanEstimate]:
+        try:
+            return await db.aexplain(query, timeout=self.timeout)
+        except Exception as e:
+            logger.info(f"Could not estimate the cost of the SQL query, running it unguarded: {e!r}")
+            return None
+
+    async def acheck(
+        self,
+        db: SQLDatabaseExtended,
+        query: str,
+    ) -> CostGuardResult:
+        """
+        Check the estimates of a query against the thresholds.
+
+        Raises:
+            SQLQueryCostException: If the query is over the thresholds and the action is "reject".
+        """
+        _counters["checks"] += 1
+        estimate = await self._aestimate(db, query)
+        if estimate is None:
+            _counters["unavailable"] += 1
+            return CostGuardResult(query)
+        exceeded = self.exceeded(estimate)
+        if exceeded is None:
+            return CostGuardResult(query, estimate=estimate)
+        logger.info(f"The SQL query is estimated at {exceeded}: {query}")
+
+        if self.action == "reject":
+            _counters["rejected"] += 1
+            raise SQLQueryCostException(f"The SQL query is too expensive, it is estimated at {exceeded}")
+        if self.action == "limit" and not _LIMIT.search(query):
+            limit = self.limit if self.max_rows is None else min(self.limit, int(self.max_rows))
+            limited_query = limit_query(query, limit)
+            limited_estimate = await self._aestimate(db, limited_query)
+            if limited_estimate is not None and self.exceeded(limited_estimate) is None:
+                _counters["limited"] += 1
+                return CostGuardResult(limited_query, estimate=limited_estimate, limited=True)
+        _counters["refined"] += 1
+        return CostGuardResult(
+            query,
+            complaint=(
+                f"The SQL query is too expensive to run, it is estimated at {exceeded}. Rewrite it to "
+                "read fewer rows: filter early, join on keys (no cross joins), aggregate in the query and add a LIMIT."
+            ),
+            estimate=estimate,
+        )
+
+
+def stats() -> Dict[str, Any]:
+    return dict(_counters)
+
+
+metrics.register("sql_cost_guard", stats)
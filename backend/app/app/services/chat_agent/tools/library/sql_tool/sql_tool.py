@@ -4,19 +4,24 @@ from __future__ import annotations
 
 import logging
 import re
-from typing import Any, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 from langchain.callbacks.manager import AsyncCallbackManagerForToolRun, CallbackManagerForToolRun
 from langchain.schema import HumanMessage, SystemMessage
 
 from app.core.config import settings
 from app.db.session import sql_tool_db
+from app.db.sql_result_cache import sql_result_cache
 from app.schemas.agent_schema import AgentAndToolsConfig
 from app.schemas.streaming_schema import StreamingDataTypeEnum
 from app.schemas.tool_schema import SqlToolConfig, ToolInputSchema
+from app.schemas.tool_schemas.sql_tool_schema import DatabaseInfo
 from app.services.chat_agent.helpers.llm import get_llm
 from app.services.chat_agent.helpers.query_formatting import standard_query_format
+from app.services.chat_agent.helpers.tokenizer import tokenizer_service
 from app.services.chat_agent.tools.ExtendedBaseTool import ExtendedBaseTool
+from app.services.chat_agent.tools.library.sql_tool.cost_guard import CostGuardAction, SQLCostGuard
+from app.services.chat_agent.tools.library.sql_tool.table_index import get_table_index, parse_table_definitions
 from app.utils.sql import is_sql_query_safe
 
 logger = logging.getLogger(__name__)
@@ -32,6 +37,19 @@ class SQLTool(ExtendedBaseTool):
     validate_empty_results: bool = False
     validate_with_llm: bool = False
     always_limit_query: bool = False
+    table_index_enabled: bool = False
+    table_index_top_k: int = 5
+    table_index_rerank_margin: float = 0.0
+    table_index_embedding_model: Optional[str] = None
+    table_descriptions: Dict[str, str] = {}
+    schema_token_budget: int = 0
+    prompt_rerank: Optional[str] = None
+    cost_guard_max_rows: Optional[float] = None
+    cost_guard_max_cost: Optional[float] = None
+    cost_guard_action: CostGuardAction = "refine"
+    cost_guard_limit: int = 1000
+    supports_prefetch = True
+    prefetch_llm_calls = 1
 
     @classmethod
     def from_config(
@@ -92,6 +110,23 @@ class SQLTool(ExtendedBaseTool):
             validate_empty_results=config.validate_empty_results,
             validate_with_llm=config.validate_with_llm,
             always_limit_query=config.always_limit_query,
+            table_index_enabled=config.table_index_enabled,
+            table_index_top_k=config.table_index_top_k,
+            table_index_rerank_margin=config.table_index_rerank_margin,
+            table_index_embedding_model=config.table_index_embedding_model,
+            schema_token_budget=config.schema_token_budget,
+            table_descriptions=parse_table_definitions(
+                next((e.content for e in config.prompt_inputs if e.name == "table_definitions"), "")
+            ),
+            prompt_rerank=(
+                config.prompt_rerank.format(**{e.name: e.content for e in config.prompt_inputs})
+                if config.prompt_rerank
+                else None
+            ),
+            cost_guard_max_rows=config.cost_guard_max_rows,
+            cost_guard_max_cost=config.cost_guard_max_cost,
+            cost_guard_action=config.cost_guard_action,
+            cost_guard_limit=config.cost_guard_limit,
         )
 
     @staticmethod
@@ -112,7 +147,7 @@ class SQLTool(ExtendedBaseTool):
             else:
                 raise ValueError(msg)
         elif sql_tool_db.db_info is None:
-            msg = "Database schema information is not initialized"
+            msg = "Database schema information is not initialized, the schema introspection may still be running"
             if warning:
                 logger.warning(msg)
             else:
@@ -143,15 +178,16 @@ class SQLTool(ExtendedBaseTool):
         """
         SQLTool.check_init(warning=False)
 
-        query = kwargs.get(
+        tool_input = kwargs.get(
             "query",
             args[0],
         )
-        query = standard_query_format(ToolInputSchema.parse_raw(query))
+        query = standard_query_format(ToolInputSchema.parse_raw(tool_input))
         try:
             filtered_tables = await self._alist_sql_tables(
                 query,
                 run_manager,
+                tool_input=tool_input,
             )
             (
                 schemas,
@@ -171,14 +207,21 @@ class SQLTool(ExtendedBaseTool):
 
             while result is None:
                 (
-                    is_valid,
-                    results_str,
-                    complaints,
-                ) = await self._avalidate_response(
-                    query,
                     response,
-                    run_manager,
-                )
+                    complaints,
+                ) = await self._aguard_cost(response)
+                if complaints is None:
+                    (
+                        is_valid,
+                        results_str,
+                        complaints,
+                    ) = await self._avalidate_response(
+                        query,
+                        response,
+                        run_manager,
+                    )
+                else:
+                    is_valid, results_str = False, []
                 if is_valid or retries > 3:
                     result = response
                 else:
@@ -229,6 +272,46 @@ class SQLTool(ExtendedBaseTool):
         """Construct the final response."""
         return f"{markdown_sql_query}, {results_str}"
 
+    async def _aguard_cost(
+        self,
+        response: str,
+    ) -> Tuple[str, Optional[str]]:
+        """
+        Check the planner's estimates of the query of the response before it runs (see `SQLCostGuard`).
+
+        Returns:
+            Tuple[str, Optional[str]]: (response, complaints), the response with a limited query if the guard limits
+                it, the complaints if the query is too expensive.
+        """
+        if (self.cost_guard_max_rows is None and self.cost_guard_max_cost is None) or sql_tool_db is None:
+            return response, None
+        try:
+            query = await self._parse_query(response)
+        except ValueError:
+            return response, None  # reported by the validation
+        if not is_sql_query_safe(query):
+            return response, None
+        guard = SQLCostGuard(
+            max_rows=self.cost_guard_max_rows,
+            max_cost=self.cost_guard_max_cost,
+            action=self.cost_guard_action,
+            limit=self.cost_guard_limit,
+        )
+        guarded = await guard.acheck(sql_tool_db, query)
+        if guarded.limited:
+            response = self._replace_query(response, guarded.query)
+        return response, guarded.complaint
+
+    @staticmethod
+    def _replace_query(
+        response: str,
+        query: str,
+    ) -> str:
+        """The response with its SQL code block replaced by the query."""
+        code_block = f"```sql\n{query}\n```"
+        replaced, count = re.subn(r"```sql.*?```", lambda _: code_block, response, count=1, flags=re.DOTALL | re.I)
+        return replaced if count else code_block
+
     async def _avalidate_response(
         self,
         question: str,
@@ -251,25 +334,24 @@ class SQLTool(ExtendedBaseTool):
                 )
             if sql_tool_db is None:
                 raise ValueError("Database is not initialized")
-            results = sql_tool_db.run_no_str(query)
+            results = await sql_result_cache.asample(sql_tool_db, query, self.nb_example_rows)
             if results is None:
                 validation: Tuple[bool, Any, Any] = (
                     False,
                     [],
                     f"The SQL query did not return any results: {results}",
                 )
-            elif self.validate_empty_results and len(results) == 0:
+            elif self.validate_empty_results and results.total_rows == 0:
                 validation = (
                     False,
                     [],
                     "The SQL query executed but did not return any result rows.",
                 )
             else:
-                sample_rows_result = results[0 : self.nb_example_rows]
                 sample_rows = list(
                     map(
                         lambda ls: [f"{str(i)[:100]}..." if len(str(i)) > 100 else str(i) for i in ls],
-                        sample_rows_result,
+                        results.rows,
                     )
                 )
                 sample_rows_str = ";".join([",".join(row) for row in sample_rows]).replace(
@@ -277,7 +359,8 @@ class SQLTool(ExtendedBaseTool):
                     "",
                 )
                 results_str = (
-                    f"total rows from SQL query: {len(results)}, first {self.nb_example_rows} rows: {sample_rows_str}"
+                    f"total rows from SQL query: {results.total_str()}, "
+                    f"first {self.nb_example_rows} rows: {sample_rows_str}"
                 )
                 if self.validate_with_llm:
                     validation_messages = [
@@ -363,8 +446,9 @@ class SQLTool(ExtendedBaseTool):
         self,
         query: str,
         run_manager: Optional[AsyncCallbackManagerForToolRun] = None,
+        tool_input: Optional[str] = None,
     ) -> List[str]:
-        """List the SQL tables."""
+        """List the SQL tables, adopting the speculatively selected tables for the tool input if available."""
         if run_manager is not None:
             await run_manager.on_text(
                 "list_tables_sql_db",
@@ -372,6 +456,29 @@ class SQLTool(ExtendedBaseTool):
                 tool=self.name,
                 step=1,
             )
+        if tool_input is not None:
+            prefetched_tables = await self.atake_prefetched(tool_input)
+            if prefetched_tables is not None:
+                return prefetched_tables
+        return await self._aselect_tables(query)
+
+    async def aprefetch(
+        self,
+        tool_input: str,
+    ) -> List[str]:
+        """Select the relevant SQL tables (one LLM call)."""
+        return await self._aselect_tables(standard_query_format(ToolInputSchema.parse_raw(tool_input)))
+
+    async def _aselect_tables(
+        self,
+        query: str,
+    ) -> List[str]:
+        db_info = sql_tool_db.db_info if sql_tool_db is not None else None
+        if self.table_index_enabled and db_info is not None:
+            try:
+                return await self._aselect_tables_from_index(query, db_info)
+            except Exception as e:
+                logger.warning(f"Table selection from the table index failed, selecting with the LLM: {e!r}")
         table_messages = [
             SystemMessage(content=self.system_context_selection if self.system_context_selection else ""),
             HumanMessage(content=self.prompt_selection.format(question=query) if self.prompt_selection else ""),
@@ -384,6 +491,46 @@ class SQLTool(ExtendedBaseTool):
         logger.info(f"Filtered tables: {filtered_tables}")
         return filtered_tables
 
+    async def _aselect_tables_from_index(
+        self,
+        query: str,
+        db_info: DatabaseInfo,
+    ) -> List[str]:
+        """
+        Select the `table_index_top_k` tables most similar to the question.
+
+        If the scores of the last selected and the first discarded table are within `table_index_rerank_margin`, the
+        fast LLM selects the tables among the top 2 * `table_index_top_k` candidates instead (`prompt_rerank`).
+        """
+        k = self.table_index_top_k
+        candidates = await get_table_index(self.table_index_embedding_model).asearch(
+            query,
+            2 * k,
+            db_info,
+            self.table_descriptions,
+        )
+        filtered_tables = [name for name, _ in candidates[:k]]
+        if (
+            self.prompt_rerank is not None
+            and len(candidates) > k
+            and candidates[k - 1][1] - candidates[k][1] < self.table_index_rerank_margin
+        ):
+            candidate_tables = "\n".join(
+                f"{name} | {self.table_descriptions.get(name.lower(), '')}" for name, _ in candidates
+            )
+            rerank_messages = [
+                SystemMessage(content=self.system_context_selection if self.system_context_selection else ""),
+                HumanMessage(content=self.prompt_rerank.format(candidate_tables=candidate_tables, question=query)),
+            ]
+            response = await self._agenerate_response(rerank_messages)
+            candidate_names = {name.lower(): name for name, _ in candidates}
+            reranked_tables = [
+                candidate_names[x.strip().lower()] for x in response.split(",") if x.strip().lower() in candidate_names
+            ]
+            filtered_tables = reranked_tables or filtered_tables
+        logger.info(f"Filtered tables: {filtered_tables} (scores: {candidates})")
+        return filtered_tables
+
     async def _aquery_with_schemas(
         self,
         query: str,
@@ -398,14 +545,15 @@ class SQLTool(ExtendedBaseTool):
                 tool=self.name,
                 step=1,
             )
-        filtered_tables_upper_case = [x.upper() for x in filtered_tables]
-        db_table_infos = sql_tool_db.db_info.tables if sql_tool_db and sql_tool_db.db_info is not None else []
-        table_schemas = "\n".join(
-            [
-                ("DB.TABLE name: " + s.name + ", Table structure: " + s.structure)
-                for s in db_table_infos
-                if s.name.upper() in filtered_tables_upper_case
-            ]
+        table_schemas = (
+            sql_tool_db.db_info.render_schemas(
+                filtered_tables,
+                token_budget=self.schema_token_budget,
+                count_tokens=tokenizer_service.count_batch,
+                question=query,
+            )
+            if sql_tool_db and sql_tool_db.db_info is not None
+            else ""
         )
         question_messages = [
             SystemMessage(content=self.system_context),
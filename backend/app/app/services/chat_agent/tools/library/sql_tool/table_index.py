@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Embedding index of the SQL tool database tables.
+
+`SQLTool` selects the tables relevant to a question by vector similarity instead of an LLM call over the list of all
+tables, which grows with the schema. Each table is embedded once (name, description and columns, see
+`table_document`) when the index is first searched, or rebuilt after the schema changes. Embeddings are also cached in
+redis by the embedding model, so restarts do not embed the tables again.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from app.schemas.tool_schemas.sql_tool_schema import DatabaseInfo, TableInfo, TableSnippet
+from app.services.chat_agent.helpers.embedding_models import get_embedding_model
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def table_columns(
+    structure: str,
+) -> List[str]:
+    """The column names of a table structure (`CREATE TABLE` statement, as rendered by langchain)."""
+    return TableSnippet.parse("", structure).columns
+
+
+def table_document(
+    table: TableInfo,
+    description: Optional[str] = None,
+) -> str:
+    """The text embedded for a table: its name, description and columns."""
+    description = description or table.description
+    document = f"{table.name}: {description}" if description else table.name
+    columns = table.snippet.columns
+    return f"{document}. Columns: {', '.join(columns)}" if columns else document
+
+
+def parse_table_definitions(
+    table_definitions: str,
+) -> Dict[str, str]:
+    """Table descriptions by name (lowercase) from `name | description` lines (`table_definitions` in tools.yml)."""
+    descriptions = {}
+    for line in table_definitions.splitlines():
+        name, separator, description = line.partition("|")
+        if separator and name.strip() and description.strip() != "description":
+            descriptions[name.strip().lower()] = description.strip()
+    return descriptions
+
+
+class TableIndex:
+    """Embeddings of the tables of a `DatabaseInfo`, searched by cosine similarity."""
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+    ) -> None:
+        self.embeddings = embeddings
+        self._db_info: Optional[DatabaseInfo] = None
+        self._descriptions: Dict[str, str] = {}
+        self._names: List[str] = []
+        self._matrix: Optional[np.ndarray] = None
+        self._lock = asyncio.Lock()
+        self.builds = 0
+        self.build_seconds = 0.0
+        self.searches = 0
+        self.search_seconds = 0.0
+
+    @property
+    def size(
+        self,
+    ) -> int:
+        return len(self._names)
+
+    def is_built(
+        self,
+        db_info: DatabaseInfo,
+        descriptions: Optional[Dict[str, str]] = None,
+    ) -> bool:
+        return self._db_info is db_info and self._descriptions == (descriptions or {})
+
+    async def abuild(
+        self,
+        db_info: DatabaseInfo,
+        descriptions: Optional[Dict[str, str]] = None,
+    ) -> None:
+        """
+        Embed the tables of the database.
+
+        Args:
+            db_info (DatabaseInfo): The tables.
+            descriptions (Optional[Dict[str, str]]): Table descriptions by lowercase name, override the
+                descriptions of `db_info`.
+        """
+        descriptions = descriptions or {}
+        start = time.perf_counter()
+        names = [table.name for table in db_info.tables]
+        documents = [table_document(table, descriptions.get(table.name.lower())) for table in db_info.tables]
+        vectors = await self.embeddings.aembed_documents(documents) if documents else []
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(len(documents), -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self._matrix = matrix / np.where(norms > 0, norms, 1.0)
+        self._names = names
+        self._db_info = db_info
+        self._descriptions = dict(descriptions)
+        self.builds += 1
+        self.build_seconds = time.perf_counter() - start
+        logger.info(f"Built the SQL table index of {len(names)} tables in {self.build_seconds:.2f}s")
+
+    async def asearch(
+        self,
+        query: str,
+        k: int,
+        db_info: DatabaseInfo,
+        descriptions: Optional[Dict[str, str]] = None,
+    ) -> List[Tuple[str, float]]:
+        """
+        The `k` tables most similar to the query, best first, building the index first if needed.
+
+        Returns:
+            List[Tuple[str, float]]: The table names and their cosine similarity with the query.
+        """
+        if not self.is_built(db_info, descriptions):
+            async with self._lock:
+                if not self.is_built(db_info, descriptions):
+                    await self.abuild(db_info, descriptions)
+        if self._matrix is None or not self._names or k <= 0:
+            return []
+        start = time.perf_counter()
+        embedding = np.asarray(await self.embeddings.aembed_query(query), dtype=np.float32)
+        norm = np.linalg.norm(embedding)
+        scores = self._matrix @ (embedding / norm if norm > 0 else embedding)
+        k = min(k, len(self._names))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        self.searches += 1
+        self.search_seconds += time.perf_counter() - start
+        return [(self._names[i], float(scores[i])) for i in top]
+
+    def stats(
+        self,
+    ) -> Dict[str, Any]:
+        return {
+            "tables": self.size,
+            "builds": self.builds,
+            "build_seconds": round(self.build_seconds, 3),
+            "searches": self.searches,
+            "avg_search_ms": round(self.search_seconds * 1000 / self.searches, 2) if self.searches else None,
+        }
+
+
+_table_indexes: Dict[Optional[str], TableIndex] = {}
+
+
+def get_table_index(
+    embedding_model: Optional[str] = None,
+) -> TableIndex:
+    """The table index of an embedding model, shared by all SQL tools of the process."""
+    if embedding_model not in _table_indexes:
+        _table_indexes[embedding_model] = TableIndex(get_embedding_model(embedding_model))
+    return _table_indexes[embedding_model]
+
+
+metrics.register(
+    "sql_table_index",
+    lambda: {str(model or "default"): index.stats() for model, index in _table_indexes.items()},
+)
@@ -12,7 +12,8 @@ from langchain.text_splitter import TokenTextSplitter
 
 from app.schemas.agent_schema import AgentAndToolsConfig
 from app.schemas.tool_schema import ToolConfig, ToolInputSchema
-from app.services.chat_agent.helpers.llm import get_llm, get_token_length
+from app.services.chat_agent.helpers.llm import get_llm
+from app.services.chat_agent.helpers.tokenizer import tokenizer_service
 from app.services.chat_agent.tools.ExtendedBaseTool import ExtendedBaseTool
 
 logger = logging.getLogger(__name__)
@@ -87,7 +88,7 @@ class SummarizerTool(ExtendedBaseTool):
             tool_input = ToolInputSchema.parse_raw(query)
             tool_outputs = [f"{k}: {v}" for k, v in tool_input.intermediate_steps.items()]
             assert self.max_token_length is not None, "max_token_length must not be None"
-            if get_token_length(query) <= self.max_token_length:
+            if await tokenizer_service.acount(query) <= self.max_token_length:
                 docs = [Document(page_content=tool_output) for tool_output in tool_outputs]
                 chain = load_summarize_chain(
                     self.llm,
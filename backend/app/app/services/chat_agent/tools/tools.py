@@ -1,9 +1,16 @@
 # -*- coding: utf-8 -*-
 # pylint: disable=cyclic-import
-from typing import List, Tuple, Type
+from __future__ import annotations
 
+import logging
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from langchain.callbacks.manager import Callbacks
 from langchain.tools import BaseTool
 
+from app.core.config import settings
+from app.schemas.agent_schema import AgentConfig
+from app.services.chat_agent.helpers.llm import get_llm
 from app.services.chat_agent.tools.ExtendedBaseTool import ExtendedBaseTool
 from app.services.chat_agent.tools.library.basellm_tool.basellm_tool import BaseLLM
 from app.services.chat_agent.tools.library.image_generation_tool.image_generation_tool import ImageGenerationTool
@@ -13,6 +20,8 @@ from app.services.chat_agent.tools.library.summarizer_tool.summarizer_tool impor
 from app.services.chat_agent.tools.library.visualizer_tool.visualizer_tool import JsxVisualizerTool
 from app.utils.config_loader import get_agent_config
 
+logger = logging.getLogger(__name__)
+
 
 def get_nested_classes() -> List[Tuple[str, Type[ExtendedBaseTool]]]:
     """separated to avoid circular imports."""
@@ -26,27 +35,9 @@ def get_nested_classes() -> List[Tuple[str, Type[ExtendedBaseTool]]]:
     return nested_classes  # type: ignore
 
 
-def get_tools(tools: List[str], load_nested: bool = True) -> List[BaseTool]:
-    """
-    Retrieves the tools based on a list of tool names.
-
-    This function takes a list of tool names and returns a list of BaseTool objects.
-    It first gets the agent configuration and a list of all available tool classes. It then creates a list of all tools
-    specified in the agent configuration. If any tool name in the input list is not in the list of all tools,
-    it raises a ValueError.
-
-    Args:
-        tools (list[str]): The list of tool names.
-        load_nested (bool): Whether to load nested chains too. Included to avoid circular imports
-
-    Returns:
-        list[BaseTool]: The list of BaseTool objects.
-
-    Raises:
-        ValueError: If any tool name in the input list is not in the list of all tools.
-    """
-    agent_config = get_agent_config()
-    all_tool_classes = [
+def get_all_tool_classes(load_nested: bool = True) -> List[Tuple[str, Type[ExtendedBaseTool]]]:
+    """Returns the (name, class) pairs of all tools known to the agent."""
+    all_tool_classes: List[Tuple[str, Type[ExtendedBaseTool]]] = [
         (
             "sql_tool",
             SQLTool,
@@ -73,8 +64,13 @@ def get_tools(tools: List[str], load_nested: bool = True) -> List[BaseTool]:
     ]
     if load_nested:
         all_tool_classes.extend(get_nested_classes())
+    return all_tool_classes
+
+
+def _build_tools(agent_config: AgentConfig, load_nested: bool = True) -> Dict[str, ExtendedBaseTool]:
+    """Construct every tool enabled in the agent config, keyed by tool name."""
     all_tools: list[ExtendedBaseTool] = [
-        c.from_config(  # type: ignore
+        c.from_config(
             config=agent_config.tools_library.library[name],
             common_config=agent_config.common,
             **({"name": name} if issubclass(c, BaseLLM) else {}),
@@ -82,12 +78,140 @@ def get_tools(tools: List[str], load_nested: bool = True) -> List[BaseTool]:
         for (
             name,
             c,
-        ) in all_tool_classes
+        ) in get_all_tool_classes(load_nested)
         if name in agent_config.tools
     ]
-    tools_map = {tool.name: tool for tool in all_tools}
+    return {tool.name: tool for tool in all_tools}
 
+
+def _check_tool_names(tools: List[str], tools_map: Dict[str, Any]) -> None:
     if any(tool_name not in tools_map for tool_name in tools):
         raise ValueError(f"Invalid tool name(s): {[tool_name for tool_name in tools if tool_name not in tools_map]}")
 
+
+def get_tools(tools: List[str], load_nested: bool = True) -> List[BaseTool]:
+    """
+    Retrieves the tools based on a list of tool names.
+
+    This function takes a list of tool names and returns a list of BaseTool objects.
+    It first gets the agent configuration and a list of all available tool classes. It then creates a list of all tools
+    specified in the agent configuration. If any tool name in the input list is not in the list of all tools,
+    it raises a ValueError.
+
+    Note: this constructs every tool from scratch, prefer `get_tool_registry().bind(...)` on the request path.
+
+    Args:
+        tools (list[str]): The list of tool names.
+        load_nested (bool): Whether to load nested chains too. Included to avoid circular imports
+
+    Returns:
+        list[BaseTool]: The list of BaseTool objects.
+
+    Raises:
+        ValueError: If any tool name in the input list is not in the list of all tools.
+    """
+    tools_map = _build_tools(get_agent_config(), load_nested=load_nested)
+    _check_tool_names(tools, tools_map)
+
     return [tools_map[tool_name] for tool_name in tools]
+
+
+class ToolRegistry:
+    """
+    Process-wide registry of fully constructed tools.
+
+    Tools are built once from the agent config (see `init_tool_registry`, called in the `lifespan` hook) and are
+    shared by all requests, so they must be treated as immutable. Request-scoped state (API key, callbacks, run_id)
+    is attached with `bind`, which returns shallow copies and never touches the registry instances.
+    """
+
+    def __init__(
+        self,
+        agent_config: AgentConfig,
+        tools: Dict[str, ExtendedBaseTool],
+    ) -> None:
+        self._agent_config = agent_config
+        self._tools = tools
+
+    @classmethod
+    def from_agent_config(cls, agent_config: AgentConfig) -> ToolRegistry:
+        """Build all tools enabled in the agent config."""
+        return cls(
+            agent_config=agent_config,
+            tools=_build_tools(agent_config),
+        )
+
+    @property
+    def tool_names(self) -> List[str]:
+        return list(self._tools)
+
+    def get(self, tool_name: str) -> ExtendedBaseTool:
+        """Get the shared instance of a tool, do not mutate it."""
+        _check_tool_names([tool_name], self._tools)
+        return self._tools[tool_name]
+
+    def bind(
+        self,
+        tools: List[str],
+        api_key: Optional[str] = None,
+        callbacks: Callbacks = None,
+        run_id: Optional[str] = None,
+    ) -> List[BaseTool]:
+        """
+        Get the tools for a single run.
+
+        Args:
+            tools (list[str]): The list of tool names.
+            api_key (Optional[str]): The API key of the user, if it differs from the default key the LLMs of the
+                tools are swapped for LLMs using this key.
+            callbacks (Callbacks): Callbacks attached to the tools for this run only.
+            run_id (Optional[str]): The run id, added to the tool metadata for tracing.
+
+        Returns:
+            list[BaseTool]: The bound tools, in the order of `tools`.
+
+        Raises:
+            ValueError: If any tool name in the input list is not in the registry.
+        """
+        _check_tool_names(tools, self._tools)
+
+        update: Dict[str, Any] = {}
+        if api_key and api_key != settings.OPENAI_API_KEY:
+            update["llm"] = get_llm(self._agent_config.common.llm, api_key)
+            update["fast_llm"] = get_llm(self._agent_config.common.fast_llm, api_key)
+        if callbacks is not None:
+            update["callbacks"] = callbacks
+
+        bound_tools: List[BaseTool] = []
+        for tool_name in tools:
+            tool = self._tools[tool_name]
+            tool_update = dict(update)
+            if api_key and "api_key" in type(tool).__fields__:
+                tool_update["api_key"] = api_key  # tools running nested tools bind them to the key (`ChainTool`)
+            if run_id is not None:
+                tool_update["metadata"] = {**(tool.metadata or {}), "run_id": run_id}
+            bound_tools.append(tool.copy(update=tool_update) if tool_update else tool)
+        return bound_tools
+
+
+_tool_registry: Optional[ToolRegistry] = None
+
+
+def init_tool_registry(agent_config: Optional[AgentConfig] = None) -> ToolRegistry:
+    """(Re)build the process-wide tool registry."""
+    global _tool_registry  # pylint: disable=global-statement
+    _tool_registry = ToolRegistry.from_agent_config(agent_config or get_agent_config())
+    logger.info(f"Tool registry initialised with tools: {_tool_registry.tool_names}")
+    return _tool_registry
+
+
+def get_tool_registry() -> ToolRegistry:
+    """Get the process-wide tool registry, building it on first use."""
+    if _tool_registry is None:
+        return init_tool_registry()
+    return _tool_registry
+
+
+def clear_tool_registry() -> None:
+    global _tool_registry  # pylint: disable=global-statement
+    _tool_registry = None
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+Admission control for agent runs.
+
+Caps the runs in flight per user (a Redis counter, so the cap holds across API workers) and per worker process. Runs
+over a cap wait in a FIFO queue for up to `queue_timeout` seconds while the stream reports their position, and are
+rejected (HTTP 429 with `Retry-After`, or an in-stream error once the stream started) when the deadline passes or
+when too many runs are already waiting.
+
+Redis errors fail open: the per-worker cap still applies, the per-user cap is skipped.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from collections import deque
+from typing import Callable, Deque, Dict
+
+from app.api.deps import get_redis_client
+from app.core.config import settings
+from app.utils.exceptions.common_exceptions import AdmissionRejectedException
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# increments the counter of a user if it is below the cap, the counter expires in case a worker dies holding slots
+_ACQUIRE_SCRIPT = """
+local n = tonumber(redis.call('GET', KEYS[1]) or '0')
+if n >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+_RELEASE_SCRIPT = """
+local n = tonumber(redis.call('GET', KEYS[1]) or '0')
+if n > 0 then
+    return redis.call('DECR', KEYS[1])
+end
+return 0
+"""
+
+
+class AdmissionController:
+    """Per-user and per-worker caps of the agent runs in flight, with a brief FIFO queue."""
+
+    def __init__(
+        self,
+        max_runs_per_user: int,
+        max_runs_per_worker: int,
+        queue_timeout: float,
+        max_queued: int,
+        retry_after: int,
+        slot_ttl: int = 900,
+        poll_interval: float = 0.25,
+    ) -> None:
+        """
+        Args:
+            max_runs_per_user (int): Runs in flight per user across all workers, 0 for no limit.
+            max_runs_per_worker (int): Runs in flight per worker process, 0 for no limit.
+            queue_timeout (float): Seconds a run waits for admission before it is rejected, 0 to reject immediately.
+            max_queued (int): Maximum number of runs waiting per worker, further runs are rejected immediately.
+            retry_after (int): Seconds clients are asked to wait before retrying a rejected run.
+            slot_ttl (int): Seconds after which the per-user counter expires if it is not updated (e.g. crashed worker).
+            poll_interval (float): Seconds between admission attempts of a waiting run.
+        """
+        self.max_runs_per_user = max_runs_per_user
+        self.max_runs_per_worker = max_runs_per_worker
+        self.queue_timeout = queue_timeout
+        self.max_queued = max_queued
+        self.retry_after = retry_after
+        self.slot_ttl = slot_ttl
+        self.poll_interval = poll_interval
+        self.in_flight = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self._waiters: Deque[str] = deque()
+
+    @staticmethod
+    def _user_key(
+        user_key: str,
+    ) -> str:
+        return f"admission:runs:{user_key}"
+
+    @staticmethod
+    def _queue_key(
+        user_key: str,
+    ) -> str:
+        return f"admission:queue:{user_key}"
+
+    def can_queue(
+        self,
+    ) -> bool:
+        return self.queue_timeout > 0 and len(self._waiters) < self.max_queued
+
+    async def atry_acquire(
+        self,
+        user_key: str,
+        waiting: bool = False,
+    ) -> bool:
+        """Take a slot for a run if the user and the worker are below their caps."""
+        if not waiting and self._waiters:
+            return False  # do not overtake waiting runs
+        if self.max_runs_per_worker > 0 and self.in_flight >= self.max_runs_per_worker:
+            return False
+        # reserve the worker slot before the redis round-trip, so concurrent runs do not overshoot the worker cap
+        self.in_flight += 1
+        if self.max_runs_per_user > 0:
+            try:
+                redis_client = await get_redis_client()
+                acquired = await redis_client.eval(
+                    _ACQUIRE_SCRIPT, 1, self._user_key(user_key), self.max_runs_per_user, self.slot_ttl
+                )
+            except asyncio.CancelledError:
+                self.in_flight -= 1
+                raise
+            except Exception as e:
+                logger.warning(f"Admission control without per-user limits, redis failed: {e!r}")
+            else:
+                if not int(acquired):
+                    self.in_flight -= 1
+                    return False
+        self.admitted += 1
+        return True
+
+    async def arelease(
+        self,
+        user_key: str,
+    ) -> None:
+        """Release the slot of a finished run."""
+        self.release_worker_slot()
+        await self.arelease_user_slot(user_key)
+
+    def release_worker_slot(
+        self,
+    ) -> None:
+        """Release the per-worker slot of a run, e.g. once the run is handed over to an agent worker."""
+        self.in_flight = max(self.in_flight - 1, 0)
+
+    async def arelease_user_slot(
+        self,
+        user_key: str,
+    ) -> None:
+        """Release the per-user slot of a run, on the process that finishes the run."""
+        if self.max_runs_per_user > 0:
+            try:
+                redis_client = await get_redis_client()
+                await redis_client.eval(_RELEASE_SCRIPT, 1, self._user_key(user_key))
+            except Exception as e:
+                logger.warning(f"Could not release the admission slot of {user_key}: {e!r}")
+
+    async def _auser_position(
+        self,
+        user_key: str,
+        ticket: str,
+    ) -> int:
+        """Number of runs of the user waiting ahead of a run, across all workers."""
+        if self.max_runs_per_user <= 0:
+            return 0
+        try:
+            redis_client = await get_redis_client()
+            queue_key = self._queue_key(user_key)
+            async with redis_client.pipeline(transaction=False) as pipeline:
+                pipeline.zremrangebyscore(queue_key, "-inf", time.time())  # runs past their deadline
+                pipeline.zrank(queue_key, ticket)
+                _, position = await pipeline.execute()
+            return position or 0
+        except Exception as e:
+            logger.warning(f"Could not read the admission queue of {user_key}: {e!r}")
+            return 0
+
+    def _worker_position(
+        self,
+        ticket: str,
+    ) -> int:
+        """Number of runs waiting ahead of a run on this worker."""
+        return self._waiters.index(ticket)
+
+    async def await_admission(
+        self,
+        user_key: str,
+        on_position: Callable[[int], None],
+    ) -> None:
+        """
+        Wait in the queue until a slot is free.
+
+        Args:
+            user_key (str): The user of the run.
+            on_position (Callable[[int], None]): Called with the (1-based) queue position whenever it changes.
+
+        Raises:
+            AdmissionRejectedException: If the run was not admitted within `queue_timeout` seconds.
+        """
+        ticket = uuid.uuid4().hex
+        deadline = time.time() + self.queue_timeout
+        self._waiters.append(ticket)
+        self.queued += 1
+        redis_client = None
+        try:
+            if self.max_runs_per_user > 0:
+                try:
+                    redis_client = await get_redis_client()
+                    queue_key = self._queue_key(user_key)
+                    async with redis_client.pipeline(transaction=False) as pipeline:
+                        pipeline.zadd(queue_key, {ticket: deadline})
+                        pipeline.expire(queue_key, int(self.queue_timeout) + 1)
+                        await pipeline.execute()
+                except Exception as e:
+                    logger.warning(f"Could not join the admission queue of {user_key}: {e!r}")
+            last_position = None
+            while time.time() < deadline:
+                position = max(await self._auser_position(user_key, ticket), self._worker_position(ticket))
+                if position == 0 and await self.atry_acquire(user_key, waiting=True):
+                    return
+                if position + 1 != last_position:  # runs ahead plus the run itself
+                    last_position = position + 1
+                    on_position(last_position)
+                await asyncio.sleep(self.poll_interval)
+            self.rejected += 1
+            raise AdmissionRejectedException(
+                "Too many concurrent requests, please try again later.",
+                retry_after=self.retry_after,
+            )
+        finally:
+            self._waiters.remove(ticket)
+            if redis_client is not None:
+                try:
+                    await redis_client.zrem(self._queue_key(user_key), ticket)
+                except Exception as e:
+                    logger.warning(f"Could not leave the admission queue of {user_key}: {e!r}")
+
+    def reject(
+        self,
+    ) -> AdmissionRejectedException:
+        """The rejection of a run that can not be queued."""
+        self.rejected += 1
+        return AdmissionRejectedException(
+            "Too many concurrent requests, please try again later.",
+            retry_after=self.retry_after,
+        )
+
+    def stats(
+        self,
+    ) -> Dict[str, int]:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+        }
+
+
+admission_controller = AdmissionController(
+    max_runs_per_user=settings.ADMISSION_MAX_RUNS_PER_USER,
+    max_runs_per_worker=settings.ADMISSION_MAX_RUNS_PER_WORKER,
+    queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT,
+    max_queued=settings.ADMISSION_MAX_QUEUED,
+    retry_after=settings.ADMISSION_RETRY_AFTER,
+)
+metrics.register("admission", admission_controller.stats)
@@ -11,3 +11,32 @@ class AgentCancelledException(Exception):
         super().__init__(detail)
         self.detail = detail
         self.headers = headers
+
+
+class SQLQueryTimeoutException(Exception):
+    def __init__(
+        self,
+        detail: Optional[str] = None,
+    ) -> None:
+        super().__init__(detail)
+        self.detail = detail
+
+
+class SQLQueryCostException(Exception):
+    def __init__(
+        self,
+        detail: Optional[str] = None,
+    ) -> None:
+        super().__init__(detail)
+        self.detail = detail
+
+
+class AdmissionRejectedException(Exception):
+    def __init__(
+        self,
+        detail: Optional[str] = None,
+        retry_after: int = 1,
+    ) -> None:
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
@@ -39,13 +39,11 @@ would result in the default value not being used.
 
 Reference: https://gist.github.com/ddanier/ead419826ac6c3d75c96f9d89bea9bd0
 """
-from collections.abc import Awaitable, Callable
-from contextvars import ContextVar, copy_context
+import asyncio
+from contextvars import ContextVar
 from typing import Any
 
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
-from starlette.types import ASGIApp
+from starlette.types import ASGIApp, Receive, Scope, Send
 
 
 class Globals:
@@ -155,38 +153,35 @@ class Globals:
         self._vars[name].set(value)
 
 
-async def globals_middleware_dispatch(
-    request: Request,
-    call_next: Callable,
-) -> Response:
-    """Dispatch the request in a new context to allow globals to be used."""
+class GlobalsMiddleware:
+    """
+    Pure ASGI middleware running every request in a copy of the context, so that globals set while handling a
+    request (including its streamed response) are isolated from other requests.
 
-    ctx = copy_context()
-
-    def _call_next() -> Awaitable[Response]:
-        return call_next(request)
-
-    return await ctx.run(_call_next)
-
-
-class GlobalsMiddleware(BaseHTTPMiddleware):  # noqa
-    """Middleware to setup the globals context using globals_middleware_dispatch()."""
+    Unlike a `BaseHTTPMiddleware`, it does not wrap the response, the chunks of streamed responses are sent directly.
+    """
 
     def __init__(
         self,
         app: ASGIApp,
     ) -> None:
-        super().__init__(
-            app,
-            globals_middleware_dispatch,
-        )
+        self.app = app
 
-    async def dispatch(
+    async def __call__(
         self,
-        request: Request,
-        call_next: RequestResponseEndpoint,
-    ) -> Response:
-        return await call_next(request)
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+    ) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        async def call_app() -> None:
+            await self.app(scope, receive, send)
+
+        # a task runs in a copy of the current context, cancelling the request cancels the task
+        await asyncio.create_task(call_app())
 
 
 g = Globals()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Lightweight per-worker metrics.
+
+Components register a collector (a callable returning a flat dict of counters/gauges) under a name, all collectors
+are exposed at `GET /statistics/metrics`. Values are per worker process, aggregate them in your monitoring stack.
+
+# Usage
+```python
+from app.utils.metrics import metrics
+
+metrics.register("llm_client_cache", llm_client_cache.stats)
+```
+"""
+import logging
+import threading
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+MetricsCollector = Callable[[], Dict[str, Any]]
+
+
+class MetricsRegistry:
+    """Registry of named metrics collectors."""
+
+    def __init__(
+        self,
+    ) -> None:
+        self._collectors: Dict[str, MetricsCollector] = {}
+        self._lock = threading.Lock()
+
+    def register(
+        self,
+        name: str,
+        collector: MetricsCollector,
+    ) -> None:
+        """Register (or replace) the collector for a component."""
+        with self._lock:
+            self._collectors[name] = collector
+
+    def unregister(
+        self,
+        name: str,
+    ) -> None:
+        with self._lock:
+            self._collectors.pop(name, None)
+
+    def collect(
+        self,
+    ) -> Dict[str, Dict[str, Any]]:
+        """Collect the current values of all registered collectors."""
+        with self._lock:
+            collectors = dict(self._collectors)
+        collected: Dict[str, Dict[str, Any]] = {}
+        for name, collector in collectors.items():
+            try:
+                collected[name] = collector()
+            except Exception as e:
+                logger.warning(f"Failed to collect metrics for {name}: {repr(e)}")
+        return collected
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Shared redis connection pools.
+
+All redis clients of a process (`app.api.deps.get_redis_client`, `get_redis_client_sync`, the `RedisStore` of the
+embedding cache and the `RedisCache` of the LLM cache) borrow connections from the pools of `redis_pools`, instead of
+opening a new pool (and new connections) per call. There is one pool per database and response decoding, binary
+payloads (e.g. the cached embeddings) use the pools with `decode_responses=False`.
+
+Asyncio connections are bound to the event loop they were opened on, so the async pools are kept per event loop
+(the API has one loop, agent workers run their runs on the `AgentWorkerLoop`). The pools of the API loop are opened
+and closed in the `lifespan` hook, pools of other loops are opened lazily.
+
+# Usage
+```python
+from app.utils.redis_pool import redis_pools
+
+redis_client = redis_pools.client()
+async with redis_client.pipeline(transaction=False) as pipeline:
+    pipeline.set("key", "value")
+    pipeline.expire("key", 60)
+    await pipeline.execute()
+```
+"""
+import asyncio
+import logging
+import threading
+import weakref
+from typing import Any, Dict, List, Tuple
+
+import redis
+import redis.asyncio as aioredis
+
+from app.core.config import settings
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+PoolKey = Tuple[int, bool]  # (db, decode_responses)
+
+
+class RedisPools:
+    """The redis connection pools of a process, by event loop (async pools), database and response decoding."""
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        max_connections: int,
+        socket_timeout: float,
+    ) -> None:
+        """
+        Args:
+            host (str): The redis host.
+            port (int): The redis port.
+            max_connections (int): Maximum number of connections per pool.
+            socket_timeout (float): Seconds before a connection attempt times out.
+        """
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.socket_timeout = socket_timeout
+        self._async_pools: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, Dict[PoolKey, aioredis.ConnectionPool]
+        ] = weakref.WeakKeyDictionary()
+        self._sync_pools: Dict[PoolKey, redis.ConnectionPool] = {}
+        self._lock = threading.Lock()
+
+    def _pool_kwargs(
+        self,
+        db: int,
+        decode_responses: bool,
+    ) -> Dict[str, Any]:
+        return {
+            "host": self.host,
+            "port": self.port,
+            "db": db,
+            "decode_responses": decode_responses,
+            "encoding": "utf8",
+            "max_connections": self.max_connections,
+            "socket_connect_timeout": self.socket_timeout,
+            "health_check_interval": 30,
+        }
+
+    def async_pool(
+        self,
+        db: int = 0,
+        decode_responses: bool = True,
+    ) -> aioredis.ConnectionPool:
+        """The async pool of the running event loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            pools = self._async_pools.setdefault(loop, {})
+            key = (db, decode_responses)
+            if key not in pools:
+                pools[key] = aioredis.ConnectionPool(**self._pool_kwargs(db, decode_responses))
+            return pools[key]
+
+    def sync_pool(
+        self,
+        db: int = 0,
+        decode_responses: bool = True,
+    ) -> redis.ConnectionPool:
+        with self._lock:
+            key = (db, decode_responses)
+            if key not in self._sync_pools:
+                self._sync_pools[key] = redis.ConnectionPool(**self._pool_kwargs(db, decode_responses))
+            return self._sync_pools[key]
+
+    def client(
+        self,
+        db: int = 0,
+        decode_responses: bool = True,
+    ) -> aioredis.Redis:
+        """An async client on the shared pool, creating it is cheap (no connection is opened)."""
+        return aioredis.Redis(connection_pool=self.async_pool(db, decode_responses))
+
+    def sync_client(
+        self,
+        db: int = 0,
+        decode_responses: bool = True,
+    ) -> redis.Redis:
+        return redis.Redis(connection_pool=self.sync_pool(db, decode_responses))
+
+    def open(
+        self,
+    ) -> None:
+        """Create the default pools of the running event loop (called in the `lifespan` hook)."""
+        self.async_pool()
+        self.async_pool(decode_responses=False)
+
+    async def aclose(
+        self,
+    ) -> None:
+        """Disconnect the async pools of the running event loop and the sync pools."""
+        with self._lock:
+            pools = self._async_pools.pop(asyncio.get_running_loop(), {})
+            sync_pools, self._sync_pools = self._sync_pools, {}
+        for pool in pools.values():
+            await pool.disconnect()
+        for sync_pool in sync_pools.values():
+            sync_pool.disconnect()
+
+    def stats(
+        self,
+    ) -> Dict[str, Any]:
+        with self._lock:
+            pools: List[Tuple[str, Any]] = [
+                (f"async_db{db}{'' if decode else '_binary'}", pool)
+                for loop_pools in self._async_pools.values()
+                for (db, decode), pool in loop_pools.items()
+            ]
+            pools += [
+                (f"sync_db{db}{'' if decode else '_binary'}", pool) for (db, decode), pool in self._sync_pools.items()
+            ]
+        stats: Dict[str, Any] = {"max_connections": self.max_connections}
+        for name, pool in pools:  # summed over the event loops
+            created = getattr(pool, "_created_connections", 0)
+            in_use = len(getattr(pool, "_in_use_connections", ()))
+            stats[f"{name}_created"] = stats.get(f"{name}_created", 0) + created
+            stats[f"{name}_in_use"] = stats.get(f"{name}_in_use", 0) + in_use
+        return stats
+
+
+redis_pools = RedisPools(
+    host=settings.REDIS_HOST,
+    port=settings.REDIS_PORT,
+    max_connections=settings.REDIS_MAX_CONNECTIONS,
+    socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+)
+metrics.register("redis_pools", redis_pools.stats)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Timings of the start up of a worker process.
+
+The steps of the `lifespan` hook (and background start up work such as the SQL tool schema introspection) are timed,
+logged as one report once the worker serves traffic and exposed at `GET /statistics/metrics` under "startup".
+
+# Usage
+```python
+from app.utils.startup_timing import startup_timings
+
+with startup_timings.measure("tool_registry"):
+    init_tool_registry(agent_config)
+logger.info(startup_timings.report())
+```
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator
+
+from app.utils.metrics import metrics
+
+
+class StartupTimings:
+    """Durations of named start up steps, in the order they were recorded."""
+
+    def __init__(
+        self,
+    ) -> None:
+        self._created = time.perf_counter()
+        self._timings: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(
+        self,
+        step: str,
+    ) -> Iterator[None]:
+        """Time the block as `step`, also if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(step, time.perf_counter() - start)
+
+    def record(
+        self,
+        step: str,
+        seconds: float,
+    ) -> None:
+        with self._lock:
+            self._timings[step] = seconds
+
+    def report(
+        self,
+    ) -> str:
+        """One line with the duration of each step and the time since the process imported this module."""
+        with self._lock:
+            steps = ", ".join(f"{step} {seconds:.2f}s" for step, seconds in self._timings.items())
+        return f"Worker {os.getpid()} started in {time.perf_counter() - self._created:.2f}s ({steps})"
+
+    def stats(
+        self,
+    ) -> Dict[str, Any]:
+        with self._lock:
+            return {step: round(seconds, 3) for step, seconds in self._timings.items()}
+
+
+startup_timings = StartupTimings()
+metrics.register("startup", startup_timings.stats)
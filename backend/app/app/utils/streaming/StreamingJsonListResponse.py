@@ -6,6 +6,8 @@ from fastapi.encoders import jsonable_encoder
 from starlette.background import BackgroundTask
 from starlette.responses import StreamingResponse
 
+from app.utils.streaming.protocol import STREAM_PROTOCOL_HEADER, StreamEncoderV2
+
 
 async def async_enumerate(
     async_sequence: AsyncIterable,
@@ -27,6 +29,9 @@ class StreamingJsonListResponse(StreamingResponse):
     Converts a pydantic model generator into a streaming HTTP Response that streams a
     JSON list, one element at a time.
 
+    With `protocol=2`, the elements are written in the compact wire protocol version 2 (see
+    `app.utils.streaming.protocol`).
+
     See https://github.com/tiangolo/fastapi/issues/1978
     """
 
@@ -42,8 +47,18 @@ class StreamingJsonListResponse(StreamingResponse):
         ] = None,
         media_type: Optional[str] = None,
         background: Optional[BackgroundTask] = None,
+        protocol: int = 1,
     ) -> None:
-        if isinstance(
+        if protocol == 2:
+            headers = {**(headers or {}), STREAM_PROTOCOL_HEADER: "2"}
+            if isinstance(
+                content_generator,
+                AsyncIterable,
+            ):
+                body_iterator = self._encoded_async_generator_v2(content_generator)
+            else:
+                body_iterator = self._encoded_generator_v2(content_generator)
+        elif isinstance(
             content_generator,
             AsyncIterable,
         ):
@@ -82,3 +97,26 @@ class StreamingJsonListResponse(StreamingResponse):
             if idx > 0:
                 yield "\n"
             yield json.dumps(jsonable_encoder(item.dict()))
+
+    @staticmethod
+    async def _encoded_async_generator_v2(
+        async_generator: AsyncIterable,
+    ) -> AsyncIterable[str]:
+        """Converts an asynchronous StreamingData generator into a protocol version 2
+        stream."""
+        encoder = StreamEncoderV2()
+        async for idx, item in async_enumerate(async_generator):
+            yield ("\n" if idx > 0 else "") + encoder.encode(item)
+
+    @staticmethod
+    async def _encoded_generator_v2(
+        generator: Iterable,
+    ) -> AsyncIterable[str]:
+        """Converts a synchronous StreamingData generator into a protocol version 2
+        stream."""
+        encoder = StreamEncoderV2()
+        for (
+            idx,
+            item,
+        ) in enumerate(generator):
+            yield ("\n" if idx > 0 else "") + encoder.encode(item)
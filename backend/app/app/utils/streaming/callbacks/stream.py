@@ -2,8 +2,9 @@
 from __future__ import annotations
 
 import asyncio
+import logging
 from datetime import datetime
-from typing import Any, AsyncIterator, Dict, List, Literal, Optional, Union, cast
+from typing import Any, AsyncIterator, Dict, List, Optional
 from uuid import UUID
 
 from langchain.callbacks.base import AsyncCallbackHandler
@@ -11,8 +12,15 @@ from langchain.globals import get_llm_cache
 from langchain.schema import AgentFinish, LLMResult
 from langchain.schema.messages import BaseMessage
 
+from app.core.config import settings
 from app.schemas.streaming_schema import StreamingData, StreamingDataTypeEnum, StreamingSignalsEnum
+from app.services.chat_agent.helpers.run_helper import stop_run
+from app.utils.exceptions.common_exceptions import AdmissionRejectedException, AgentCancelledException
 from app.utils.fastapi_globals import g
+from app.utils.streaming.channel import StreamChannel, merge_llm_tokens, streaming_data_nbytes
+from app.utils.streaming.run_events import RunEventPublisher
+
+logger = logging.getLogger(__name__)
 
 
 # pylint: disable=too-many-ancestors
@@ -24,8 +32,9 @@ class AsyncIteratorCallbackHandler(AsyncCallbackHandler):
     asynchronous iteration over received data.
     """
 
-    queue: asyncio.Queue[StreamingData]
-    done: asyncio.Event
+    channel: StreamChannel[StreamingData]
+    publisher: Optional[RunEventPublisher] = None
+    agent_task: Optional[asyncio.Task] = None
     run_id_cached: dict[str, bool] = {}
 
     @property
@@ -42,16 +51,49 @@ class AsyncIteratorCallbackHandler(AsyncCallbackHandler):
 
     def __init__(
         self,
+        publish: Optional[bool] = None,
+        local_stream: bool = True,
+        owner: Optional[str] = None,
     ) -> None:
         """
-        queue (asyncio.Queue): A queue to hold streaming data until the agent is done.
+        Args:
+            publish (Optional[bool]): Whether to publish the events to the Redis Stream of the run, defaults to
+                RUN_EVENTS_STREAM_ENABLED.
+            local_stream (bool): Whether to buffer the events for `aiter`, disabled on agent workers, which only
+                publish the events.
+            owner (Optional[str]): The user who started the run, the only one allowed to read its published events.
+
+        channel (StreamChannel): A channel to hold streaming data until the agent is done, closing it signals the
+            completion of data streaming. Consecutive LLM tokens are coalesced if STREAM_COALESCE_DELAY is set. The
+            channel holds at most about STREAM_BUFFER_MAX_BYTES, beyond that LLM tokens are merged, and if the client
+            does not catch up within STREAM_BUFFER_STALL_TIMEOUT seconds, the stream is dropped and the run cancelled.
 
-        done (asyncio.Event): An event that signals the completion of data streaming.
+        publisher (Optional[RunEventPublisher]): Appends the events to the Redis Stream of the run if
+            RUN_EVENTS_STREAM_ENABLED is set, so that clients can resume the stream.
+
+        agent_task (Optional[asyncio.Task]): The task running the agent, cancelled when the stream is dropped.
         """
-        self.queue = asyncio.Queue()
-        self.done = asyncio.Event()
+        self.channel = StreamChannel(
+            merge=merge_llm_tokens,
+            size=lambda item: len(item.data),
+            max_delay=settings.STREAM_COALESCE_DELAY,
+            max_size=settings.STREAM_COALESCE_MAX_CHARS,
+            nbytes=streaming_data_nbytes,
+            max_bytes=settings.STREAM_BUFFER_MAX_BYTES,
+            stall_timeout=settings.STREAM_BUFFER_STALL_TIMEOUT,
+            on_stall=self._on_stall,
+        )
+        self._stop_run_task: Optional[asyncio.Task] = None
         query_context = g.query_context or {}
-        self.queue.put_nowait(
+        self.run_id = query_context.get("run_id")
+        self.local_stream = local_stream
+        if not local_stream:
+            self.channel.discard()
+        if publish is None:
+            publish = settings.RUN_EVENTS_STREAM_ENABLED
+        if publish and self.run_id is not None:
+            self.publisher = RunEventPublisher(self.run_id, owner=owner)
+        self._put(
             StreamingData(
                 data=StreamingSignalsEnum.START.value,
                 data_type=StreamingDataTypeEnum.SIGNAL,
@@ -59,6 +101,41 @@ class AsyncIteratorCallbackHandler(AsyncCallbackHandler):
             )
         )
 
+    def _put(
+        self,
+        item: StreamingData,
+    ) -> None:
+        if self.local_stream:
+            self.channel.put_nowait(item)
+        if self.publisher is not None:
+            self.publisher.publish(item)
+
+    def _close(
+        self,
+    ) -> None:
+        self.channel.close()
+        if self.publisher is not None:
+            self.publisher.close()
+
+    async def aclose_publisher(
+        self,
+    ) -> None:
+        """Wait until all events are published to the Redis Stream of the run."""
+        if self.publisher is not None:
+            await self.publisher.aclose()
+
+    def _on_stall(
+        self,
+    ) -> None:
+        """Cancel the run of a client that stopped reading the stream."""
+        logger.warning(f"Stream buffer of run {self.run_id} is full, dropping the client and cancelling the run.")
+        if self.publisher is not None:
+            self.publisher.close()
+        if self.run_id is not None:
+            self._stop_run_task = asyncio.create_task(stop_run(self.run_id))
+        if self.agent_task is not None:
+            self.agent_task.cancel()
+
     async def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> None:
         if self.llm_cache_enabled:
             self.run_id_cached[str(kwargs.get("run_id"))] = True
@@ -77,7 +154,7 @@ class AsyncIteratorCallbackHandler(AsyncCallbackHandler):
             self.run_id_cached[str(kwargs.get("run_id"))] = False
 
         query_context = g.query_context or {}
-        self.queue.put_nowait(
+        self._put(
             StreamingData(
                 data=token,
                 data_type=StreamingDataTypeEnum.LLM,
@@ -99,7 +176,7 @@ class AsyncIteratorCallbackHandler(AsyncCallbackHandler):
         if self.llm_cache_enabled and self.run_id_cached[str(kwargs.get("run_id"))]:
             for generation in response.generations:
                 for token in generation:
-                    self.queue.put_nowait(
+                    self._put(
                         StreamingData(
                             data=token.text,
                             data_type=StreamingDataTypeEnum.LLM,
@@ -108,7 +185,7 @@ class AsyncIteratorCallbackHandler(AsyncCallbackHandler):
                     )
             del self.run_id_cached[str(kwargs.get("run_id"))]
 
-        self.queue.put_nowait(
+        self._put(
             StreamingData(
                 data=StreamingSignalsEnum.LLM_END.value,
                 data_type=StreamingDataTypeEnum.SIGNAL,
@@ -128,9 +205,9 @@ class AsyncIteratorCallbackHandler(AsyncCallbackHandler):
         """
         Callback for when an error occurs during streaming.
 
-        The error is queued for streaming and done flag is set to signal completion.
+        The error is queued for streaming and the channel is closed to signal completion.
         """
-        self.queue.put_nowait(
+        self._put(
             StreamingData(
                 data=repr(error),
                 data_type=StreamingDataTypeEnum.LLM,
@@ -138,7 +215,55 @@ class AsyncIteratorCallbackHandler(AsyncCallbackHandler):
             )
         )
         await asyncio.sleep(1)
-        self.done.set()
+        self._close()
+
+    def on_cancelled(
+        self,
+    ) -> None:
+        """
+        Callback for when the task running the agent is cancelled (e.g. by `stop_run`).
+
+        The cancellation is queued for streaming and the channel is closed right away, the run stopped already.
+        """
+        self._put(
+            StreamingData(
+                data=repr(AgentCancelledException("The agent is cancelled.")),
+                data_type=StreamingDataTypeEnum.LLM,
+                metadata={**(g.query_context or {})},
+            )
+        )
+        self._close()
+
+    def on_queued(
+        self,
+        position: int,
+    ) -> None:
+        """Signal the queue position of a run waiting for admission."""
+        self._put(
+            StreamingData(
+                data=StreamingSignalsEnum.QUEUED.value,
+                data_type=StreamingDataTypeEnum.SIGNAL,
+                metadata={"position": position, **(g.query_context or {})},
+            )
+        )
+
+    async def on_rejected(
+        self,
+        error: AdmissionRejectedException,
+    ) -> None:
+        """
+        Callback for when a queued run is not admitted.
+
+        The error is queued for streaming along with the seconds after which the client may retry.
+        """
+        self._put(
+            StreamingData(
+                data=repr(error),
+                data_type=StreamingDataTypeEnum.LLM,
+                metadata={"error": "too_many_requests", "retry_after": error.retry_after, **(g.query_context or {})},
+            )
+        )
+        self._close()
 
     async def on_tool_start(
         self,
@@ -153,7 +278,7 @@ class AsyncIteratorCallbackHandler(AsyncCallbackHandler):
         kwargs["tool"] = serialized["name"]
         kwargs["step"] = 0
         kwargs["time"] = datetime.now()
-        self.queue.put_nowait(
+        self._put(
             StreamingData(
                 data=serialized["name"],
                 data_type=StreamingDataTypeEnum.ACTION,
@@ -168,7 +293,7 @@ class AsyncIteratorCallbackHandler(AsyncCallbackHandler):
     ) -> None:
         """Run when tool ends running."""
         kwargs["tool"] = kwargs["name"]
-        self.queue.put_nowait(
+        self._put(
             StreamingData(
                 data=StreamingSignalsEnum.TOOL_END.value,
                 data_type=StreamingDataTypeEnum.SIGNAL,
@@ -193,7 +318,7 @@ class AsyncIteratorCallbackHandler(AsyncCallbackHandler):
             "tags": tags,
             "error": repr(error),
         }
-        self.queue.put_nowait(
+        self._put(
             StreamingData(
                 data="error",
                 data_type=StreamingDataTypeEnum.ACTION,
@@ -214,7 +339,7 @@ class AsyncIteratorCallbackHandler(AsyncCallbackHandler):
         if data_type is not None:
             if data_type == StreamingDataTypeEnum.ACTION:
                 text = text.upper()
-            self.queue.put_nowait(
+            self._put(
                 StreamingData(
                     data=text,
                     data_type=data_type,
@@ -228,7 +353,7 @@ class AsyncIteratorCallbackHandler(AsyncCallbackHandler):
         **kwargs: Any,
     ) -> None:
         """Run on agent end."""
-        self.queue.put_nowait(
+        self._put(
             StreamingData(
                 data=StreamingSignalsEnum.END.value,
                 data_type=StreamingDataTypeEnum.SIGNAL,
@@ -236,48 +361,14 @@ class AsyncIteratorCallbackHandler(AsyncCallbackHandler):
             )
         )
         await asyncio.sleep(0.1)
-        self.done.set()
+        self._close()
 
     async def aiter(
         self,
     ) -> AsyncIterator[StreamingData]:
-        """Allow streams to be stopped (e.g. on errors or cancelation) via done flag."""
-        while not self.queue.empty() or not self.done.is_set():
-            # Wait for the next token in the queue,
-            # but stop waiting if the done event is set
-            (
-                done,
-                other,
-            ) = await asyncio.wait(
-                [
-                    # NOTE: If you add other tasks here, update the code below,
-                    # which assumes each set has exactly one task each
-                    asyncio.ensure_future(self.queue.get()),
-                    asyncio.ensure_future(self.done.wait()),
-                ],
-                return_when=asyncio.FIRST_COMPLETED,
-            )
-
-            # Cancel the other task
-            while len(other) > 0:
-                other.pop().cancel()
-
-            while len(done) > 0:
-                # Extract the value of the first completed task
-                token_or_done = cast(
-                    Union[
-                        StreamingData,
-                        Literal[True],
-                    ],
-                    done.pop().result(),
-                )
-
-                # If the extracted value is the boolean True, the done event was set
-                if token_or_done is True:
-                    break
-
-                # Otherwise, the extracted value is a token, which we yield
-                yield token_or_done
+        """Allow streams to be stopped (e.g. on errors or cancelation) by closing the channel."""
+        async for item in self.channel:
+            yield item
 
     async def on_chat_model_start(
         self,
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+Low-overhead single-consumer channel for streaming events.
+
+Producers (the callback handler) append items without awaiting, a single consumer (the HTTP response) iterates over
+them. The consumer parks on one future that is resolved by the next `put_nowait` or by `close`, instead of creating
+and cancelling a `queue.get()` and a `done.wait()` task for every token. Closing the channel appends an end-of-stream
+sentinel, so items put before `close` are always delivered.
+
+Optionally, consecutive mergeable items (LLM tokens of the same run) are coalesced until `max_delay` seconds passed or
+`max_size` characters are buffered, which reduces the number of events written per response.
+
+Channels can be bounded to `max_bytes` buffered bytes. Producers never block: once the bound is reached, new items
+are merged into the last buffered item where possible (consecutive LLM tokens) and appended otherwise. If the consumer
+does not bring the buffer back under the bound within `stall_timeout` seconds, the channel drops its items, ends the
+stream and calls `on_stall` (which cancels the run).
+"""
+import asyncio
+import threading
+from collections import deque
+from typing import AsyncIterator, Callable, Deque, Dict, Generic, Optional, Tuple, TypeVar
+
+from app.schemas.streaming_schema import StreamingData, StreamingDataTypeEnum
+from app.utils.metrics import metrics
+
+T = TypeVar("T")
+
+_END_OF_STREAM = object()
+
+STREAMING_DATA_OVERHEAD = 256  # approximate bytes of the metadata of an event, which is not serialized to measure it
+
+
+class StreamBufferStats:
+    """Per-worker gauges and counters of the stream buffers."""
+
+    def __init__(
+        self,
+    ) -> None:
+        self._lock = threading.Lock()
+        self.buffered_bytes = 0
+        self.open_channels = 0
+        self.overflow_merges = 0
+        self.stalled_clients = 0
+
+    def add(
+        self,
+        nbytes: int = 0,
+        channels: int = 0,
+        overflow_merges: int = 0,
+        stalled_clients: int = 0,
+    ) -> None:
+        with self._lock:
+            self.buffered_bytes += nbytes
+            self.open_channels += channels
+            self.overflow_merges += overflow_merges
+            self.stalled_clients += stalled_clients
+
+    def stats(
+        self,
+    ) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "buffered_bytes": self.buffered_bytes,
+                "open_channels": self.open_channels,
+                "overflow_merges": self.overflow_merges,
+                "stalled_clients": self.stalled_clients,
+            }
+
+
+stream_buffer_stats = StreamBufferStats()
+metrics.register("stream_buffers", stream_buffer_stats.stats)
+
+
+class StreamChannel(Generic[T]):
+    """Single-consumer channel with an end-of-stream sentinel, optional coalescing and an optional byte bound."""
+
+    def __init__(
+        self,
+        merge: Optional[Callable[[T, T], Optional[T]]] = None,
+        size: Callable[[T], int] = lambda item: 1,
+        max_delay: float = 0.0,
+        max_size: int = 0,
+        nbytes: Callable[[T], int] = lambda item: 0,
+        max_bytes: int = 0,
+        stall_timeout: float = 0.0,
+        on_stall: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """
+        Args:
+            merge (Optional[Callable[[T, T], Optional[T]]]): Merges an item with the next one, returns None if they
+                can not be merged. Used to coalesce items and to merge items once the buffer is full.
+            size (Callable[[T], int]): The size of an item, coalescing stops once `max_size` is reached.
+            max_delay (float): Maximum seconds to wait for further mergeable items, 0 disables coalescing.
+            max_size (int): Maximum size of a coalesced item, 0 for no limit.
+            nbytes (Callable[[T], int]): The (approximate) memory size of an item.
+            max_bytes (int): Maximum bytes buffered before items are merged, 0 for no limit.
+            stall_timeout (float): Seconds the buffer may stay full before the stream is dropped, 0 to never drop it.
+            on_stall (Optional[Callable[[], None]]): Called when the stream is dropped.
+        """
+        self.merge = merge
+        self.size = size
+        self.max_delay = max_delay
+        self.max_size = max_size
+        self.nbytes = nbytes
+        self.max_bytes = max_bytes
+        self.stall_timeout = stall_timeout
+        self.on_stall = on_stall
+        self.buffered_bytes = 0
+        self.dropped = False
+        self._buffer: Deque[Tuple[object, int]] = deque()
+        self._waiter: Optional[asyncio.Future] = None
+        self._stall_timer: Optional[asyncio.TimerHandle] = None
+        self._closed = False
+        self._finished = False
+        stream_buffer_stats.add(channels=1)
+
+    @property
+    def closed(
+        self,
+    ) -> bool:
+        return self._closed
+
+    def __len__(
+        self,
+    ) -> int:
+        return len(self._buffer)
+
+    def _wake(
+        self,
+    ) -> None:
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def _account(
+        self,
+        nbytes: int,
+    ) -> None:
+        self.buffered_bytes += nbytes
+        stream_buffer_stats.add(nbytes=nbytes)
+        if self._stall_timer is not None and self.buffered_bytes <= self.max_bytes:
+            self._stall_timer.cancel()
+            self._stall_timer = None
+
+    def _popleft(
+        self,
+    ) -> object:
+        item, nbytes = self._buffer.popleft()
+        self._account(-nbytes)
+        return item
+
+    def put_nowait(
+        self,
+        item: T,
+    ) -> None:
+        """Append an item, items put after `close` are dropped."""
+        if self._closed:
+            return
+        nbytes = self.nbytes(item)
+        if self.max_bytes > 0 and self.buffered_bytes + nbytes > self.max_bytes:
+            self._put_overflow(item, nbytes)
+        else:
+            self._buffer.append((item, nbytes))
+            self._account(nbytes)
+        self._wake()
+
+    def _put_overflow(
+        self,
+        item: T,
+        nbytes: int,
+    ) -> None:
+        """Merge the item into the last buffered item if possible, and start the stall timer."""
+        merged = None
+        if self.merge is not None and self._buffer:
+            last, last_nbytes = self._buffer[-1]
+            merged = self.merge(last, item)  # type: ignore
+            if merged is not None:
+                merged_nbytes = self.nbytes(merged)
+                self._buffer[-1] = (merged, merged_nbytes)
+                self._account(merged_nbytes - last_nbytes)
+                stream_buffer_stats.add(overflow_merges=1)
+        if merged is None:
+            self._buffer.append((item, nbytes))
+            self._account(nbytes)
+        if self.stall_timeout > 0 and self._stall_timer is None and self.buffered_bytes > self.max_bytes:
+            self._stall_timer = asyncio.get_running_loop().call_later(self.stall_timeout, self._stall)
+
+    def _stall(
+        self,
+    ) -> None:
+        """Drop the stream of a consumer that did not keep up."""
+        self._stall_timer = None
+        if self._finished or self.buffered_bytes <= self.max_bytes:
+            return
+        self.dropped = True
+        stream_buffer_stats.add(stalled_clients=1)
+        self.discard()
+        if self.on_stall is not None:
+            self.on_stall()
+
+    def close(
+        self,
+    ) -> None:
+        """End the stream after the items that are already buffered."""
+        if self._closed:
+            return
+        self._closed = True
+        self._buffer.append((_END_OF_STREAM, 0))
+        self._wake()
+
+    def discard(
+        self,
+    ) -> None:
+        """End the stream immediately, dropping the buffered items (e.g. when the client disconnected)."""
+        self._closed = True
+        self._account(-self.buffered_bytes)
+        self._buffer.clear()
+        self._buffer.append((_END_OF_STREAM, 0))
+        self._finish()
+        self._wake()
+
+    def _finish(
+        self,
+    ) -> None:
+        if not self._finished:
+            self._finished = True
+            stream_buffer_stats.add(channels=-1)
+            if self._stall_timer is not None:
+                self._stall_timer.cancel()
+                self._stall_timer = None
+
+    async def _wait(
+        self,
+        timeout: Optional[float] = None,
+    ) -> None:
+        """Wait until an item is put or the channel is closed."""
+        loop = asyncio.get_running_loop()
+        self._waiter = loop.create_future()
+        timer = loop.call_later(timeout, self._wake) if timeout is not None else None
+        try:
+            await self._waiter
+        finally:
+            self._waiter = None
+            if timer is not None:
+                timer.cancel()
+
+    async def _coalesce(
+        self,
+        item: T,
+    ) -> T:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while self.max_size <= 0 or self.size(item) < self.max_size:
+            if self._buffer:
+                next_item = self._buffer[0][0]
+                if next_item is _END_OF_STREAM:
+                    break
+                merged = self.merge(item, next_item)  # type: ignore
+                if merged is None:
+                    break
+                self._popleft()
+                item = merged
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            await self._wait(remaining)
+        return item
+
+    async def get(
+        self,
+    ) -> T:
+        """The next item, raises StopAsyncIteration at the end of the stream."""
+        while not self._buffer:
+            await self._wait()
+        item = self._popleft()
+        if item is _END_OF_STREAM:
+            self._buffer.appendleft((item, 0))
+            self._finish()
+            raise StopAsyncIteration
+        if self.merge is not None and self.max_delay > 0:
+            return await self._coalesce(item)  # type: ignore
+        return item  # type: ignore
+
+    def __aiter__(
+        self,
+    ) -> AsyncIterator[T]:
+        return self
+
+    async def __anext__(
+        self,
+    ) -> T:
+        return await self.get()
+
+
+def merge_llm_tokens(
+    item: StreamingData,
+    next_item: StreamingData,
+) -> Optional[StreamingData]:
+    """
+    Merge two consecutive LLM tokens of the same LLM call.
+
+    Tokens are merged if their metadata (run ids, tags, tool, ...) is the same, apart from the langchain `chunk`,
+    which is dropped from the merged token.
+    """
+    if item.data_type != StreamingDataTypeEnum.LLM or next_item.data_type != StreamingDataTypeEnum.LLM:
+        return None
+    metadata = {key: value for key, value in item.metadata.items() if key != "chunk"}
+    if metadata != {key: value for key, value in next_item.metadata.items() if key != "chunk"}:
+        return None
+    return StreamingData(
+        data=item.data + next_item.data,
+        data_type=StreamingDataTypeEnum.LLM,
+        metadata=metadata,
+    )
+
+
+def streaming_data_nbytes(
+    item: StreamingData,
+) -> int:
+    """Approximate memory size of an event."""
+    return len(item.data) + STREAMING_DATA_OVERHEAD
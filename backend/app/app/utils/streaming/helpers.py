@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import logging
-from typing import Any, AsyncGenerator, Awaitable
+from typing import Any, AsyncGenerator, Awaitable, Coroutine
 
 from app.schemas.streaming_schema import StreamingData
-from app.utils.exceptions.common_exceptions import AgentCancelledException
+from app.utils.admission import admission_controller
+from app.utils.exceptions.common_exceptions import AdmissionRejectedException, AgentCancelledException
 from app.utils.streaming.callbacks.stream import AsyncIteratorCallbackHandler
 
 logger = logging.getLogger(__name__)
@@ -46,9 +48,13 @@ async def event_generator(
     ait = acallback.aiter()
 
     logger.info("Streaming response...")
-    async for response in ait:
-        stream_logger.debug(response)
-        yield response
+    try:
+        async for response in ait:
+            stream_logger.debug(response)
+            yield response
+    finally:
+        # release the buffered events if the client disconnected
+        acallback.channel.discard()
     stream_logger.info("\n")
 
 
@@ -68,3 +74,31 @@ async def handle_exceptions(
     except Exception as e:
         logger.exception(e)
         await stream_handler.on_llm_error(error=e)
+    except asyncio.CancelledError:
+        logger.info(f"Run {stream_handler.run_id} cancelled")
+        stream_handler.on_cancelled()
+        raise
+
+
+async def handle_admission(
+    coroutine: Coroutine,
+    stream_handler: AsyncIteratorCallbackHandler,
+    admission_key: str,
+    admitted: bool,
+) -> None:
+    """Wait for the admission of a queued run, run it and release its slot."""
+    if not admitted:
+        try:
+            await admission_controller.await_admission(admission_key, stream_handler.on_queued)
+        except AdmissionRejectedException as e:
+            coroutine.close()
+            await stream_handler.on_rejected(e)
+            return None
+        except asyncio.CancelledError:
+            coroutine.close()
+            stream_handler.on_cancelled()
+            raise
+    try:
+        return await handle_exceptions(coroutine, stream_handler)
+    finally:
+        await admission_controller.arelease(admission_key)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Wire protocols of the chat stream.
+
+Version 1 (default) writes every `StreamingData` as a full JSON object per line:
+```
+{"data": "Hel", "data_type": "llm", "metadata": {"run_id": "...", "parent_run_id": "...", "tags": [...], ...}}
+```
+
+Version 2 is negotiated with the `X-Stream-Protocol: 2` request header (and echoed in the response headers). Every
+line is a compact JSON object with the data type `t`, the data `d` and only the metadata that changed since the
+previous event:
+```
+{"t":"signal","d":"START","m":{"run_id":"..."}}
+{"t":"llm","d":"Hel","m":{"parent_run_id":"...","tags":[...]}}
+{"t":"llm","d":"lo"}
+{"t":"signal","d":"LLM_END","r":["tool"]}
+```
+`m` holds the metadata keys that were added or changed, `r` the keys that were removed. A client keeps the metadata
+of the previous event and applies both to it (see `decode_v2`), which yields the same metadata as version 1, apart
+from the `chunk` of LLM tokens, which duplicates `d` and is not sent. Run-level metadata (the query context) is thus
+sent once with the START signal.
+"""
+import json
+from datetime import date, datetime, time
+from enum import Enum
+from typing import Any, Dict, Iterable, List, Optional
+from uuid import UUID
+
+from pydantic import BaseModel
+from pydantic.v1 import BaseModel as BaseModelV1
+
+from app.schemas.streaming_schema import StreamingData, StreamingDataTypeEnum
+
+STREAM_PROTOCOL_HEADER = "X-Stream-Protocol"
+STREAM_PROTOCOLS = (1, 2)
+V2_EXCLUDED_METADATA = frozenset({"chunk"})
+
+
+def _to_json(
+    obj: Any,
+) -> Any:
+    """Convert the values `json` can not serialize, like `jsonable_encoder` does for the types used in metadata."""
+    if isinstance(obj, Enum):
+        return obj.value
+    if isinstance(obj, UUID):
+        return str(obj)
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    if isinstance(obj, BaseModelV1):
+        return obj.dict()
+    return str(obj)
+
+
+_encoder = json.JSONEncoder(
+    default=_to_json,
+    ensure_ascii=False,
+    separators=(",", ":"),
+)
+
+
+def encode_event(
+    item: StreamingData,
+) -> str:
+    """Encode an event with its full metadata (the version 1 event shape, without the LLM `chunk`)."""
+    return _encoder.encode(
+        {
+            "data": item.data,
+            "data_type": item.data_type.value,
+            "metadata": {key: value for key, value in item.metadata.items() if key not in V2_EXCLUDED_METADATA},
+        }
+    )
+
+
+def negotiate_protocol(
+    header: Optional[str],
+) -> int:
+    """The stream protocol requested by the client, version 1 if the header is missing or unknown."""
+    try:
+        protocol = int(header) if header else 1
+    except ValueError:
+        return 1
+    return protocol if protocol in STREAM_PROTOCOLS else 1
+
+
+class StreamEncoderV2:
+    """Encodes the events of one stream, keeping the metadata of the previous event to send deltas."""
+
+    def __init__(
+        self,
+    ) -> None:
+        self.metadata: Dict[str, Any] = {}
+
+    def encode(
+        self,
+        item: StreamingData,
+    ) -> str:
+        """Encode an event as a compact JSON line (without the newline)."""
+        event: Dict[str, Any] = {"t": item.data_type.value, "d": item.data}
+        changed = {
+            key: value
+            for key, value in item.metadata.items()
+            if key not in V2_EXCLUDED_METADATA and (key not in self.metadata or self.metadata[key] != value)
+        }
+        removed = [key for key in self.metadata if key not in item.metadata]
+        if changed:
+            event["m"] = changed
+            self.metadata.update(changed)
+        if removed:
+            event["r"] = removed
+            for key in removed:
+                del self.metadata[key]
+        return _encoder.encode(event)
+
+
+def decode_v2(
+    lines: Iterable[str],
+) -> List[StreamingData]:
+    """Decode a version 2 stream into the events with their full metadata, as a reference for clients."""
+    metadata: Dict[str, Any] = {}
+    events = []
+    for line in lines:
+        if not line:
+            continue
+        event = json.loads(line)
+        metadata.update(event.get("m", {}))
+        for key in event.get("r", []):
+            metadata.pop(key, None)
+        events.append(
+            StreamingData(
+                data=event["d"],
+                data_type=StreamingDataTypeEnum(event["t"]),
+                metadata=dict(metadata),
+            )
+        )
+    return events
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Per-run Redis Streams of the chat events.
+
+If `RUN_EVENTS_STREAM_ENABLED` is set, every event of a run is also appended to the Redis Stream
+`run_events:<run_id>`, which expires `RUN_EVENTS_STREAM_TTL` seconds after the last event. Clients that lost the
+connection (or any other worker) read the run from `GET /chat/run/{run_id}/events` instead of running the agent again:
+the endpoint replays the events after the given stream id and then tails the stream until the run ends. Only the
+user who started the run (`run_events:<run_id>:owner`, with the same TTL) can read its events.
+"""
+import asyncio
+import logging
+from typing import AsyncIterator, List, Optional, Set
+
+from redis.asyncio import Redis
+
+from app.api.deps import get_redis_client
+from app.core.config import settings
+from app.schemas.streaming_schema import StreamingData
+from app.utils.streaming.protocol import encode_event
+
+logger = logging.getLogger(__name__)
+
+END_OF_RUN_FIELD = "eos"
+EVENT_FIELD = "e"
+
+_flush_tasks: Set[asyncio.Task] = set()
+
+
+def run_events_key(
+    run_id: str,
+) -> str:
+    return f"run_events:{run_id}"
+
+
+def run_owner_key(
+    run_id: str,
+) -> str:
+    return f"{run_events_key(run_id)}:owner"
+
+
+class RunEventPublisher:
+    """
+    Appends the events of a run to its Redis Stream.
+
+    Events are buffered and written with one pipelined batch of XADD commands per `flush_interval`, off the path of
+    the live stream. Publishing is best effort: redis errors are logged and never affect the live response. A failed
+    batch is retried with the next one up to `max_attempts` times before its events are dropped, so that the
+    end-of-run entry is still written after a transient error.
+    """
+
+    def __init__(
+        self,
+        run_id: str,
+        owner: Optional[str] = None,
+        ttl: int = settings.RUN_EVENTS_STREAM_TTL,
+        max_len: int = settings.RUN_EVENTS_STREAM_MAX_LEN,
+        flush_interval: float = settings.RUN_EVENTS_FLUSH_INTERVAL,
+        max_attempts: int = 3,
+        retry_delay: float = 0.1,
+    ) -> None:
+        self.key = run_events_key(run_id)
+        self.owner_key = run_owner_key(run_id)
+        self.owner = owner
+        self.ttl = ttl
+        self.max_len = max_len
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._buffer: List[StreamingData] = []
+        self._pending = asyncio.Event()
+        self._closed = False
+        self._task: Optional[asyncio.Task] = None
+
+    def publish(
+        self,
+        item: StreamingData,
+    ) -> None:
+        """Buffer an event for the next batch."""
+        if self._closed:
+            return
+        self._buffer.append(item)
+        self._pending.set()
+        self._start()
+
+    def close(
+        self,
+    ) -> None:
+        """Write the buffered events and mark the end of the run."""
+        if self._closed:
+            return
+        self._closed = True
+        self._pending.set()
+        self._start()
+
+    async def aclose(
+        self,
+    ) -> None:
+        """Close the publisher and wait until all events are written."""
+        self.close()
+        if self._task is not None:
+            await self._task
+
+    def _start(
+        self,
+    ) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._aflush_loop())
+            _flush_tasks.add(self._task)
+            self._task.add_done_callback(_flush_tasks.discard)
+
+    async def _aflush_loop(
+        self,
+    ) -> None:
+        attempts = 0
+        while True:
+            await self._pending.wait()
+            if not self._closed:
+                await asyncio.sleep(self.flush_interval)
+            self._pending.clear()
+            items, self._buffer = self._buffer, []
+            closed = self._closed
+            try:
+                await self._aflush(await get_redis_client(), items, closed)
+                attempts = 0
+            except Exception as e:
+                attempts += 1
+                logger.warning(f"Could not publish the events of {self.key} (attempt {attempts}): {e!r}")
+                if attempts < self.max_attempts:
+                    self._buffer[:0] = items  # retried with the next batch
+                    self._pending.set()
+                    await asyncio.sleep(self.retry_delay * attempts)
+                    continue
+                logger.error(f"Dropped {len(items)} events of {self.key} after {attempts} attempts")
+                attempts = 0
+            if closed:
+                return
+
+    async def _aflush(
+        self,
+        redis_client: Redis,
+        items: List[StreamingData],
+        closed: bool,
+    ) -> None:
+        pipeline = redis_client.pipeline(transaction=False)
+        for item in items:
+            pipeline.xadd(self.key, {EVENT_FIELD: encode_event(item)}, maxlen=self.max_len, approximate=True)
+        if closed:
+            pipeline.xadd(self.key, {END_OF_RUN_FIELD: "1"}, maxlen=self.max_len, approximate=True)
+        pipeline.expire(self.key, self.ttl)
+        if self.owner is not None:
+            pipeline.set(self.owner_key, self.owner, ex=self.ttl)
+        await pipeline.execute()
+
+
+async def aread_run_events(
+    run_id: str,
+    after: str = "0-0",
+    block: int = 5_000,
+    count: int = 100,
+    start_timeout: float = 0.0,
+) -> AsyncIterator[tuple[str, str]]:
+    """
+    Replay the events of a run after the stream id `after` and tail the stream until the end of the run.
+
+    Yields the stream id and the JSON encoded event. Stops at the end-of-run entry, or when the stream expired (e.g.
+    the worker running the agent died). A stream that does not exist yet (e.g. a queued run) is waited for up to
+    `start_timeout` seconds.
+    """
+    redis_client = await get_redis_client()
+    key = run_events_key(run_id)
+    loop = asyncio.get_running_loop()
+    start_deadline = loop.time() + start_timeout
+    while True:
+        response = await redis_client.xread({key: after}, count=count, block=block)
+        if not response:
+            if not await redis_client.exists(key) and (after != "0-0" or loop.time() >= start_deadline):
+                return
+            continue
+        for entry_id, fields in response[0][1]:
+            after = entry_id
+            if END_OF_RUN_FIELD in fields:
+                return
+            yield entry_id, fields[EVENT_FIELD]
+
+
+async def run_events_exist(
+    run_id: str,
+) -> bool:
+    redis_client = await get_redis_client()
+    return bool(await redis_client.exists(run_events_key(run_id)))
+
+
+async def arun_events_owner(
+    run_id: str,
+) -> Optional[str]:
+    """The user who started the run, None if it was started without authentication."""
+    redis_client = await get_redis_client()
+    return await redis_client.get(run_owner_key(run_id))
+
+
+async def sse_run_events(
+    run_id: str,
+    after: str = "0-0",
+) -> AsyncIterator[str]:
+    """Format the events of a run as server-sent events, the stream id is the event id (`Last-Event-ID`)."""
+    async for entry_id, event in aread_run_events(run_id, after):
+        yield f"id: {entry_id}\ndata: {event}\n\n"
+    yield "event: end\ndata: {}\n\n"
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Cache of verified token claims.
+
+Decrypting a NextAuth token (`app.api.deps.get_jwt`) or verifying a bearer JWT (`user_id_identifier`) on every
+request is wasted work for clients polling e.g. the run status. `verified_token_cache` keeps the claims of verified
+tokens in a bounded LRU keyed by a hash of the token (tokens themselves are never stored). An entry expires at the
+`exp` claim of the token, or after JWT_CACHE_TTL seconds, whichever comes first, so an expired token is never served
+from the cache: it is verified again, and rejected by the verifier.
+"""
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Tuple
+
+from app.core.config import settings
+from app.utils.metrics import metrics
+
+TokenCacheKey = Tuple[str, str]
+
+
+@dataclass
+class _CachedClaims:
+    claims: Dict[str, Any]
+    expires_at: float
+
+
+class VerifiedTokenCache:
+    """Bounded, expiry-aware LRU cache of verified token claims keyed by (verifier, token hash)."""
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+    ) -> None:
+        """
+        Args:
+            max_size (int): Maximum number of cached tokens, 0 disables the cache.
+            ttl (float): Maximum seconds a verified token is cached, bounds how long a revoked token is accepted.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._claims: OrderedDict[TokenCacheKey, _CachedClaims] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    @staticmethod
+    def make_key(
+        verifier: str,
+        token: str,
+    ) -> TokenCacheKey:
+        """The cache key, tokens are only kept as a hash."""
+        return (
+            verifier,
+            hashlib.sha256(token.encode("utf-8")).hexdigest(),
+        )
+
+    def get_or_verify(
+        self,
+        verifier: str,
+        token: str,
+        verify: Callable[[], Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        """
+        Get the cached claims of a token, or verify it and cache its claims.
+
+        Args:
+            verifier (str): The name of the verifier, tokens of different verifiers are cached separately.
+            token (str): The token.
+            verify (Callable[[], Dict[str, Any]]): Verifies the token and returns its claims, raises if it is invalid
+                (errors are not cached).
+
+        Returns:
+            Dict[str, Any]: A copy of the claims of the token.
+        """
+        if self.max_size <= 0:
+            return verify()
+        key = self.make_key(verifier, token)
+        now = time.time()
+        with self._lock:
+            cached = self._claims.get(key)
+            if cached is not None:
+                if now < cached.expires_at:
+                    self.hits += 1
+                    self._claims.move_to_end(key)
+                    return dict(cached.claims)
+                del self._claims[key]
+                self.expired += 1
+            self.misses += 1
+
+        claims = verify()
+        expires_at = min(self._expiry(claims), now + self.ttl)
+        with self._lock:
+            self._claims[key] = _CachedClaims(claims=dict(claims), expires_at=expires_at)
+            self._claims.move_to_end(key)
+            while len(self._claims) > self.max_size:
+                self._claims.popitem(last=False)
+        return claims
+
+    @staticmethod
+    def _expiry(
+        claims: Dict[str, Any],
+    ) -> float:
+        try:
+            return float(claims["exp"])
+        except (KeyError, TypeError, ValueError):
+            return math.inf
+
+    def clear(
+        self,
+    ) -> None:
+        with self._lock:
+            self._claims.clear()
+
+    def stats(
+        self,
+    ) -> Dict[str, Any]:
+        """Hit/miss counters, hit rate and current size of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._claims),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+verified_token_cache = VerifiedTokenCache(
+    max_size=settings.JWT_CACHE_SIZE,
+    ttl=settings.JWT_CACHE_TTL,
+)
+metrics.register("verified_token_cache", verified_token_cache.stats)
@@ -2,13 +2,18 @@
 import json
 import time
 from typing import Any
+from unittest.mock import AsyncMock, patch
 
 import pytest
 from fastapi.testclient import TestClient
 
+from app.api.deps import get_jwt
 from app.schemas.message_schema import IChatMessage, IChatQuery, ICreatorRole
 from app.schemas.streaming_schema import StreamingData, StreamingDataTypeEnum, StreamingSignalsEnum
 from app.utils import uuid7
+from app.utils.streaming.protocol import decode_v2
+from app.utils.streaming.run_events import RunEventPublisher
+from tests.helpers.test_run_events import FakeRedis
 
 
 @pytest.fixture
@@ -82,3 +87,44 @@ async def test_chat(test_client: TestClient, chat_query: dict[str, Any]):  # pyl
         time.sleep(0.1)  # Wait a bit before reading the next line
 
     assert len(response_data) == 5
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_protocol_v2(
+    test_client: TestClient, chat_query: dict[str, Any]
+):  # pylint: disable=redefined-outer-name
+    response = test_client.post("api/v1/chat/agent", json=chat_query, headers={"X-Stream-Protocol": "2"})
+    assert response.status_code == 200
+    assert response.headers["X-Stream-Protocol"] == "2"
+
+    lines = [line for line in response.iter_lines() if line]
+    assert "m" in json.loads(lines[0])
+    events = decode_v2(lines)
+    assert [(e.data_type, e.data) for e in events] == [
+        (StreamingDataTypeEnum.SIGNAL, StreamingSignalsEnum.START.value),
+        (StreamingDataTypeEnum.ACTION, "clarify_tool"),
+        (StreamingDataTypeEnum.SIGNAL, StreamingSignalsEnum.LLM_END.value),
+        (StreamingDataTypeEnum.SIGNAL, StreamingSignalsEnum.TOOL_END.value),
+        (StreamingDataTypeEnum.SIGNAL, StreamingSignalsEnum.END.value),
+    ]
+    assert all(e.metadata["run_id"] == events[0].metadata["run_id"] for e in events)
+
+
+@pytest.mark.asyncio
+async def test_run_events_are_only_sent_to_the_run_owner(test_client: TestClient):
+    fake_redis = FakeRedis()
+    with patch("app.utils.streaming.run_events.get_redis_client", new=AsyncMock(return_value=fake_redis)):
+        publisher = RunEventPublisher("owned-run", owner="owner@example.com", flush_interval=0)
+        publisher.publish(
+            StreamingData(data=StreamingSignalsEnum.END.value, data_type=StreamingDataTypeEnum.SIGNAL, metadata={})
+        )
+        await publisher.aclose()
+
+        test_client.app.dependency_overrides[get_jwt] = lambda: {"sub": "other@example.com"}
+        assert test_client.get("api/v1/chat/run/owned-run/events").status_code == 404
+
+        test_client.app.dependency_overrides[get_jwt] = lambda: {"sub": "owner@example.com"}
+        response = test_client.get("api/v1/chat/run/owned-run/events")
+        assert response.status_code == 200
+        assert response.text.endswith("event: end\ndata: {}\n\n")
+    test_client.app.dependency_overrides[get_jwt] = lambda: {}
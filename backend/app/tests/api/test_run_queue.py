@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from langchain.agents import AgentExecutor
+
+from app.schemas.message_schema import IChatQuery
+from app.schemas.streaming_schema import StreamingDataTypeEnum, StreamingSignalsEnum
+from app.services.chat_agent.run_queue import AgentWorkerLoop, aenqueue_run, arelay_run, arun_queued
+from app.utils import uuid7
+from tests.helpers.test_run_events import FakeRedis
+
+
+@pytest.fixture
+def chat() -> IChatQuery:
+    return IChatQuery(
+        messages=[{"role": "user", "content": "Hello, I am a test user."}],
+        conversation_id=uuid7(),
+        new_message_id=uuid7(),
+        user_email="",
+    )
+
+
+@pytest.mark.asyncio
+async def test_queued_run_is_relayed(meta_agent: AgentExecutor, chat: IChatQuery):
+    with patch("app.utils.streaming.run_events.get_redis_client", new=AsyncMock(return_value=FakeRedis())), patch(
+        "app.services.chat_agent.run_queue.agent_deps.get_meta_agent", return_value=meta_agent
+    ):
+        relay = asyncio.create_task(asyncio.wait_for(_collect(arelay_run("queued-run")), 5))
+        await arun_queued("queued-run", chat)
+        events = await relay
+
+    assert [(e.data_type, e.data) for e in events] == [
+        (StreamingDataTypeEnum.SIGNAL, StreamingSignalsEnum.START.value),
+        (StreamingDataTypeEnum.ACTION, "clarify_tool"),
+        (StreamingDataTypeEnum.SIGNAL, StreamingSignalsEnum.LLM_END.value),
+        (StreamingDataTypeEnum.SIGNAL, StreamingSignalsEnum.TOOL_END.value),
+        (StreamingDataTypeEnum.SIGNAL, StreamingSignalsEnum.END.value),
+    ]
+    assert all(e.metadata["run_id"] == "queued-run" for e in events)
+
+
+async def _collect(iterator):
+    return [item async for item in iterator]
+
+
+def test_worker_loop_is_reused():
+    worker_loop = AgentWorkerLoop()
+
+    async def current_loop():
+        return asyncio.get_running_loop()
+
+    assert worker_loop.run(current_loop()) is worker_loop.run(current_loop())
+
+
+@pytest.mark.asyncio
+async def test_api_key_is_not_sent_through_the_broker(meta_agent: AgentExecutor, chat: IChatQuery):
+    redis_client = AsyncMock()
+    redis_client.getdel.return_value = "user-key"
+    chat.api_key = "user-key"
+    with patch("app.services.chat_agent.run_queue.get_redis_client", new=AsyncMock(return_value=redis_client)), patch(
+        "app.services.chat_agent.run_queue.celery.send_task"
+    ) as send_task:
+        await aenqueue_run("queued-run", chat)
+
+    assert send_task.call_args.args == ("run_agent",)
+    run_id, chat_query, _, api_key_ref, _ = send_task.call_args.kwargs["args"]
+    assert "api_key" not in chat_query
+    redis_client.set.assert_awaited_once_with(api_key_ref, "user-key", ex=60)
+
+    with patch("app.utils.streaming.run_events.get_redis_client", new=AsyncMock(return_value=FakeRedis())), patch(
+        "app.services.chat_agent.run_queue.get_redis_client", new=AsyncMock(return_value=redis_client)
+    ), patch("app.services.chat_agent.run_queue.agent_deps.get_meta_agent", return_value=meta_agent) as get_meta_agent:
+        await arun_queued(run_id, IChatQuery.model_validate(chat_query), api_key_ref=api_key_ref)
+
+    redis_client.getdel.assert_awaited_once_with(api_key_ref)
+    get_meta_agent.assert_called_once_with("user-key")
+
+
+@pytest.mark.asyncio
+async def test_worker_releases_the_user_slot_of_a_dropped_run(chat: IChatQuery):
+    redis_client = AsyncMock()
+    redis_client.getdel.return_value = None  # the API key expired
+    with patch("app.services.chat_agent.run_queue.get_redis_client", new=AsyncMock(return_value=redis_client)), patch(
+        "app.services.chat_agent.run_queue.admission_controller.arelease_user_slot", new_callable=AsyncMock
+    ) as arelease_user_slot:
+        await arun_queued("queued-run", chat, api_key_ref="agent_run_api_key:queued-run", admission_key="user")
+
+    arelease_user_slot.assert_awaited_once_with("user")
@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import AsyncMock, patch
+
+from fastapi.testclient import TestClient
+
+
+def test_sql_cache_invalidation(test_client: TestClient):
+    with patch("app.api.v1.endpoints.sql.sql_result_cache.ainvalidate", new_callable=AsyncMock) as ainvalidate:
+        response = test_client.post("api/v1/sql/cache/invalidate", params={"tables": ["main.orders", "main.items"]})
+        assert response.status_code == 200
+        ainvalidate.assert_awaited_once_with(["main.orders", "main.items"])
+
+        test_client.post("api/v1/sql/cache/invalidate")
+        ainvalidate.assert_awaited_with(None)
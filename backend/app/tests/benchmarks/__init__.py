@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks for the hot paths of the backend.
+
+The modules in this package are not collected by pytest (they are named `bench_*.py`), run them from `backend/app`:
+```
+python -m tests.benchmarks.bench_tool_registry
+```
+Environment variables that are not set fall back to the values used by the test suite (see `tests/pytest.ini`).
+"""
+import os
+import time
+from typing import Any, Callable, Dict
+
+_TEST_ENV = {
+    "PROJECT_NAME": "",
+    "OPENAI_API_KEY": "sk-benchmark",
+    "DATABASE_USER": "postgres",
+    "DATABASE_PASSWORD": "postgres",
+    "DATABASE_HOST": "database",
+    "DATABASE_PORT": "5432",
+    "DATABASE_NAME": "fastapi_db",
+    "REDIS_HOST": "redis_server",
+    "REDIS_PORT": "6379",
+    "MINIO_ROOT_USER": "",
+    "MINIO_ROOT_PASSWORD": "",
+    "MINIO_URL": "",
+    "MINIO_BUCKET": "",
+    "BACKEND_CORS_ORIGINS": '["*"]',
+    "PDF_TOOL_EXTRACTION_CONFIG_PATH": "",
+    "AGENT_CONFIG_PATH": "tests/config/agent-test.yml",
+    "SQL_TOOL_DB_ENABLED": "false",
+    "SQL_TOOL_DB_INFO_PATH": "",
+    "SQL_TOOL_DB_URI": "",
+    "PDF_TOOL_ENABLED": "true",
+    "PDF_TOOL_DATA_PATH": "",
+    "PDF_TOOL_DATABASE": "",
+}
+
+for _key, _value in _TEST_ENV.items():
+    os.environ.setdefault(_key, _value)
+
+
+def timeit(
+    fn: Callable[[], Any],
+    iterations: int,
+) -> Dict[str, float]:
+    """Time a synchronous callable, returns the mean and total duration in milliseconds."""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    total = (time.perf_counter() - start) * 1000
+    return {"total_ms": total, "mean_ms": total / iterations}
+
+
+def print_results(
+    title: str,
+    results: Dict[str, Dict[str, float]],
+) -> None:
+    """Print benchmark results as a small table."""
+    print(f"\n{title}")
+    for name, values in results.items():
+        print(f"  {name:<44}" + "  ".join(f"{k}={v:,.4f}" for k, v in values.items()))
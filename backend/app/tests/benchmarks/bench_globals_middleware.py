@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the `GlobalsMiddleware` against the previous `BaseHTTPMiddleware` implementation.
+
+Both wrap a minimal FastAPI app that sets `g.query_context` in a dependency, like `set_global_tool_context`. Requests
+are sent directly to the ASGI app (no server, no http client), reports the requests per second of a small JSON
+endpoint and the time per chunk of a streamed response.
+"""
+import asyncio
+import time
+from contextvars import copy_context
+from typing import Any, AsyncIterator, Callable, Dict, List
+
+from fastapi import Depends, FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
+from starlette.types import ASGIApp
+
+import tests.benchmarks  # noqa: F401  # pylint: disable=unused-import
+from app.utils.fastapi_globals import GlobalsMiddleware, g
+from tests.benchmarks import print_results
+
+REQUESTS = 2_000
+CHUNKS = 5_000
+
+
+class LegacyGlobalsMiddleware(BaseHTTPMiddleware):
+    """The previous implementation, a `BaseHTTPMiddleware` running `call_next` in a copied context."""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+    ) -> None:
+        async def dispatch(request: Request, call_next: Callable) -> Response:
+            return await copy_context().run(lambda: call_next(request))
+
+        super().__init__(app, dispatch)
+
+    async def dispatch(
+        self,
+        request: Request,
+        call_next: RequestResponseEndpoint,
+    ) -> Response:
+        return await call_next(request)
+
+
+async def set_query_context() -> None:
+    g.query_context = {"run_id": "benchmark"}
+
+
+def _app(middleware: type) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(middleware)
+
+    @app.get("/ping", dependencies=[Depends(set_query_context)])
+    async def ping() -> Dict[str, str]:
+        return {"run_id": g.query_context["run_id"]}
+
+    @app.get("/stream", dependencies=[Depends(set_query_context)])
+    async def stream() -> StreamingResponse:
+        async def chunks() -> AsyncIterator[str]:
+            for _ in range(CHUNKS):
+                yield '{"data": "token"}\n'
+
+        return StreamingResponse(chunks(), media_type="text/plain")
+
+    return app
+
+
+async def _request(app: FastAPI, path: str) -> List[Dict[str, Any]]:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [],
+        "client": ("127.0.0.1", 1234),
+        "server": ("testserver", 80),
+    }
+    messages: List[Dict[str, Any]] = []
+    requests = [{"type": "http.request", "body": b"", "more_body": False}]
+    disconnected = asyncio.Event()
+
+    async def receive() -> Dict[str, Any]:
+        if requests:
+            return requests.pop()
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: Dict[str, Any]) -> None:
+        messages.append(message)
+
+    await app(scope, receive, send)
+    disconnected.set()
+    return messages
+
+
+async def _bench(app: FastAPI) -> Dict[str, float]:
+    await _request(app, "/ping")  # warm up
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        await _request(app, "/ping")
+    requests_per_second = REQUESTS / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    messages = await _request(app, "/stream")
+    us_per_chunk = (time.perf_counter() - start) * 1_000_000 / CHUNKS
+    assert len(messages) >= CHUNKS
+    return {"requests_per_s": requests_per_second, "us_per_chunk": us_per_chunk}
+
+
+def main() -> None:
+    results = {}
+    for name, middleware in {
+        "BaseHTTPMiddleware (previous)": LegacyGlobalsMiddleware,
+        "pure ASGI GlobalsMiddleware": GlobalsMiddleware,
+    }.items():
+        results[name] = asyncio.run(_bench(_app(middleware)))
+    print_results(f"{REQUESTS} JSON requests and a response streaming {CHUNKS} chunks", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the delivery of streamed LLM tokens from the callback handler to the response.
+
+Compares the previous `asyncio.Queue` + `asyncio.Event` iterator (two tasks and an `asyncio.wait` per token) with the
+`StreamChannel` (one waiter future), with and without coalescing of consecutive tokens.
+"""
+import asyncio
+from typing import AsyncIterator, Callable, Optional
+
+import tests.benchmarks  # noqa: F401  # pylint: disable=unused-import
+from app.schemas.streaming_schema import StreamingData, StreamingDataTypeEnum
+from app.utils.streaming.channel import StreamChannel, merge_llm_tokens
+from tests.benchmarks import print_results, timeit
+
+TOKENS = 2_000
+ITERATIONS = 20
+
+
+class QueueStream:
+    """Previous implementation of `AsyncIteratorCallbackHandler.aiter`."""
+
+    def __init__(self) -> None:
+        self.queue: asyncio.Queue[StreamingData] = asyncio.Queue()
+        self.done = asyncio.Event()
+
+    def put_nowait(self, item: StreamingData) -> None:
+        self.queue.put_nowait(item)
+
+    def close(self) -> None:
+        self.done.set()
+
+    async def __aiter__(self) -> AsyncIterator[StreamingData]:
+        while not self.queue.empty() or not self.done.is_set():
+            done, other = await asyncio.wait(
+                [asyncio.ensure_future(self.queue.get()), asyncio.ensure_future(self.done.wait())],
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            while other:
+                other.pop().cancel()
+            while done:
+                result = done.pop().result()
+                if result is True:
+                    break
+                yield result
+
+
+async def _stream(stream: object, tokens_per_tick: int, tick: Optional[float]) -> int:
+    """Produce LLM tokens like `on_llm_new_token` does and consume them like `event_generator` does."""
+
+    async def produce() -> None:
+        for i in range(TOKENS):
+            stream.put_nowait(  # type: ignore
+                StreamingData(data=" tok", data_type=StreamingDataTypeEnum.LLM, metadata={"run_id": "run"})
+            )
+            if i % tokens_per_tick == 0:
+                await (asyncio.sleep(tick) if tick else asyncio.sleep(0))
+        stream.close()  # type: ignore
+
+    producer = asyncio.create_task(produce())
+    events = 0
+    async for _ in stream:  # type: ignore
+        events += 1
+    await producer
+    return events
+
+
+def _run(factory: Callable[[], object], tokens_per_tick: int, tick: Optional[float] = None) -> Callable[[], int]:
+    return lambda: asyncio.run(_stream(factory(), tokens_per_tick, tick))
+
+
+def main() -> None:
+    factories = {
+        "asyncio.Queue + Event (previous)": QueueStream,
+        "StreamChannel": StreamChannel,
+        "StreamChannel, coalesced (5ms, 256 chars)": lambda: StreamChannel(
+            merge=merge_llm_tokens, size=lambda item: len(item.data), max_delay=0.005, max_size=256
+        ),
+    }
+    for title, tokens_per_tick in [
+        (f"{TOKENS} tokens, one token per event loop iteration", 1),
+        (f"{TOKENS} tokens, bursts of 8 tokens per event loop iteration", 8),
+    ]:
+        print_results(
+            title, {name: timeit(_run(factory, tokens_per_tick), ITERATIONS) for name, factory in factories.items()}
+        )
+
+    print(f"\nEvents written for {TOKENS} tokens arriving every 1ms (bursts of 8)")
+    for name, factory in factories.items():
+        print(f"  {name:<44}events={_run(factory, 8, 0.001)()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the encoding of streamed LLM tokens in the wire protocols version 1 and 2.
+
+Tokens carry the metadata `AsyncIteratorCallbackHandler.on_llm_new_token` sends (the langchain chunk, run ids, tags
+and the query context). Reports the bytes and the encoding time per token.
+"""
+import asyncio
+from datetime import datetime
+from uuid import uuid4
+
+from langchain_core.messages import AIMessageChunk
+from langchain_core.outputs import ChatGenerationChunk
+
+import tests.benchmarks  # noqa: F401  # pylint: disable=unused-import
+from app.schemas.streaming_schema import StreamingData, StreamingDataTypeEnum
+from app.utils.streaming.protocol import StreamEncoderV2
+from app.utils.streaming.StreamingJsonListResponse import StreamingJsonListResponse
+from tests.benchmarks import print_results, timeit
+
+TOKENS = 1_000
+ITERATIONS = 20
+
+
+def _events() -> list[StreamingData]:
+    run_id, parent_run_id = str(uuid4()), uuid4()
+    tags = [
+        "agent_chat",
+        "user_email=user@example.com",
+        f"conversation_id={uuid4()}",
+        f"message_id={uuid4()}",
+        f"timestamp={datetime.now()}",
+        "version=N/A",
+    ]
+    tokens = [" the", " answer", " is", " 4", "2", "."] * (TOKENS // 6 + 1)
+    return [
+        StreamingData(
+            data=token,
+            data_type=StreamingDataTypeEnum.LLM,
+            metadata={
+                "chunk": ChatGenerationChunk(message=AIMessageChunk(content=token)),
+                "run_id": run_id,
+                "parent_run_id": parent_run_id,
+                "tags": tags,
+            },
+        )
+        for token in tokens[:TOKENS]
+    ]
+
+
+def _encode_v1(events: list[StreamingData]) -> list[str]:
+    async def collect() -> list[str]:
+        # pylint: disable=protected-access
+        return [line async for line in StreamingJsonListResponse._encoded_generator(events)]
+
+    return asyncio.run(collect())
+
+
+def _encode_v2(events: list[StreamingData]) -> list[str]:
+    encoder = StreamEncoderV2()
+    return [encoder.encode(event) for event in events]
+
+
+def main() -> None:
+    events = _events()
+    encoders = {"protocol 1 (jsonable_encoder)": _encode_v1, "protocol 2 (metadata deltas)": _encode_v2}
+    results = {}
+    for name, encode in encoders.items():
+        size = sum(len(line.encode()) for line in encode(events))
+        timing = timeit(lambda encode=encode: encode(events), ITERATIONS)
+        results[name] = {"bytes_per_token": size / TOKENS, "us_per_token": timing["mean_ms"] * 1000 / TOKENS}
+    print_results(f"Encoding {TOKENS} streamed LLM tokens", results)
+
+
+if __name__ == "__main__":
+    main()
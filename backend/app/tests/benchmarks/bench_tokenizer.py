@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark token counting for typical tool inputs.
+
+Compares loading the encoder on every call (the previous `get_token_length`) with the process-wide
+`tokenizer_service`: cached encoders, memoized system contexts and encoding of many texts on the thread pool.
+Requires the tiktoken encodings (downloaded on first use, or from `TIKTOKEN_CACHE_DIR`).
+"""
+import asyncio
+
+import tiktoken
+from langchain.schema import HumanMessage, SystemMessage
+
+import tests.benchmarks  # noqa: F401  # pylint: disable=unused-import
+from app.services.chat_agent.helpers.tokenizer import tokenizer_service
+from app.utils.config_loader import get_agent_config
+from tests.benchmarks import print_results, timeit
+
+ITERATIONS = 200
+
+
+def _count_uncached(text: str, model: str = "gpt-4") -> int:
+    """Previous implementation of get_token_length."""
+    return len(tiktoken.encoding_for_model(model).encode(text))
+
+
+def main() -> None:
+    system_context = "\n".join(t.system_context for t in get_agent_config().tools_library.library.values()) * 4
+    question = "Which five artists sold the most tracks in 2023, and how many tracks did each of them sell?"
+    sql_result = "\n".join(f"{i}, artist {i}, album {i % 13}, {i * 7 % 101}.99" for i in range(2_000))
+    messages = [SystemMessage(content=system_context), HumanMessage(content=question)]
+    intermediate_steps = [f"step {i}: " + sql_result[: 200 * (i + 1)] for i in range(32)]
+
+    tokenizer_service.encoding()
+    print_results(
+        "Token count of a router prompt (system context + question)",
+        {
+            "encoder loaded per call": timeit(
+                lambda: _count_uncached("".join(m.content for m in messages)), ITERATIONS
+            ),
+            "cached encoder": timeit(lambda: tokenizer_service.count("".join(m.content for m in messages)), ITERATIONS),
+            "memoized system context": timeit(
+                lambda: asyncio.run(tokenizer_service.acount_messages(messages, static_contents=[system_context])),
+                ITERATIONS,
+            ),
+        },
+    )
+    print_results(
+        "Token count of a large SQL result",
+        {
+            "encoder loaded per call": timeit(lambda: _count_uncached(sql_result), ITERATIONS // 10),
+            "cached encoder": timeit(lambda: tokenizer_service.count(sql_result), ITERATIONS // 10),
+        },
+    )
+    print_results(
+        "Token count of 32 intermediate steps",
+        {
+            "sequential": timeit(lambda: [tokenizer_service.count(s) for s in intermediate_steps], ITERATIONS // 10),
+            "thread pool": timeit(
+                lambda: asyncio.run(tokenizer_service.acount_batch(intermediate_steps)), ITERATIONS // 10
+            ),
+        },
+    )
+    tokenizer_service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
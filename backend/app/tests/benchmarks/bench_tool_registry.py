@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the per-request agent construction and the time to the first streamed event.
+
+Compares building every tool per request (`get_tools`, the previous behaviour) with binding the tools of the
+process-wide `ToolRegistry`. The router LLM is faked, so the time to first event only measures our own overhead.
+"""
+import asyncio
+import statistics
+import time
+from typing import List
+from unittest.mock import patch
+
+from langchain.agents import AgentExecutor
+from langchain_core.messages import HumanMessage
+
+import tests.benchmarks  # noqa: F401  # pylint: disable=unused-import
+from app.services.chat_agent.router_agent.SimpleRouterAgent import SimpleRouterAgent
+from app.services.chat_agent.tools.tools import ToolRegistry, get_tools
+from app.utils.config_loader import get_agent_config
+from app.utils.fastapi_globals import g
+from app.utils.streaming.callbacks.stream import AsyncIteratorCallbackHandler
+from tests.benchmarks import print_results, timeit
+from tests.fake.chat_model import FakeMessagesListChatModel
+
+ITERATIONS = 50
+
+
+def _executor(tools: list, llm: FakeMessagesListChatModel) -> AgentExecutor:
+    agent_config = get_agent_config()
+    agent = SimpleRouterAgent.from_llm_and_tools(
+        tools=tools,
+        llm=llm,
+        prompt_message=agent_config.prompt_message,
+        system_context=agent_config.system_context,
+        action_plans=agent_config.action_plans,
+    )
+    return AgentExecutor.from_agent_and_tools(agent=agent, tools=tools)
+
+
+async def _time_to_first_event(build: str, registry: ToolRegistry, llm: FakeMessagesListChatModel) -> float:
+    """Time from receiving the request until the first tool action is streamed."""
+    start = time.perf_counter()
+    tools = get_tools(get_agent_config().tools) if build == "get_tools" else registry.bind(get_agent_config().tools)
+    executor = _executor(tools, llm)
+    stream_handler = AsyncIteratorCallbackHandler()
+    task = asyncio.create_task(
+        executor.arun(input="Hello", chat_history=[], callbacks=[stream_handler], user_settings=None)
+    )
+    elapsed = float("nan")
+    async for event in stream_handler.aiter():
+        if event.data_type.value == "action":
+            elapsed = (time.perf_counter() - start) * 1000
+            break
+    task.cancel()
+    return elapsed
+
+
+async def _run_ttfe(registry: ToolRegistry, llm: FakeMessagesListChatModel) -> None:
+    results = {}
+    for build in ["get_tools", "registry.bind"]:
+        durations: List[float] = [await _time_to_first_event(build, registry, llm) for _ in range(ITERATIONS)]
+        results[build] = {"median_ms": statistics.median(durations), "max_ms": max(durations)}
+    print_results("Time to first streamed action (fake router LLM)", results)
+
+
+def main() -> None:
+    g.query_context = {"run_id": "benchmark"}
+    agent_config = get_agent_config()
+    llm = FakeMessagesListChatModel(responses=[HumanMessage(content="0")])
+    registry = ToolRegistry.from_agent_config(agent_config)
+
+    print_results(
+        "Tool construction per request",
+        {
+            "get_tools": timeit(lambda: get_tools(agent_config.tools), ITERATIONS),
+            "registry.bind": timeit(lambda: registry.bind(agent_config.tools), ITERATIONS),
+            "registry.bind (user api key)": timeit(
+                lambda: registry.bind(agent_config.tools, api_key="sk-user-key"), ITERATIONS
+            ),
+        },
+    )
+    with patch("app.services.chat_agent.router_agent.SimpleRouterAgent.is_running", return_value=True):
+        asyncio.run(_run_ttfe(registry, llm))
+
+
+if __name__ == "__main__":
+    main()
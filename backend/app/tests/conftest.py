@@ -11,11 +11,13 @@ from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 
 from app.api.deps import get_jwt
 from app.api.v1.endpoints.chat import get_meta_agent_with_api_key
+from app.db.sql_result_cache import sql_result_cache
 from app.deps.agent_deps import set_global_tool_context
 from app.main import app
 from app.schemas.agent_schema import AgentConfig
 from app.schemas.tool_schema import ToolInputSchema
 from app.services.chat_agent.meta_agent import create_meta_agent
+from app.services.chat_agent.tools.tools import ToolRegistry
 from app.utils import uuid7
 from app.utils.config_loader import get_agent_config
 from app.utils.fastapi_globals import g
@@ -41,6 +43,39 @@ def mock_redis_client_sync():
         yield
 
 
+@pytest.fixture(autouse=True)
+def mock_router_redis_client():
+    with patch(
+        "app.services.chat_agent.router_agent.router_cache.get_redis_client", new_callable=AsyncMock
+    ) as mock_router_redis_client:
+        mock_router_redis_client.return_value.get.return_value = None
+        mock_router_redis_client.return_value.lrange.return_value = []
+
+        yield
+
+
+@pytest.fixture(autouse=True)
+def mock_admission_redis_client():
+    with patch("app.utils.admission.get_redis_client", new_callable=AsyncMock) as mock_admission_redis_client:
+        mock_admission_redis_client.return_value.eval.return_value = 1
+        mock_admission_redis_client.return_value.pipeline = MagicMock()
+        pipeline = mock_admission_redis_client.return_value.pipeline.return_value.__aenter__.return_value
+        pipeline.execute.return_value = [0, 0]
+
+        yield mock_admission_redis_client
+
+
+@pytest.fixture(autouse=True)
+def mock_sql_result_cache_redis_client():
+    with patch("app.db.sql_result_cache.get_redis_client_binary", new_callable=AsyncMock) as mock_redis_client:
+        mock_redis_client.return_value.get.return_value = None
+        mock_redis_client.return_value.pipeline = MagicMock()
+        mock_redis_client.return_value.pipeline.return_value.__aenter__.return_value = MagicMock(execute=AsyncMock())
+        sql_result_cache.clear()
+
+        yield mock_redis_client
+
+
 @pytest.fixture
 def messages() -> list:
     return [
@@ -82,7 +117,9 @@ def agent_config() -> AgentConfig:
 def meta_agent(llm: BaseLanguageModel) -> AgentExecutor:  # pylint: disable=redefined-outer-name
     agent_config = get_agent_config()
     return create_meta_agent(
-        agent_config=agent_config, get_llm_hook=lambda type, key: llm  # pylint: disable=unused-argument
+        agent_config=agent_config,
+        get_llm_hook=lambda type, key: llm,  # pylint: disable=unused-argument
+        tool_registry=ToolRegistry.from_agent_config(agent_config),
     )
 
 
@@ -1,26 +1,40 @@
 # -*- coding: utf-8 -*-
-from typing import List, Sequence
+from typing import List, Optional, Sequence
 
-from pydantic import BaseModel
 from sqlalchemy.engine.result import Row
 from sqlalchemy.sql import column
 from sqlalchemy.sql.sqltypes import String
 
-from app.db.SQLDatabaseExtended import SQLDatabaseExtended
+from app.db.SQLDatabaseExtended import SampledResult, SQLDatabaseExtended
+from app.schemas.tool_schemas.sql_tool_schema import DatabaseInfo, TableInfo
 
 
-class FakeTable(BaseModel):
-    name: str
-    structure: str
+class FakeTable(TableInfo):
+    def __init__(self, name: str, structure: str):
+        super().__init__(schema_name="", table_name=name, structure=structure)
 
+    @property
+    def name(self) -> str:
+        return self.table_name
 
-class FakeDBInfo(BaseModel):
-    tables: List[FakeTable]
+
+class FakeDBInfo(DatabaseInfo):
+    pass
 
 
 class FakeSQLDatabase(SQLDatabaseExtended):
+    use_async_engine = False
+
     def __init__(self, db_info: FakeDBInfo):
         self.db_info = db_info
 
-    def run_no_str(self, command: str, fetch: str = "all") -> Sequence | Row | List[Row] | None:
+    def run_no_str(
+        self, command: str, fetch: str = "all", timeout: Optional[float] = None
+    ) -> Sequence | Row | List[Row] | None:
         return ["col1, col2; value1, value2"]
+
+    def sample(
+        self, command: str, nb_rows: int, count_cap: Optional[int] = None, timeout: Optional[float] = None
+    ) -> Optional[SampledResult]:
+        rows = self.run_no_str(command, timeout=timeout)
+        return SampledResult(columns=["result"], rows=[(row,) for row in rows[:nb_rows]], total_rows=len(rows))
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from typing import Any
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.utils import uuid7
+from app.utils.admission import AdmissionController, admission_controller
+from app.utils.exceptions.common_exceptions import AdmissionRejectedException
+from app.utils.streaming.callbacks.stream import AsyncIteratorCallbackHandler
+from app.utils.streaming.helpers import handle_admission
+
+
+def _controller(**kwargs: Any) -> AdmissionController:
+    return AdmissionController(
+        **{
+            "max_runs_per_user": 0,
+            "max_runs_per_worker": 1,
+            "queue_timeout": 1.0,
+            "max_queued": 10,
+            "retry_after": 7,
+            "poll_interval": 0.01,
+            **kwargs,
+        }
+    )
+
+
+@pytest.mark.asyncio
+async def test_worker_cap_queues_runs_in_order():
+    controller = _controller()
+    assert await controller.atry_acquire("a")
+    assert not await controller.atry_acquire("b")
+
+    positions: list[int] = []
+    waiter = asyncio.create_task(controller.await_admission("b", positions.append))
+    await asyncio.sleep(0.05)
+    assert positions == [1]
+    assert not await controller.atry_acquire("c")  # does not overtake the waiting run
+
+    await controller.arelease("a")
+    await asyncio.wait_for(waiter, 1)
+    assert controller.stats() == {"in_flight": 1, "waiting": 0, "admitted": 2, "queued": 1, "rejected": 0}
+
+
+@pytest.mark.asyncio
+async def test_queued_run_is_rejected_after_the_timeout():
+    controller = _controller(queue_timeout=0.05)
+    assert await controller.atry_acquire("a")
+    with pytest.raises(AdmissionRejectedException) as e:
+        await controller.await_admission("b", lambda position: None)
+    assert e.value.retry_after == 7
+    assert controller.stats()["rejected"] == 1
+    assert controller.stats()["waiting"] == 0
+
+
+@pytest.mark.asyncio
+async def test_run_cancelled_while_queued_ends_the_stream():
+    controller = _controller()
+    assert await controller.atry_acquire("a")
+    stream_handler = AsyncIteratorCallbackHandler()
+    with patch("app.utils.streaming.helpers.admission_controller", controller):
+        task = asyncio.create_task(handle_admission(asyncio.sleep(60), stream_handler, "b", admitted=False))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    events = await asyncio.wait_for(_collect(stream_handler.aiter()), 1)
+    assert "AgentCancelledException" in events[-1].data
+    assert controller.stats()["waiting"] == 0
+
+
+async def _collect(iterator):
+    return [item async for item in iterator]
+
+
+@pytest.mark.asyncio
+async def test_user_cap_is_counted_in_redis(mock_admission_redis_client):
+    controller = _controller(max_runs_per_user=2, max_runs_per_worker=0)
+    redis_client = mock_admission_redis_client.return_value
+    redis_client.eval.return_value = 0
+    assert not await controller.atry_acquire("a")
+    redis_client.eval.side_effect = ConnectionError("redis is down")
+    assert await controller.atry_acquire("a")  # fails open
+
+
+@pytest.mark.asyncio
+async def test_concurrent_runs_do_not_overshoot_the_worker_cap(mock_admission_redis_client):
+    controller = _controller(max_runs_per_user=10, max_runs_per_worker=2)
+
+    async def slow_eval(*args: Any) -> int:
+        await asyncio.sleep(0.01)
+        return 1
+
+    mock_admission_redis_client.return_value.eval.side_effect = slow_eval
+    acquired = await asyncio.gather(*(controller.atry_acquire(f"user-{i}") for i in range(5)))
+    assert sum(acquired) == 2
+    assert controller.in_flight == 2
+
+    mock_admission_redis_client.return_value.eval.side_effect = None
+    mock_admission_redis_client.return_value.eval.return_value = 0
+    await controller.arelease("user-0")
+    assert not await controller.atry_acquire("user-0")
+    assert controller.in_flight == 1
+
+
+def test_chat_over_the_limit_is_rejected(test_client: TestClient):
+    chat_query = {
+        "messages": [{"role": "user", "content": "Hello, I am a test user."}],
+        "api_key": None,
+        "conversation_id": str(uuid7()),
+        "new_message_id": str(uuid7()),
+        "user_email": "",
+        "settings": None,
+    }
+    with patch.object(admission_controller, "max_runs_per_worker", 1), patch.object(
+        admission_controller, "in_flight", 1
+    ), patch.object(admission_controller, "queue_timeout", 0):
+        response = test_client.post("api/v1/chat/agent", json=chat_query)
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == str(admission_controller.retry_after)
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from typing import AsyncIterator, Dict
+
+from fastapi import Depends, FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from app.utils.fastapi_globals import GlobalsMiddleware, g
+
+
+def test_globals_are_isolated_per_request():
+    app = FastAPI()
+    app.add_middleware(GlobalsMiddleware)
+
+    async def set_context(value: str) -> None:
+        assert g.request_value is None  # not leaked from a previous request
+        g.request_value = value
+
+    @app.get("/value", dependencies=[Depends(set_context)])
+    async def value() -> Dict[str, str]:
+        return {"value": g.request_value}
+
+    @app.get("/stream", dependencies=[Depends(set_context)])
+    async def stream() -> StreamingResponse:
+        async def chunks() -> AsyncIterator[str]:
+            for _ in range(3):
+                yield g.request_value
+
+        return StreamingResponse(chunks(), media_type="text/plain")
+
+    client = TestClient(app)
+    assert client.get("/value", params={"value": "a"}).json() == {"value": "a"}
+    assert client.get("/value", params={"value": "b"}).json() == {"value": "b"}
+    assert client.get("/stream", params={"value": "c"}).text == "ccc"
+    assert g.request_value is None
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import MagicMock, patch
+
+from app.services.chat_agent.helpers.llm import LLMClientCache
+
+
+def test_cache_hit_and_miss():
+    cache = LLMClientCache(max_size=2, idle_timeout=60)
+    factory = MagicMock(side_effect=lambda: object())
+    key = LLMClientCache.make_key("gpt-4", "sk-test", True)
+
+    first = cache.get_or_create(key, factory)
+    second = cache.get_or_create(key, factory)
+
+    assert first is second
+    assert factory.call_count == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+    assert "sk-test" not in str(key)
+
+
+def test_cache_is_bounded():
+    cache = LLMClientCache(max_size=2, idle_timeout=60)
+    keys = [LLMClientCache.make_key("gpt-4", f"sk-{i}", True) for i in range(3)]
+    for key in keys:
+        cache.get_or_create(key, object)
+
+    assert cache.stats()["size"] == 2
+    assert cache.stats()["evictions"] == 1
+    # the least recently used client was evicted
+    factory = MagicMock(side_effect=lambda: object())
+    cache.get_or_create(keys[0], factory)
+    assert factory.call_count == 1
+
+
+def test_idle_user_key_clients_are_evicted():
+    cache = LLMClientCache(max_size=10, idle_timeout=60)
+    default_key = LLMClientCache.make_key("gpt-4", "sk-default", True)
+    user_key = LLMClientCache.make_key("gpt-4", "sk-user", True)
+
+    with patch("app.services.chat_agent.helpers.llm.time.monotonic", return_value=0):
+        cache.get_or_create(default_key, object, default_key=True)
+        cache.get_or_create(user_key, object)
+    with patch("app.services.chat_agent.helpers.llm.time.monotonic", return_value=120):
+        cache.get_or_create(LLMClientCache.make_key("gpt-3.5-turbo", "sk-default", True), object, default_key=True)
+
+    assert cache.stats()["size"] == 2
+    assert cache.stats()["evictions"] == 1
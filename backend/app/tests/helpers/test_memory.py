@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+from typing import List
+from unittest.mock import patch
+
+import pytest
+from langchain.memory import ChatMessageHistory, ConversationTokenBufferMemory
+from langchain.schema import AIMessage, HumanMessage
+from langchain_openai import ChatOpenAI
+
+from app.services.chat_agent.helpers.memory import MessageTokenCounter, build_token_buffer_history
+from app.services.chat_agent.helpers.tokenizer import tokenizer_service
+
+
+class FakeEncoding:
+    """Whitespace tokenizer, avoids downloading the tiktoken encodings."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, text: str) -> List[str]:
+        self.calls += 1
+        return text.split()
+
+
+def _replay_with_token_buffer_memory(chat_messages, max_token_limit) -> list:
+    """Previous implementation of the chat history (ConversationTokenBufferMemory)."""
+    memory = ConversationTokenBufferMemory(
+        memory_key="chat_history",
+        return_messages=True,
+        max_token_limit=max_token_limit,
+        llm=ChatOpenAI(model_name="gpt-4", openai_api_key="sk-test"),
+        chat_memory=ChatMessageHistory(),
+    )
+    i = 0
+    while i < len(chat_messages):
+        if isinstance(chat_messages[i], HumanMessage):
+            if isinstance(chat_messages[i + 1], AIMessage):
+                memory.save_context(
+                    inputs={"input": chat_messages[i].content},
+                    outputs={"output": chat_messages[i + 1].content},
+                )
+                i += 1
+        else:
+            memory.save_context(inputs={"input": chat_messages[i].content}, outputs={"output": ""})
+        i += 1
+    return memory.load_memory_variables({})["chat_history"]
+
+
+@pytest.fixture
+def chat_messages() -> list:
+    messages = []
+    for i in range(20):
+        messages.append(HumanMessage(content=f"question {i} " + "word " * (i % 7)))
+        messages.append(AIMessage(content=f"answer {i} " + "token " * (i % 5)))
+    # unpaired messages
+    messages.append(AIMessage(content="an AI message without question"))
+    messages.append(HumanMessage(content="a dropped question"))
+    messages.append(HumanMessage(content="the last question"))
+    messages.append(AIMessage(content="the last answer"))
+    return messages
+
+
+@pytest.mark.parametrize("max_token_limit", [3, 20, 57, 100, 250, 10_000])
+def test_chat_history_identical_to_token_buffer_memory(chat_messages: list, max_token_limit: int):
+    encoding = FakeEncoding()
+    with patch("tiktoken.encoding_for_model", return_value=encoding), patch.object(
+        tokenizer_service, "encoding", return_value=encoding
+    ):
+        expected = _replay_with_token_buffer_memory(chat_messages, max_token_limit)
+        chat_history = build_token_buffer_history(
+            chat_messages,
+            max_token_limit=max_token_limit,
+            token_counter=MessageTokenCounter("gpt-4"),
+        )
+
+    assert [(type(m), m.content) for m in chat_history] == [(type(m), m.content) for m in expected]
+
+
+def test_messages_are_tokenized_once(chat_messages: list):
+    encoding = FakeEncoding()
+    token_counter = MessageTokenCounter("gpt-4")
+    with patch.object(tokenizer_service, "encoding", return_value=encoding):
+        build_token_buffer_history(chat_messages, max_token_limit=10_000, token_counter=token_counter)
+        calls = encoding.calls
+        build_token_buffer_history(chat_messages, max_token_limit=10_000, token_counter=token_counter)
+
+    assert encoding.calls == calls
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from app.utils.redis_pool import RedisPools
+
+
+@pytest.mark.asyncio
+async def test_clients_share_the_pools_of_the_event_loop():
+    pools = RedisPools(host="localhost", port=6379, max_connections=8, socket_timeout=1.0)
+    pools.open()
+
+    assert pools.client().connection_pool is pools.client().connection_pool
+    assert pools.client(decode_responses=False).connection_pool is not pools.client().connection_pool
+    assert pools.sync_client(db=2).connection_pool is pools.sync_client(db=2).connection_pool
+    assert pools.client().connection_pool.max_connections == 8
+
+    stats = pools.stats()
+    assert stats["async_db0_created"] == 0
+    assert stats["async_db0_binary_in_use"] == 0
+    assert "sync_db2_created" in stats
+
+    await pools.aclose()
+    assert pools.stats() == {"max_connections": 8}
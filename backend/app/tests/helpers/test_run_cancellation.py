@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from app.services.chat_agent.helpers.run_helper import RunCancellationListener, RunTaskRegistry, stop_run
+from app.utils.streaming.callbacks.stream import AsyncIteratorCallbackHandler
+from app.utils.streaming.helpers import handle_exceptions
+
+
+@pytest.mark.asyncio
+async def test_cancellation_interrupts_the_run_and_reports_the_latency():
+    registry = RunTaskRegistry()
+    stream_handler = AsyncIteratorCallbackHandler()
+    task = asyncio.create_task(handle_exceptions(asyncio.sleep(60), stream_handler))
+    registry.register("run", task)
+    await asyncio.sleep(0)
+
+    listener = RunCancellationListener(registry)
+    listener._on_message(json.dumps({"run_id": "run"}))  # pylint: disable=protected-access
+    listener._on_message("not json")  # pylint: disable=protected-access
+    with pytest.raises(asyncio.CancelledError):
+        await asyncio.wait_for(task, 1)
+
+    events = [event async for event in stream_handler.aiter()]
+    assert "AgentCancelledException" in events[-1].data
+    stats = registry.stats()
+    assert stats["running"] == 0
+    assert stats["cancelled"] == 1
+    assert stats["cancel_to_stop_max_ms"] < 1000
+    assert not registry.cancel("run")
+
+
+@pytest.mark.asyncio
+async def test_stop_run_cancels_locally_and_publishes():
+    registry = RunTaskRegistry()
+    task = asyncio.create_task(asyncio.sleep(60))
+    registry.register("run", task)
+    with patch("app.services.chat_agent.helpers.run_helper.get_redis_client", new_callable=AsyncMock) as redis, patch(
+        "app.services.chat_agent.helpers.run_helper.run_task_registry", registry
+    ):
+        redis.return_value.pipeline = MagicMock()
+        await stop_run("run")
+
+    pipeline = redis.return_value.pipeline.return_value.__aenter__.return_value
+    pipeline.delete.assert_called_once_with("run")
+    pipeline.execute.assert_awaited_once()
+    channel, message = pipeline.publish.call_args.args
+    assert channel == "run_cancel"
+    assert json.loads(message)["run_id"] == "run"
+    with pytest.raises(asyncio.CancelledError):
+        await task
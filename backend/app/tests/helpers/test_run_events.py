@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+from typing import Dict, List, Tuple
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from app.schemas.streaming_schema import StreamingData, StreamingDataTypeEnum, StreamingSignalsEnum
+from app.utils.streaming.run_events import (
+    RunEventPublisher,
+    aread_run_events,
+    arun_events_owner,
+    run_events_key,
+    sse_run_events,
+)
+
+
+class FakePipeline:
+    def __init__(self, redis: "FakeRedis"):
+        self.redis = redis
+        self.commands: List[Tuple] = []
+
+    def xadd(self, key, fields, maxlen=None, approximate=True):
+        self.commands.append(("xadd", key, fields))
+
+    def expire(self, key, ttl):
+        self.commands.append(("expire", key, ttl))
+
+    def set(self, key, value, ex=None):
+        self.commands.append(("set", key, value, ex))
+
+    async def execute(self):
+        if self.redis.failures:
+            self.redis.failures -= 1
+            raise ConnectionError("redis is down")
+        self.redis.batches += 1
+        for command in self.commands:
+            if command[0] == "xadd":
+                entries = self.redis.streams.setdefault(command[1], [])
+                entries.append((f"{len(entries) + 1}-0", command[2]))
+            elif command[0] == "set":
+                self.redis.values[command[1]] = command[2]
+                self.redis.ttls[command[1]] = command[3]
+            else:
+                self.redis.ttls[command[1]] = command[2]
+
+
+class FakeRedis:
+    def __init__(self):
+        self.streams: Dict[str, List[Tuple[str, Dict[str, str]]]] = {}
+        self.ttls: Dict[str, int] = {}
+        self.values: Dict[str, str] = {}
+        self.batches = 0
+        self.failures = 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def exists(self, key):
+        return int(key in self.streams)
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def xread(self, streams, count=None, block=None):
+        ((key, after),) = streams.items()
+        for _ in range(max(block // 10, 1)):
+            entries = [e for e in self.streams.get(key, []) if int(e[0].split("-")[0]) > int(after.split("-")[0])]
+            if entries:
+                return [[key, entries[:count]]]
+            await asyncio.sleep(0.01)
+        return []
+
+
+@pytest.fixture
+def redis() -> FakeRedis:
+    fake_redis = FakeRedis()
+    with patch("app.utils.streaming.run_events.get_redis_client", new=AsyncMock(return_value=fake_redis)):
+        yield fake_redis
+
+
+def _token(data: str) -> StreamingData:
+    return StreamingData(data=data, data_type=StreamingDataTypeEnum.LLM, metadata={"run_id": "run", "chunk": data})
+
+
+@pytest.mark.asyncio
+async def test_events_are_batched_and_replayed_after_an_id(redis: FakeRedis):
+    publisher = RunEventPublisher("run", ttl=60, max_len=100, flush_interval=0.01)
+    for token in ["a", "b", "c"]:
+        publisher.publish(_token(token))
+
+    events = []
+
+    async def tail():
+        async for entry_id, event in aread_run_events("run", after="1-0", block=10):
+            events.append((entry_id, json.loads(event)))
+
+    consumer = asyncio.create_task(tail())
+    await asyncio.sleep(0.05)
+    publisher.publish(_token("d"))
+    publisher.close()
+    await asyncio.wait_for(consumer, 1)
+
+    assert [(entry_id, event["data"]) for entry_id, event in events] == [("2-0", "b"), ("3-0", "c"), ("4-0", "d")]
+    assert events[0][1]["metadata"] == {"run_id": "run"}
+    assert redis.batches == 2
+    assert redis.ttls[run_events_key("run")] == 60
+
+
+@pytest.mark.asyncio
+async def test_sse_ends_with_the_run(redis: FakeRedis):
+    publisher = RunEventPublisher("run", ttl=60, max_len=100, flush_interval=0)
+    publisher.publish(
+        StreamingData(data=StreamingSignalsEnum.END.value, data_type=StreamingDataTypeEnum.SIGNAL, metadata={})
+    )
+    publisher.close()
+    await asyncio.sleep(0.01)
+
+    messages = [message async for message in sse_run_events("run")]
+    assert messages[0].startswith("id: 1-0\ndata: {")
+    assert messages[-1] == "event: end\ndata: {}\n\n"
+
+    assert [message async for message in aread_run_events("expired", block=1)] == []
+
+
+@pytest.mark.asyncio
+async def test_failed_batches_are_retried_and_the_run_ended(redis: FakeRedis):
+    redis.failures = 2
+    publisher = RunEventPublisher("run", owner="user", ttl=60, max_len=100, flush_interval=0, retry_delay=0)
+    publisher.publish(_token("a"))
+    await publisher.aclose()
+
+    assert [fields for _, fields in redis.streams[run_events_key("run")]][-1] == {"eos": "1"}
+    assert [message async for message in aread_run_events("run")] and await arun_events_owner("run") == "user"
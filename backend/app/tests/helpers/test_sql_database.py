@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from app.core.config import settings
+from app.db.SQLDatabaseExtended import EXPLAIN_STATEMENTS, QueryPlanEstimate, SQLDatabaseExtended, async_url
+from app.utils.exceptions.common_exceptions import SQLQueryTimeoutException
+
+
+@pytest.fixture
+def database(tmp_path) -> SQLDatabaseExtended:
+    db = SQLDatabaseExtended.from_uri(f"sqlite:///{tmp_path / 'test.db'}", query_timeout=5)
+
+    @event.listens_for(db._engine, "connect")  # pylint: disable=protected-access
+    def add_sleep(dbapi_connection, _):  # noqa: ANN001
+        dbapi_connection.create_function("sleep", 1, lambda seconds: time.sleep(seconds) or seconds)
+
+    db._engine.dispose()  # pylint: disable=protected-access
+    return db
+
+
+@pytest.mark.asyncio
+async def test_async_queries_do_not_block_the_event_loop(database: SQLDatabaseExtended):
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.01)
+
+    ticker = asyncio.create_task(tick())
+    columns, rows = await database.aexecute("SELECT sleep(0.2) AS slept, 'a' AS name")
+    ticker.cancel()
+
+    assert columns == ["slept", "name"]
+    assert [tuple(row) for row in rows] == [(0.2, "a")]
+    assert ticks >= 5
+    assert await database.arun_no_str("SELECT 42", fetch="one") == 42
+
+
+@pytest.mark.asyncio
+async def test_async_queries_time_out(database: SQLDatabaseExtended):
+    with pytest.raises(SQLQueryTimeoutException):
+        await database.arun_no_str("SELECT sleep(0.5)", timeout=0.05)
+
+
+def test_async_driver_urls():
+    url, connect_args = async_url(make_url("postgresql://user:pw@db/postgres?connect_timeout=10"))
+    assert url.drivername == "postgresql+asyncpg"
+    assert not url.query
+    assert connect_args == {"timeout": 10.0}
+    assert async_url(make_url("postgresql://user:pw@db/postgres?sslmode=require")) is None
+    assert async_url(make_url("sqlite:///test.db")) is None
+
+
+@pytest.fixture
+def numbers(database: SQLDatabaseExtended) -> SQLDatabaseExtended:
+    database.run_no_str("CREATE TABLE numbers (n INTEGER)")
+    database.run_no_str(
+        "WITH RECURSIVE s(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM s WHERE n < 500) "
+        "INSERT INTO numbers SELECT n FROM s"
+    )
+    return database
+
+
+@pytest.mark.asyncio
+async def test_sample_counts_up_to_the_cap(numbers: SQLDatabaseExtended):
+    result = await numbers.asample("SELECT n FROM numbers ORDER BY n;", 3)
+    assert result.columns == ["n"]
+    assert [tuple(row) for row in result.rows] == [(1,), (2,), (3,)]
+    assert (result.total_rows, result.total_capped, result.total_str()) == (500, False, "500")
+
+    capped = numbers.sample("SELECT n FROM numbers", 3, count_cap=100)
+    assert (capped.total_rows, capped.total_capped, capped.total_str()) == (100, True, "more than 100")
+
+    small = await numbers.asample("SELECT n FROM numbers WHERE n < 3", 5)
+    assert (len(small.rows), small.total_rows) == (2, 2)
+    assert numbers.sample("CREATE TABLE other (n INTEGER)", 5) is None
+
+
+def test_plan_estimates_and_timeouts_by_dialect(tmp_path):
+    _, parse_postgresql = EXPLAIN_STATEMENTS["postgresql"]
+    plan = '[{"Plan": {"Node Type": "Nested Loop", "Total Cost": 85213.5, "Plan Rows": 966000}}]'
+    assert parse_postgresql(plan) == QueryPlanEstimate(rows=966000, cost=85213.5)
+    _, parse_mysql = EXPLAIN_STATEMENTS["mysql"]
+    plan = {
+        "query_block": {
+            "cost_info": {"query_cost": "1021.75"},
+            "nested_loop": [
+                {"table": {"table_name": "album", "rows_examined_per_scan": 347}},
+                {"table": {"table_name": "track", "rows_examined_per_scan": 3503}},
+            ],
+        }
+    }
+    assert parse_mysql(plan) == QueryPlanEstimate(rows=3503, cost=1021.75)
+
+    database = SQLDatabaseExtended.from_uri(f"sqlite:///{tmp_path / 'explain.db'}")
+    assert database.explain("SELECT 1") is None
+    with patch.object(settings, "SQL_TOOL_DB_STATEMENT_TIMEOUTS", {"sqlite": 2.5}):
+        assert SQLDatabaseExtended.from_uri(f"sqlite:///{tmp_path / 'timeout.db'}").query_timeout == 2.5
+        assert SQLDatabaseExtended.default_query_timeout("postgresql") == SQLDatabaseExtended.query_timeout
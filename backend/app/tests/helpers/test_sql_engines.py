@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+
+from app.db.sql_engines import configure_session_state, session_statements, sql_engine_pools
+from app.db.SQLDatabaseExtended import SQLDatabaseExtended
+
+
+def test_session_statements_by_dialect():
+    assert session_statements("postgresql", "public", 30, read_only=True) == [
+        "SET search_path TO public",
+        "SET statement_timeout = 30000",
+        "SET default_transaction_read_only = on",
+    ]
+    assert session_statements("snowflake", "sales", 0.5) == [
+        "ALTER SESSION SET search_path='sales'",
+        "ALTER SESSION SET STATEMENT_TIMEOUT_IN_SECONDS = 1",
+    ]
+    assert session_statements("mysql", None, None, read_only=True) == ["SET SESSION TRANSACTION READ ONLY"]
+    assert not session_statements("oracle", "public", 30, read_only=True)
+
+
+def test_read_only_is_reported_where_it_is_not_enforced(caplog):
+    with patch("app.db.sql_engines.READ_ONLY_DIALECTS", {"postgresql"}):
+        configure_session_state(create_engine("sqlite://"), read_only=True)
+    assert "Read-only mode is not enforced on sqlite" in caplog.text
+
+
+def test_engines_are_pooled_by_schema(tmp_path):
+    uri = f"sqlite:///{tmp_path / 'test.db'}"
+    assert sql_engine_pools.engine(uri, schema="main") is sql_engine_pools.engine(uri, schema="main")
+    assert sql_engine_pools.engine(uri, schema="main") is not sql_engine_pools.engine(uri, schema="other")
+    assert sql_engine_pools.engine(uri) is not sql_engine_pools.engine(uri, read_only=True)
+
+
+def test_session_state_is_set_once_per_connection(tmp_path):
+    uri = f"sqlite:///{tmp_path / 'test.db'}"
+    SQLDatabaseExtended.from_uri(uri).run_no_str("CREATE TABLE artist (id INTEGER, name TEXT)")
+    database = SQLDatabaseExtended.from_uri(uri, read_only=True, lazy_table_reflection=True)
+    assert not database._session_statements(database.query_timeout)  # pylint: disable=protected-access
+
+    for _ in range(5):
+        assert database.run_no_str("SELECT COUNT(*) FROM artist", fetch="one") == 0
+    with pytest.raises(OperationalError, match="readonly"):
+        database.run_no_str("INSERT INTO artist VALUES (1, 'AC/DC')")
+
+    stats = sql_engine_pools.stats()["sqlite:default"]
+    assert stats["checkouts"] >= 6
+    assert stats["connects"] < stats["checkouts"]
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import datetime
+import decimal
+import uuid
+from typing import Dict, List, Set
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from app.db.sql_result_cache import SQLResultCache, decode_result, encode_result, normalize_sql, referenced_tables
+from app.db.SQLDatabaseExtended import SQLDatabaseExtended
+from app.schemas.tool_schemas.sql_tool_schema import DatabaseInfo, TableInfo
+
+
+class FakePipeline:
+    def __init__(self, redis: "FakeRedis"):
+        self.redis = redis
+        self.commands: List = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return None
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append(getattr(self.redis, name)(*args, **kwargs))
+
+    async def execute(self):
+        return [await command for command in self.commands]
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values: Dict[str, bytes] = {}
+        self.sets: Dict[str, Set[str]] = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.values[key] = value
+
+    async def sadd(self, key, value):
+        self.sets.setdefault(key, set()).add(value)
+
+    async def expire(self, key, seconds):
+        return True
+
+    async def smembers(self, key):
+        return self.sets.get(key, set())
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+            self.sets.pop(key, None)
+
+
+@pytest.fixture
+def redis() -> FakeRedis:
+    fake_redis = FakeRedis()
+    with patch("app.db.sql_result_cache.get_redis_client_binary", new=AsyncMock(return_value=fake_redis)):
+        yield fake_redis
+
+
+@pytest.fixture
+def database(tmp_path) -> SQLDatabaseExtended:
+    db = SQLDatabaseExtended.from_uri(
+        f"sqlite:///{tmp_path / 'test.db'}",
+        db_info=DatabaseInfo(
+            tables=[
+                TableInfo(schema_name="main", table_name="orders", structure="orders(id, amount)"),
+                TableInfo(schema_name="main", table_name="customers", structure="customers(id)"),
+            ]
+        ),
+    )
+    db.run_no_str("CREATE TABLE orders (id INTEGER, amount NUMERIC)")
+    db.run_no_str("INSERT INTO orders VALUES (1, 10), (2, 20), (3, 30)")
+    db.run_no_str("CREATE TABLE customers (id INTEGER)")
+    return db
+
+
+def test_normalize_sql():
+    assert normalize_sql("SELECT  a ,b\nFROM T -- comment\nWHERE name = 'Foo  Bar';") == (
+        "select a,b from t where name='Foo  Bar'"
+    )
+    assert normalize_sql('select "A" from t') != normalize_sql('select "a" from t')
+    assert referenced_tables(normalize_sql("SELECT * FROM Orders o JOIN main.customers c"), ["main.orders"]) == {
+        "main.orders"
+    }
+    assert not referenced_tables("select 'orders'", ["main.orders"])
+
+
+def test_payloads_keep_value_types():
+    row = (
+        decimal.Decimal("1.10"),
+        datetime.datetime(2024, 1, 2, 3, 4, 5),
+        datetime.date(2024, 1, 2),
+        uuid.UUID(int=1),
+        b"\x00\x01",
+        [1, "a"],
+        {"key": decimal.Decimal("2")},
+        None,
+    )
+    payload = decode_result(encode_result(["a"], [row], total_rows=5, total_capped=True))
+    assert payload["rows"] == [row[:5] + ([1, "a"], {"key": decimal.Decimal("2")}, None)]
+    assert (payload["total_rows"], payload["total_capped"]) == (5, True)
+
+
+@pytest.mark.asyncio
+async def test_results_are_cached_in_process_and_in_redis(database: SQLDatabaseExtended, redis: FakeRedis):
+    cache = SQLResultCache(max_size=10, local_ttl=60, ttl=600)
+    with patch.object(database, "aexecute", wraps=database.aexecute) as aexecute:
+        columns, rows = await cache.aexecute(database, "SELECT id FROM orders ORDER BY id")
+        assert (columns, rows) == (["id"], [(1,), (2,), (3,)])
+        assert await cache.aexecute(database, "select id\n from orders order by id;") == (columns, rows)
+        assert aexecute.call_count == 1
+
+        cache.clear()
+        assert await cache.aexecute(database, "SELECT id FROM orders ORDER BY id") == (columns, rows)
+        assert aexecute.call_count == 1
+
+    sample = await cache.asample(database, "SELECT id FROM orders", 2)
+    assert (sample.rows, sample.total_rows) == ([(1,), (2,)], 3)
+    assert cache.stats()["misses"] == 2
+    assert (cache.stats()["local_hits"], cache.stats()["redis_hits"]) == (1, 1)
+    assert redis.sets["sql_result:table:main.orders"]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_queries_are_executed_once(database: SQLDatabaseExtended, redis: FakeRedis):
+    cache = SQLResultCache(max_size=10, local_ttl=60, ttl=600)
+    with patch.object(database, "aexecute", wraps=database.aexecute) as aexecute:
+        results = await asyncio.gather(*[cache.aexecute(database, "SELECT id FROM orders") for _ in range(5)])
+    assert aexecute.call_count == 1
+    assert all(result == results[0] for result in results)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_queries_do_not_cancel_shared_executions(database: SQLDatabaseExtended, redis: FakeRedis):
+    cache = SQLResultCache(max_size=10, local_ttl=60, ttl=600)
+    aexecute = database.aexecute
+
+    async def slow_aexecute(*args, **kwargs):
+        await asyncio.sleep(0.05)
+        return await aexecute(*args, **kwargs)
+
+    with patch.object(database, "aexecute", side_effect=slow_aexecute) as mock_aexecute:
+        owner = asyncio.create_task(cache.aexecute(database, "SELECT id FROM orders"))
+        waiter = asyncio.create_task(cache.aexecute(database, "SELECT id FROM orders"))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        assert (await owner)[1] == [(1,), (2,), (3,)]
+        assert waiter.cancelled()
+
+        owner = asyncio.create_task(cache.aexecute(database, "SELECT id FROM customers"))
+        waiter = asyncio.create_task(cache.aexecute(database, "SELECT id FROM customers"))
+        await asyncio.sleep(0.01)
+        owner.cancel()
+        assert await waiter == (await cache.aexecute(database, "SELECT id FROM customers"))
+        assert owner.cancelled()
+    assert mock_aexecute.call_count == 3  # the waiter runs the query of the cancelled owner itself
+
+
+@pytest.mark.asyncio
+async def test_table_ttls_and_invalidation(database: SQLDatabaseExtended, redis: FakeRedis):
+    cache = SQLResultCache(max_size=10, local_ttl=60, ttl=600, table_ttls={"customers": 0})
+    with patch.object(database, "aexecute", wraps=database.aexecute) as aexecute:
+        await cache.aexecute(database, "SELECT * FROM customers")
+        await cache.aexecute(database, "SELECT * FROM customers")
+        assert aexecute.call_count == 2
+
+        await cache.aexecute(database, "SELECT * FROM orders")
+        database.run_no_str("INSERT INTO orders VALUES (4, 40)")
+        await cache.ainvalidate(["main.orders"])
+        _, rows = await cache.aexecute(database, "SELECT * FROM orders")
+        assert aexecute.call_count == 4
+    assert len(rows) == 4
+    assert cache.stats()["uncacheable"] == 2
+
+    with patch.object(database, "aexecute", wraps=database.aexecute) as aexecute:
+        await cache.aexecute(database, "SELECT random()")
+        await cache.aexecute(database, "SELECT random()")
+        assert aexecute.call_count == 2
+    assert cache.stats()["uncacheable"] == 4
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import patch
+
+from sqlalchemy import create_engine, text
+
+from app.db import sql_tool_introspection
+from app.db.sql_tool_introspection import DBInfoSnapshot, introspect_database
+from app.db.SQLDatabaseExtended import SQLDatabaseExtended
+
+
+def _create_tables(uri: str) -> None:
+    engine = create_engine(uri)
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE artist (id INTEGER PRIMARY KEY, name TEXT)"))
+        connection.execute(text("CREATE TABLE album (id INTEGER PRIMARY KEY, artist_id INTEGER REFERENCES artist(id))"))
+        connection.execute(text("INSERT INTO artist VALUES (1, 'AC/DC')"))
+    engine.dispose()
+
+
+def test_lazy_table_reflection_runs_no_query_on_construction(tmp_path):
+    uri = f"sqlite:///{tmp_path / 'test.db'}"
+    _create_tables(uri)
+    with patch("langchain_community.utilities.sql_database.inspect") as inspect:
+        database = SQLDatabaseExtended.from_uri(uri, lazy_table_reflection=True)
+        assert not inspect.called
+    assert list(database.get_usable_table_names()) == ["album", "artist"]
+    table_info = database.get_table_info(["artist"])
+    assert "CREATE TABLE artist" in table_info and "AC/DC" in table_info
+    assert "CREATE TABLE album" not in table_info
+
+
+def test_snapshot_refresh_only_inspects_changed_tables(tmp_path):
+    uri = f"sqlite:///{tmp_path / 'test.db'}"
+    _create_tables(uri)
+    snapshot = DBInfoSnapshot(str(tmp_path / "constants" / "db_info.json"))
+    assert snapshot.load() is None
+
+    report = snapshot.refresh(uri, ["main"], max_workers=2)
+    assert (report.status, report.tables, report.inspected, report.reused) == ("refreshed", 2, 2, 0)
+    db_info = snapshot.load()
+    assert [table.name for table in db_info.tables] == ["main.album", "main.artist"]
+    assert all(table.fingerprint for table in db_info.tables)
+    assert snapshot.load() is db_info
+
+    report = snapshot.refresh(uri, ["main"], max_workers=2)
+    assert (report.status, report.inspected, report.reused) == ("unchanged", 0, 2)
+    assert snapshot.load() is db_info
+
+    engine = create_engine(uri)
+    with engine.begin() as connection:
+        connection.execute(text("ALTER TABLE artist ADD COLUMN country TEXT"))
+        connection.execute(text("CREATE TABLE genre (id INTEGER PRIMARY KEY)"))
+    engine.dispose()
+    with patch.object(
+        sql_tool_introspection, "_inspect_table", wraps=sql_tool_introspection._inspect_table
+    ) as inspect_table:
+        report = snapshot.refresh(uri, ["main"], max_workers=2)
+    assert sorted(call.args[2] for call in inspect_table.call_args_list) == ["artist", "genre"]
+    assert (report.status, report.tables, report.inspected, report.reused) == ("refreshed", 3, 2, 1)
+    assert "country" in snapshot.load().get_table("main.artist").structure
+
+    assert snapshot.refresh(uri, ["main"], overwrite=False).status == "loaded"
+
+
+def test_introspection_reports_failed_tables(tmp_path):
+    uri = f"sqlite:///{tmp_path / 'test.db'}"
+    _create_tables(uri)
+    engine = create_engine(uri)
+    with patch.object(SQLDatabaseExtended, "get_table_info_no_throw", side_effect=RuntimeError("boom")):
+        db_info, report = introspect_database(engine, ["main"])
+    assert (report.inspected, report.failed) == (2, 2)
+    assert all(table.structure.startswith("Failed to get table info") for table in db_info.tables)
+    assert not any(table.fingerprint for table in db_info.tables)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from typing import List
+
+import pytest
+
+from app.schemas.streaming_schema import StreamingData, StreamingDataTypeEnum, StreamingSignalsEnum
+from app.utils.streaming.channel import StreamChannel, merge_llm_tokens, stream_buffer_stats
+
+
+def _token(data: str, run_id: str = "run") -> StreamingData:
+    return StreamingData(data=data, data_type=StreamingDataTypeEnum.LLM, metadata={"run_id": run_id})
+
+
+async def _collect(channel: StreamChannel) -> List[StreamingData]:
+    return [item async for item in channel]
+
+
+@pytest.mark.asyncio
+async def test_items_put_before_close_are_delivered():
+    channel: StreamChannel[int] = StreamChannel()
+    consumer = asyncio.create_task(_collect(channel))
+    await asyncio.sleep(0)
+
+    for i in range(3):
+        channel.put_nowait(i)
+    channel.close()
+    channel.put_nowait(3)
+
+    assert await consumer == [0, 1, 2]
+    assert await _collect(channel) == []
+
+
+@pytest.mark.asyncio
+async def test_consecutive_tokens_of_a_run_are_coalesced():
+    channel = StreamChannel(merge=merge_llm_tokens, size=lambda item: len(item.data), max_delay=0.05, max_size=6)
+    consumer = asyncio.create_task(_collect(channel))
+
+    for data in ["a", "b", "c"]:
+        channel.put_nowait(_token(data))
+        await asyncio.sleep(0)
+    channel.put_nowait(_token("other", run_id="other"))
+    channel.put_nowait(_token("12345678", run_id="other"))
+    channel.put_nowait(_token("9", run_id="other"))
+    channel.put_nowait(
+        StreamingData(data=StreamingSignalsEnum.LLM_END.value, data_type=StreamingDataTypeEnum.SIGNAL, metadata={})
+    )
+    channel.close()
+
+    assert [item.data for item in await consumer] == ["abc", "other12345678", "9", StreamingSignalsEnum.LLM_END.value]
+
+
+@pytest.mark.asyncio
+async def test_full_buffer_merges_tokens_and_drops_stalled_client():
+    stalled = []
+    channel = StreamChannel(
+        merge=merge_llm_tokens,
+        nbytes=lambda item: len(item.data),
+        max_bytes=4,
+        stall_timeout=0.01,
+        on_stall=lambda: stalled.append(True),
+    )
+    base_bytes = stream_buffer_stats.stats()["buffered_bytes"]
+
+    for data in ["ab", "cd", "ef", "gh"]:
+        channel.put_nowait(_token(data))
+    channel.put_nowait(_token("other", run_id="other"))
+    assert [item for item, _ in channel._buffer][1].data == "cdefgh"  # pylint: disable=protected-access
+    assert stream_buffer_stats.stats()["buffered_bytes"] == base_bytes + 13
+
+    assert (await channel.get()).data == "ab"
+    await asyncio.sleep(0.02)
+    assert stalled == [True] and channel.dropped
+    assert await _collect(channel) == []
+    assert stream_buffer_stats.stats()["buffered_bytes"] == base_bytes
+
+
+@pytest.mark.asyncio
+async def test_client_catching_up_is_not_dropped():
+    channel = StreamChannel(nbytes=lambda item: 1, max_bytes=1, stall_timeout=0.01, on_stall=pytest.fail)
+    channel.put_nowait(1)
+    channel.put_nowait(2)
+    assert await channel.get() == 1
+    await asyncio.sleep(0.02)
+    channel.close()
+    assert await _collect(channel) == [2]
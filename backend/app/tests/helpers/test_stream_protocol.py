@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import json
+from datetime import datetime
+from uuid import uuid4
+
+from fastapi.encoders import jsonable_encoder
+
+from app.schemas.streaming_schema import StreamingData, StreamingDataTypeEnum, StreamingSignalsEnum
+from app.utils.streaming.protocol import StreamEncoderV2, decode_v2, negotiate_protocol
+
+
+def test_v2_sends_metadata_deltas_that_decode_to_v1_metadata():
+    run_id, llm_run_id = "run", uuid4()
+    events = [
+        StreamingData(
+            data=StreamingSignalsEnum.START.value, data_type=StreamingDataTypeEnum.SIGNAL, metadata={"run_id": run_id}
+        ),
+        StreamingData(
+            data="sql_tool",
+            data_type=StreamingDataTypeEnum.ACTION,
+            metadata={"run_id": run_id, "tool": "sql_tool", "step": 0, "time": datetime(2024, 1, 1)},
+        ),
+        *[
+            StreamingData(
+                data=token,
+                data_type=StreamingDataTypeEnum.LLM,
+                metadata={"run_id": run_id, "parent_run_id": llm_run_id, "tags": ["agent_chat"], "chunk": token},
+            )
+            for token in ["Hel", "lo", " wörld"]
+        ],
+    ]
+    encoder = StreamEncoderV2()
+    lines = [encoder.encode(event) for event in events]
+
+    assert json.loads(lines[0]) == {"t": "signal", "d": "START", "m": {"run_id": "run"}}
+    assert json.loads(lines[3]) == {"t": "llm", "d": "lo"}
+    assert json.loads(lines[2])["r"] == ["tool", "step", "time"]
+    assert "wörld" in lines[4]
+
+    expected = [jsonable_encoder(event.dict()) for event in events]
+    for event in expected:
+        event["metadata"].pop("chunk", None)
+    assert [jsonable_encoder(event.dict()) for event in decode_v2(lines)] == expected
+
+
+def test_negotiate_protocol():
+    assert negotiate_protocol("2") == 2
+    assert negotiate_protocol(None) == 1
+    assert negotiate_protocol("3") == 1
+    assert negotiate_protocol("v2") == 1
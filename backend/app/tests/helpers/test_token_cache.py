@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+from fastapi_nextauth_jwt import NextAuthJWT
+from jose import jwe
+from starlette.requests import Request
+
+from app.api.deps import get_jwt, get_nextauth_jwt
+from app.utils.token_cache import VerifiedTokenCache
+
+
+def test_verified_claims_are_cached_until_the_token_expires():
+    cache = VerifiedTokenCache(max_size=2, ttl=60)
+    verify = MagicMock(return_value={"sub": "user", "exp": time.time() + 0.05})
+
+    assert cache.get_or_verify("jwt", "token", verify)["sub"] == "user"
+    assert cache.get_or_verify("jwt", "token", verify)["sub"] == "user"
+    assert verify.call_count == 1
+
+    time.sleep(0.06)
+    verify.side_effect = ValueError("Signature has expired")
+    with pytest.raises(ValueError):
+        cache.get_or_verify("jwt", "token", verify)
+    assert cache.stats() | {"hit_rate": None} == {
+        "size": 0,
+        "max_size": 2,
+        "hits": 1,
+        "misses": 2,
+        "expired": 1,
+        "hit_rate": None,
+    }
+
+
+def test_cache_is_bounded_and_separate_per_verifier():
+    cache = VerifiedTokenCache(max_size=2, ttl=60)
+    for token in ["a", "b", "c"]:
+        cache.get_or_verify("jwt", token, lambda token=token: {"sub": token})
+    assert cache.stats()["size"] == 2
+    assert cache.get_or_verify("nextauth", "c", lambda: {"sub": "other"}) == {"sub": "other"}
+
+    ttl_cache = VerifiedTokenCache(max_size=2, ttl=0)
+    verify = MagicMock(return_value={"sub": "user"})
+    ttl_cache.get_or_verify("jwt", "token", verify)
+    ttl_cache.get_or_verify("jwt", "token", verify)
+    assert verify.call_count == 2
+
+
+def test_get_jwt_builds_the_verifier_once():
+    get_nextauth_jwt.cache_clear()
+    with patch("app.api.deps.settings.ENABLE_AUTH", True), patch("app.api.deps.settings.NEXTAUTH_SECRET", "secret"):
+        verifier = get_nextauth_jwt()
+        claims = {"email": "user@example.com", "exp": int(time.time()) + 60}
+        token = jwe.encrypt(json.dumps(claims), verifier.key, algorithm="dir", encryption="A256GCM").decode()
+        request = Request(
+            {
+                "type": "http",
+                "method": "GET",
+                "headers": [(b"cookie", f"{verifier.cookie_name}={token}".encode())],
+            }
+        )
+        with patch.object(NextAuthJWT, "__call__", autospec=True, side_effect=NextAuthJWT.__call__) as decrypt:
+            assert get_jwt(request) == claims
+            assert get_jwt(request) == claims
+        assert decrypt.call_count == 1
+        assert get_nextauth_jwt() is verifier
+    get_nextauth_jwt.cache_clear()
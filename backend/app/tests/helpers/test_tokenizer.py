@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from typing import List
+from unittest.mock import patch
+
+import pytest
+from langchain.schema import HumanMessage, SystemMessage
+
+from app.services.chat_agent.helpers.tokenizer import TokenizerService
+
+
+class FakeEncoding:
+    """Whitespace tokenizer, avoids downloading the tiktoken encodings."""
+
+    def __init__(self):
+        self.encoded: List[str] = []
+
+    def encode(self, text: str) -> List[str]:
+        self.encoded.append(text)
+        return text.split()
+
+
+@pytest.fixture
+def encoding() -> FakeEncoding:
+    return FakeEncoding()
+
+
+@pytest.fixture
+def tokenizer(encoding: FakeEncoding) -> TokenizerService:
+    with patch("tiktoken.encoding_for_model", return_value=encoding) as encoding_for_model:
+        service = TokenizerService(max_workers=2, offload_threshold=50, static_cache_size=2)
+        yield service
+        service.shutdown()
+    assert encoding_for_model.call_count <= 1
+
+
+def test_static_counts_are_memoized(tokenizer: TokenizerService, encoding: FakeEncoding):
+    assert tokenizer.count_static("you are a helpful assistant") == 5
+    assert tokenizer.count_static("you are a helpful assistant") == 5
+    assert encoding.encoded == ["you are a helpful assistant"]
+
+    tokenizer.count_static("a")
+    tokenizer.count_static("b")
+    assert tokenizer.stats()["static_cache_size"] == 2
+
+
+@pytest.mark.asyncio
+async def test_only_variable_messages_are_tokenized(tokenizer: TokenizerService, encoding: FakeEncoding):
+    system_context = "you are a helpful assistant"
+    messages = [SystemMessage(content=system_context), HumanMessage(content="how many tracks")]
+
+    assert await tokenizer.acount_messages(messages, static_contents=[system_context]) == 8
+    assert await tokenizer.acount_messages(messages, static_contents=[system_context]) == 8
+    assert encoding.encoded.count(system_context) == 1
+    assert encoding.encoded.count("how many tracks") == 2
+
+
+@pytest.mark.asyncio
+async def test_large_inputs_are_offloaded(tokenizer: TokenizerService):
+    text = "token " * 100
+
+    assert await tokenizer.acount(text) == 100
+    assert await tokenizer.acount_batch([text, "a b"]) == [100, 2]
+    assert tokenizer.stats()["offloaded"] == 2
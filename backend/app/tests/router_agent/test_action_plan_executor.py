@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from typing import Any, List
+
+import pytest
+from langchain.tools import BaseTool
+from langchain_core.messages import AIMessage
+
+from app.schemas.agent_schema import ActionPlan, ActionPlans
+from app.schemas.tool_schema import ToolInputSchema
+from app.services.chat_agent.router_agent.ActionPlanExecutor import ActionPlanExecutor, build_action_graph
+from app.services.chat_agent.router_agent.SimpleRouterAgent import SimpleRouterAgent
+from tests.fake.chat_model import FakeMessagesListChatModel
+
+
+class FakeTool(BaseTool):
+    """Tool that records its input and the order of events."""
+
+    description: str = "fake tool"
+    delay: float = 0.0
+    fail: bool = False
+    events: Any  # shared between the tools (not copied by validation)
+    inputs: Any
+
+    def _run(self, *args: Any, **kwargs: Any) -> str:
+        raise NotImplementedError
+
+    async def _arun(self, query: str, **kwargs: Any) -> str:
+        self.events.append(f"start {self.name}")
+        self.inputs.append(ToolInputSchema.parse_raw(query))
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.events.append(f"cancelled {self.name}")
+            raise
+        if self.fail:
+            raise ValueError(f"{self.name} failed")
+        self.events.append(f"end {self.name}")
+        return f"{self.name} output"
+
+
+@pytest.fixture
+def action_plan() -> ActionPlan:
+    return ActionPlan(
+        name="",
+        description="Gather new information and summarize",
+        actions=[["pdf_tool", "entertainer_tool"], ["expert_tool"]],
+        dependencies={"expert_tool": ["pdf_tool"]},
+    )
+
+
+def test_action_graph(action_plan: ActionPlan):
+    sequential = build_action_graph(ActionPlan(name="", description="", actions=[["memory", "a", "b"], ["c"], ["d"]]))
+    assert [(n.tool, n.dependencies, n.upstream) for n in sequential] == [
+        ("a", [], set()),
+        ("b", [], set()),
+        ("c", [0, 1], {0, 1}),
+        ("d", [2], {0, 1, 2}),
+    ]
+
+    graph = build_action_graph(action_plan)
+    assert [(n.tool, n.dependencies) for n in graph] == [
+        ("pdf_tool", []),
+        ("entertainer_tool", []),
+        ("expert_tool", [0]),
+    ]
+
+    with pytest.raises(ValueError):
+        ActionPlan(name="", description="", actions=[["a"], ["b"]], dependencies={"a": ["b"]})
+    with pytest.raises(ValueError, match="memory"):
+        ActionPlan(name="", description="", actions=[["memory", "a"], ["b"]], dependencies={"b": ["memory"]})
+
+
+def make_executor(action_plan: ActionPlan, tools: List[BaseTool], **kwargs: Any) -> ActionPlanExecutor:
+    agent = SimpleRouterAgent.from_llm_and_tools(
+        tools=tools,
+        llm=FakeMessagesListChatModel(responses=[AIMessage(content="1")]),
+        prompt_message="{input}",
+        system_context="{action_plans}",
+        action_plans=ActionPlans(action_plans={"1": action_plan}),
+    )
+    return ActionPlanExecutor.from_agent_and_tools(agent=agent, tools=tools, return_intermediate_steps=True, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_independent_tools_overlap_across_steps(action_plan: ActionPlan):
+    events: List[str] = []
+    tools = [
+        FakeTool(name="pdf_tool", events=events, inputs=[]),
+        FakeTool(name="entertainer_tool", delay=0.2, events=events, inputs=[]),
+        FakeTool(name="expert_tool", events=events, inputs=[]),
+    ]
+    executor = make_executor(action_plan, tools)
+
+    result = await executor.acall({"input": "question", "chat_history": [], "user_settings": None})
+
+    assert events.index("end expert_tool") < events.index("end entertainer_tool")
+    assert [action.tool for action, _ in result["intermediate_steps"]] == [
+        "pdf_tool",
+        "entertainer_tool",
+        "expert_tool",
+    ]
+    assert tools[2].inputs[0].intermediate_steps == {"pdf_tool": "pdf_tool output"}
+    assert result["output"] == "pdf_tool:\npdf_tool output\n\nentertainer_tool:\nentertainer_tool output\n\n" + (
+        "expert_tool:\nexpert_tool output"
+    )
+
+
+@pytest.mark.asyncio
+async def test_failed_tool_cancels_and_awaits_the_others(action_plan: ActionPlan):
+    events: List[str] = []
+    tools = [
+        FakeTool(name="pdf_tool", fail=True, events=events, inputs=[]),
+        FakeTool(name="entertainer_tool", delay=0.2, events=events, inputs=[]),
+        FakeTool(name="expert_tool", events=events, inputs=[]),
+    ]
+
+    with pytest.raises(ValueError, match="pdf_tool failed"):
+        await make_executor(action_plan, tools).acall({"input": "question", "chat_history": [], "user_settings": None})
+    assert "cancelled entertainer_tool" in events
+    assert "start expert_tool" not in events
+
+
+@pytest.mark.asyncio
+async def test_max_iterations_bounds_the_steps(action_plan: ActionPlan):
+    events: List[str] = []
+    tools = [FakeTool(name=name, events=events, inputs=[]) for name in ("pdf_tool", "entertainer_tool", "expert_tool")]
+
+    result = await make_executor(action_plan, tools, max_iterations=1).acall(
+        {"input": "question", "chat_history": [], "user_settings": None}
+    )
+
+    assert [action.tool for action, _ in result["intermediate_steps"]] == ["pdf_tool", "entertainer_tool"]
+    assert result["output"] == "Agent stopped due to max iterations."
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+from typing import Dict, List
+from unittest.mock import AsyncMock, patch
+
+import numpy as np
+import pytest
+from langchain.schema import AIMessage, HumanMessage
+
+from app.schemas.agent_schema import ActionPlan, ActionPlans
+from app.services.chat_agent.router_agent.router_cache import (
+    ActionPlanRouter,
+    NearestNeighbourRouter,
+    RouterDecisionCache,
+)
+
+
+class FakePipeline:
+    def __init__(self, redis: "FakeRedis"):
+        self.redis = redis
+        self.commands: List = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return None
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append(getattr(self.redis, name)(*args, **kwargs))
+
+    async def execute(self):
+        return [await command for command in self.commands]
+
+
+class FakeRedis:
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def __init__(self):
+        self.values: Dict[str, str] = {}
+        self.lists: Dict[str, List[str]] = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.values[key] = value
+
+    async def lpush(self, key, value):
+        self.lists.setdefault(key, []).insert(0, value)
+
+    async def ltrim(self, key, start, end):
+        self.lists[key] = self.lists.get(key, [])[start : end + 1]
+
+    async def lrange(self, key, start, end):
+        return self.lists.get(key, [])[start : end + 1]
+
+
+@pytest.fixture(autouse=True)
+def redis() -> FakeRedis:
+    fake_redis = FakeRedis()
+    with patch(
+        "app.services.chat_agent.router_agent.router_cache.get_redis_client",
+        new=AsyncMock(return_value=fake_redis),
+    ):
+        yield fake_redis
+
+
+@pytest.fixture
+def action_plans() -> ActionPlans:
+    return ActionPlans(
+        action_plans={
+            "0": ActionPlan(name="pdf", description="PDF", actions=[["pdf_tool"]]),
+            "1": ActionPlan(name="sql", description="SQL", actions=[["sql_tool"]]),
+        }
+    )
+
+
+class LLMRouter:
+    def __init__(self, plan_id: str):
+        self.plan_id = plan_id
+        self.calls = 0
+
+    async def __call__(self) -> str:
+        self.calls += 1
+        return self.plan_id
+
+
+@pytest.mark.asyncio
+async def test_cached_decision_skips_llm(action_plans: ActionPlans):
+    router = ActionPlanRouter(cache=RouterDecisionCache(ttl=60, history_messages=2))
+    predict = LLMRouter("1")
+    history = [HumanMessage(content="hi"), AIMessage(content="hello")]
+
+    assert await router.aselect("How many tracks?", history, action_plans, predict) == "1"
+    assert await router.aselect("  how many TRACKS ", history, action_plans, predict) == "1"
+    assert predict.calls == 1
+
+    assert await router.aselect("How many tracks?", history + [AIMessage(content="new")], action_plans, predict)
+    assert predict.calls == 2
+    assert router.stats()["hit_rate"] == pytest.approx(1 / 3)
+
+    assert await router.aselect("How many tracks?", history, action_plans, predict, prompt="edited prompt") == "1"
+    assert predict.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_classifier_answers_similar_questions(action_plans: ActionPlans):
+    embeddings = {"how many tracks": [1.0, 0.0, 0.0], "number of tracks": [0.99, 0.05, 0.0], "a pdf": [0, 1.0, 0]}
+    router = ActionPlanRouter(classifier=NearestNeighbourRouter(threshold=0.95, max_examples=10))
+    router._aembed = AsyncMock(side_effect=lambda q: np.array(embeddings[q], dtype=np.float32))
+
+    assert await router.aselect("how many tracks", [], action_plans, LLMRouter("1")) == "1"
+    predict = LLMRouter("0")
+    assert await router.aselect("number of tracks", [], action_plans, predict) == "1"
+    assert predict.calls == 0
+
+    # below the similarity threshold the LLM decides and the classifier disagrees
+    assert await router.aselect("a pdf", [], action_plans, predict) == "0"
+    assert predict.calls == 1
+    stats = router.stats()
+    assert stats["classifier_hits"] == 1
+    assert stats["classifier_examples"] == 2
+    assert stats["classifier_comparisons"] == 1
+    assert stats["classifier_agreement"] == 0.0
+
+
+@pytest.mark.asyncio
+async def test_classifier_examples_are_shared(redis: FakeRedis):
+    classifier = NearestNeighbourRouter(threshold=0.9, max_examples=2)
+    for i, plan_id in enumerate(["0", "1", "2"]):
+        embedding = np.eye(3, dtype=np.float32)[i]
+        classifier.add(embedding, plan_id)
+        await classifier.apersist(embedding, plan_id)
+
+    other_worker = NearestNeighbourRouter(threshold=0.9, max_examples=2)
+    await other_worker.aload(3)
+
+    assert other_worker.size == 2
+    assert other_worker.predict(np.array([0, 0, 1.0])) == ("2", pytest.approx(1.0))
+    assert classifier.predict(np.array([1.0, 0, 0]))[0] != "0"
+
+
+@pytest.mark.asyncio
+async def test_classifier_load_is_retried_after_failure(redis: FakeRedis):
+    classifier = NearestNeighbourRouter(threshold=0.9, max_examples=2)
+    await classifier.apersist(np.eye(3, dtype=np.float32)[0], "0")
+
+    other_worker = NearestNeighbourRouter(threshold=0.9, max_examples=2)
+    with patch.object(FakeRedis, "lrange", side_effect=ConnectionError("redis is down")):
+        await other_worker.aload(3)
+    assert other_worker.size == 0
+
+    await other_worker.aload(3)
+    assert other_worker.size == 1
+
+
+@pytest.mark.asyncio
+async def test_classifier_discards_examples_of_another_dimension(redis: FakeRedis):
+    classifier = NearestNeighbourRouter(threshold=0.9, max_examples=4)
+    await classifier.apersist(np.eye(3, dtype=np.float32)[0], "0")
+    await classifier.apersist(np.eye(4, dtype=np.float32)[1], "1")
+
+    other_worker = NearestNeighbourRouter(threshold=0.9, max_examples=4)
+    await other_worker.aload(4)
+    assert other_worker.size == 1
+    assert other_worker.predict(np.eye(3, dtype=np.float32)[0]) is None
+
+    other_worker.add(np.eye(3, dtype=np.float32)[2], "2")
+    assert other_worker.size == 1
+    assert other_worker.predict(np.eye(3, dtype=np.float32)[2]) == ("2", pytest.approx(1.0))
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from typing import List
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from langchain.base_language import BaseLanguageModel
+
+from app.schemas.agent_schema import ActionPlan, ActionPlans
+from app.services.chat_agent.router_agent.speculation import (
+    PlanFrequencies,
+    SpeculationBudget,
+    Speculator,
+    get_speculative_run,
+    speculative_run_scope,
+)
+from app.services.chat_agent.tools.ExtendedBaseTool import ExtendedBaseTool
+
+
+class FakePrefetchTool(ExtendedBaseTool):
+    supports_prefetch = True
+    cancelled: bool = False
+
+    async def aprefetch(self, tool_input: str) -> str:
+        try:
+            await asyncio.sleep(0.01)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return f"{self.name}: {tool_input}"
+
+
+@pytest.fixture(autouse=True)
+def redis():
+    with patch(
+        "app.services.chat_agent.router_agent.speculation.get_redis_client", new_callable=AsyncMock
+    ) as mock_redis_client:
+        mock_redis_client.return_value.hgetall.return_value = {"0": "6", "1": "3"}
+        yield mock_redis_client.return_value
+
+
+@pytest.fixture
+def make_tool(llm: BaseLanguageModel):
+    def make(name: str, prefetch_llm_calls: int = 0) -> FakePrefetchTool:
+        return FakePrefetchTool(
+            name=name,
+            prefetch_llm_calls=prefetch_llm_calls,
+            llm=llm,
+            fast_llm=llm,
+            description=name,
+            prompt_message="",
+            system_context="",
+        )
+
+    return make
+
+
+@pytest.fixture
+def action_plans() -> ActionPlans:
+    return ActionPlans(
+        action_plans={
+            "0": ActionPlan(name="", description="PDF", actions=[["pdf_tool", "entertainer_tool"], ["expert_tool"]]),
+            "1": ActionPlan(name="", description="SQL", actions=[["sql_tool"]]),
+            "2": ActionPlan(name="", description="Clarify", actions=[["clarify_tool"]]),
+        }
+    )
+
+
+def _first_step_input(first_step: List[str]) -> str:
+    return "with memory" if "memory" in first_step else "question"
+
+
+@pytest.mark.asyncio
+async def test_agreed_step_is_adopted_and_others_cancelled(action_plans: ActionPlans, make_tool):
+    pdf_tool, sql_tool = make_tool("pdf_tool"), make_tool("sql_tool", prefetch_llm_calls=1)
+    speculator = Speculator(min_probability=0.2, max_tasks=2, budget=SpeculationBudget(10, 60))
+
+    await speculator.astart([pdf_tool, sql_tool], action_plans, _first_step_input)
+    await asyncio.sleep(0)  # the router LLM is deciding
+    speculative_run = get_speculative_run()
+    speculative_run.resolve({("pdf_tool", "question"), ("entertainer_tool", "question")})
+
+    assert await speculative_run.atake("pdf_tool", "question") == "pdf_tool: question"
+    assert await speculative_run.atake("sql_tool", "question") is None
+    await asyncio.sleep(0)
+    assert sql_tool.cancelled
+    assert speculator.stats() == {
+        "started": 2,
+        "adopted": 1,
+        "discarded": 1,
+        "skipped_budget": 0,
+        "wasted_llm_calls": 1,
+        "budget_remaining": 9,
+    }
+
+
+@pytest.mark.asyncio
+async def test_budget_and_probability_limit_speculation(action_plans: ActionPlans, make_tool):
+    pdf_tool, sql_tool = make_tool("pdf_tool"), make_tool("sql_tool", prefetch_llm_calls=1)
+    budget = SpeculationBudget(max_wasted_llm_calls=1, window=60)
+    budget.charge(1)
+
+    speculator = Speculator(min_probability=0.2, max_tasks=2, budget=budget)
+    await speculator.astart([pdf_tool, sql_tool], action_plans, _first_step_input)
+    assert speculator.started == 1
+    assert speculator.skipped_budget == 1
+    get_speculative_run().resolve(set())
+
+    unlikely = Speculator(min_probability=0.9, max_tasks=2, budget=SpeculationBudget(10, 60))
+    await unlikely.astart([pdf_tool, sql_tool], action_plans, _first_step_input)
+    assert unlikely.started == 0
+
+
+@pytest.mark.asyncio
+async def test_speculative_runs_are_scoped_to_the_executor(action_plans: ActionPlans, make_tool):
+    pdf_tool, sql_tool = make_tool("pdf_tool"), make_tool("sql_tool", prefetch_llm_calls=1)
+    speculator = Speculator(min_probability=0.2, max_tasks=2, budget=SpeculationBudget(10, 60))
+
+    with speculative_run_scope():
+        await speculator.astart([pdf_tool, sql_tool], action_plans, _first_step_input)
+        outer_run = get_speculative_run()
+
+        async def nested_executor() -> None:
+            with speculative_run_scope():
+                assert get_speculative_run() is None
+                await speculator.astart([pdf_tool], action_plans, _first_step_input)
+                assert get_speculative_run() is not outer_run
+
+        await asyncio.create_task(nested_executor())
+        assert get_speculative_run() is outer_run
+        assert await outer_run.atake("pdf_tool", "question") == "pdf_tool: question"
+
+    assert get_speculative_run() is None
+    assert speculator.adopted == 1
+    assert speculator.discarded == 2  # the nested run and the outer sql_tool run
+    assert speculator.wasted_llm_calls == 1
+
+
+@pytest.mark.asyncio
+async def test_plan_frequencies_are_reloaded(redis, action_plans: ActionPlans):
+    frequencies = PlanFrequencies(reload_interval=3600)
+    await frequencies.aload()
+    redis.hgetall.return_value = {"2": "9"}
+    await frequencies.aload()
+    assert frequencies.probabilities(action_plans)["0"] == pytest.approx(7 / 12)
+
+    frequencies.reload_interval = 0
+    await frequencies.aload()
+    assert frequencies.probabilities(action_plans)["2"] == pytest.approx(10 / 12)
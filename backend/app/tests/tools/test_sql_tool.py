@@ -1,11 +1,22 @@
 # -*- coding: utf-8 -*-
+from typing import List
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 from langchain.base_language import BaseLanguageModel
+from langchain_core.embeddings import Embeddings
 
+from app.db.SQLDatabaseExtended import QueryPlanEstimate
 from app.schemas.agent_schema import AgentConfig
+from app.schemas.tool_schemas.sql_tool_schema import DatabaseInfo, TableInfo
 from app.services.chat_agent.tools.library.sql_tool.sql_tool import SQLTool
+from app.services.chat_agent.tools.library.sql_tool.table_index import (
+    TableIndex,
+    parse_table_definitions,
+    table_columns,
+    table_document,
+)
+from app.utils.exceptions.common_exceptions import SQLQueryCostException
 from tests.fake.sql_db import FakeDBInfo, FakeSQLDatabase, FakeTable
 
 
@@ -74,3 +85,146 @@ async def test_sql_tool_run(sql_tool: SQLTool, tool_input: str):
     ):
         response = await sql_tool._arun(tool_input)
     assert response == "0"
+
+
+class KeywordEmbeddings(Embeddings):
+    """Bag of words embeddings over a fixed vocabulary."""
+
+    vocabulary = ["album", "artist", "invoice", "customer", "track", "genre"]
+
+    def _embed(self, text: str) -> List[float]:
+        words = text.lower().replace(".", " ").replace(",", " ").split()
+        return [float(sum(word.startswith(v) for word in words)) for v in self.vocabulary]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+@pytest.fixture
+def db_info() -> DatabaseInfo:
+    return DatabaseInfo(
+        tables=[
+            TableInfo(
+                schema_name="public",
+                table_name="Album",
+                structure='CREATE TABLE "Album" (\n\t"AlbumId" INTEGER NOT NULL,\n\t"Title" VARCHAR(160),\n'
+                '\tCONSTRAINT "PK_Album" PRIMARY KEY ("AlbumId")\n)',
+            ),
+            TableInfo(schema_name="public", table_name="Artist", structure="", description="Names of all artists"),
+            TableInfo(schema_name="public", table_name="Invoice", structure="", description="Invoices of customers"),
+            TableInfo(schema_name="public", table_name="Genre", structure="", description="List of genres"),
+        ]
+    )
+
+
+def test_table_documents(db_info: DatabaseInfo):
+    assert table_columns(db_info.tables[0].structure) == ["AlbumId", "Title"]
+    assert (
+        table_document(db_info.tables[0], "Albums per artist")
+        == "public.Album: Albums per artist. Columns: AlbumId, Title"
+    )
+    assert parse_table_definitions("public.db_table | description\npublic.Album | Albums per artist") == {
+        "public.album": "Albums per artist"
+    }
+
+
+@pytest.mark.asyncio
+async def test_table_index_search(db_info: DatabaseInfo):
+    index = TableIndex(KeywordEmbeddings())
+    results = await index.asearch("Which customer has the most invoices?", 2, db_info)
+    assert results[0][0] == "public.Invoice"
+    assert len(results) == 2
+    await index.asearch("Albums of an artist", 2, db_info)
+    assert index.builds == 1
+
+
+@pytest.mark.asyncio
+async def test_select_tables_from_index(sql_tool: SQLTool, db_info: DatabaseInfo):
+    sql_tool.table_index_enabled = True
+    sql_tool.table_index_top_k = 1
+    with (
+        patch("app.services.chat_agent.tools.library.sql_tool.sql_tool.sql_tool_db", new=FakeSQLDatabase(db_info)),
+        patch(
+            "app.services.chat_agent.tools.library.sql_tool.sql_tool.get_table_index",
+            return_value=TableIndex(KeywordEmbeddings()),
+        ),
+    ):
+        assert await sql_tool._aselect_tables("Which customer has the most invoices?") == ["public.Invoice"]
+
+        # close scores: the fast LLM selects among the candidates
+        sql_tool.table_index_rerank_margin = 1.0
+        sql_tool.prompt_rerank = "{candidate_tables} {question}"
+        with patch.object(SQLTool, "_agenerate_response", new=AsyncMock(return_value="public.album, public.invoice")):
+            assert await sql_tool._aselect_tables("Genres of the albums") == ["public.Album"]
+
+
+def test_render_schemas_within_token_budget():
+    structure = (
+        '\nCREATE TABLE "{table}" (\n\t"{table}Id" INTEGER NOT NULL, \n\t"Title" VARCHAR(160) NOT NULL, \n'
+        '\t"Composer" VARCHAR(220), \n\t"UnitPrice" NUMERIC(10, 2) NOT NULL, \n'
+        '\tCONSTRAINT "PK_{table}" PRIMARY KEY ("{table}Id")\n)\n\n/*\n2 rows from {table} table:\n'
+        "{table}Id\tTitle\tComposer\tUnitPrice\n1\tFor Those About To Rock\tAngus Young\t0.99\n"
+        "2\tBalls to the Wall\tNone\t0.99\n*/"
+    )
+    db_info = DatabaseInfo(
+        tables=[
+            TableInfo(schema_name="public", table_name=table, structure=structure.format(table=table))
+            for table in ("Track", "Album")
+        ]
+    )
+    assert db_info.get_table("PUBLIC.track") is db_info.tables[0]
+    assert db_info.get_tables(["public.album", "unknown", "public.Album"]) == [db_info.tables[1]]
+
+    def count_words(texts: List[str]) -> List[int]:
+        return [len(text.split()) for text in texts]
+
+    full = db_info.render_schemas(["public.Track", "public.Album"])
+    assert full.startswith(
+        'DB.TABLE name: public.Track, Table structure: CREATE TABLE "Track" ("TrackId" INTEGER NOT NULL, '
+        '"Title" VARCHAR(160) NOT NULL, "Composer" VARCHAR(220), "UnitPrice" NUMERIC(10, 2) NOT NULL, '
+        'PRIMARY KEY ("TrackId")) /* 2 rows from Track table: TrackId\tTitle'
+    )
+    assert db_info.render_schemas(["public.Track", "public.Album"], 1000, count_words) == full
+
+    # the sample rows, then the columns not matching the question, are pruned from the last table
+    pruned = db_info.render_schemas(["public.Track", "public.Album"], 50, count_words, "Prices of the tracks?")
+    track, album = pruned.split("\n")
+    assert "rows from" not in pruned
+    assert '"Composer" VARCHAR(220)' in track
+    assert album.endswith(
+        '("AlbumId" INTEGER NOT NULL, "UnitPrice" NUMERIC(10, 2) NOT NULL, PRIMARY KEY ("AlbumId"), ...)'
+    )
+    assert sum(count_words([pruned])) <= 50
+
+    assert db_info.render_schemas(["public.Track", "public.Album"], 1, count_words).count("DB.TABLE") == 1
+
+
+@pytest.mark.asyncio
+async def test_cost_guard(sql_tool: SQLTool):
+    response = "The query:\n```sql\nSELECT * FROM invoice, track\n```"
+
+    async def aexplain(self, command: str, timeout=None) -> QueryPlanEstimate:  # noqa: ANN001
+        return QueryPlanEstimate(rows=100 if "LIMIT" in command else 1e7, cost=50.0)
+
+    sql_tool.cost_guard_max_rows = 10_000
+    with patch.object(FakeSQLDatabase, "aexplain", new=aexplain):
+        guarded_response, complaints = await sql_tool._aguard_cost(response)
+        assert guarded_response == response
+        assert "10,000,000 rows (max 10,000)" in complaints
+
+        sql_tool.cost_guard_action = "limit"
+        guarded_response, complaints = await sql_tool._aguard_cost(response)
+        assert complaints is None
+        assert guarded_response == (
+            "The query:\n```sql\nSELECT * FROM (SELECT * FROM invoice, track) AS limited_query LIMIT 1000\n```"
+        )
+
+        sql_tool.cost_guard_action = "reject"
+        with pytest.raises(SQLQueryCostException):
+            await sql_tool._aguard_cost(response)
+
+        sql_tool.cost_guard_max_rows = 1e8
+        assert await sql_tool._aguard_cost(response) == (response, None)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import patch
+
+import pytest
+from langchain.base_language import BaseLanguageModel
+
+from app.core.config import settings
+from app.schemas.agent_schema import AgentConfig
+from app.services.chat_agent.tools.library.chain_tool.nested_meta_agent_tool import ChainTool
+from app.services.chat_agent.tools.tools import ToolRegistry
+
+
+@pytest.fixture
+def tool_registry(agent_config: AgentConfig, llm: BaseLanguageModel) -> ToolRegistry:
+    tool_registry = ToolRegistry.from_agent_config(agent_config)
+    chain_tool = ChainTool(
+        agent_config=agent_config,
+        llm=llm,
+        fast_llm=llm,
+        description="Nested agent",
+        prompt_message="",
+        system_context="",
+    )
+    return ToolRegistry(
+        agent_config,
+        tools={**{name: tool_registry.get(name) for name in agent_config.tools}, chain_tool.name: chain_tool},
+    )
+
+
+def test_bind_swaps_llms_for_user_api_key(tool_registry: ToolRegistry, llm: BaseLanguageModel):
+    with patch("app.services.chat_agent.tools.tools.get_llm", return_value=llm) as get_llm:
+        clarify_tool, chain_tool = tool_registry.bind(["clarify_tool", "chain_tool"], api_key="user-key")
+
+    assert {call.args[1] for call in get_llm.call_args_list} == {"user-key"}
+    assert clarify_tool.llm is llm and clarify_tool.fast_llm is llm
+    assert isinstance(chain_tool, ChainTool) and chain_tool.api_key == "user-key"
+    assert tool_registry.get("chain_tool").api_key is None
+
+
+def test_bind_keeps_shared_tools_for_default_api_key(tool_registry: ToolRegistry):
+    with patch("app.services.chat_agent.tools.tools.get_llm") as get_llm:
+        (clarify_tool,) = tool_registry.bind(["clarify_tool"], api_key=settings.OPENAI_API_KEY)
+
+    get_llm.assert_not_called()
+    assert clarify_tool is tool_registry.get("clarify_tool")
+
+
+def test_bind_does_not_mutate_shared_tools(tool_registry: ToolRegistry, llm: BaseLanguageModel):
+    shared_tool = tool_registry.get("clarify_tool")
+    shared_llm, shared_callbacks, shared_metadata = shared_tool.llm, shared_tool.callbacks, shared_tool.metadata
+    callbacks: list = []
+
+    with patch("app.services.chat_agent.tools.tools.get_llm", return_value=llm):
+        (clarify_tool,) = tool_registry.bind(["clarify_tool"], api_key="user-key", callbacks=callbacks, run_id="run")
+
+    assert clarify_tool is not shared_tool
+    assert clarify_tool.callbacks is callbacks and clarify_tool.metadata == {**(shared_metadata or {}), "run_id": "run"}
+    assert shared_tool.llm is shared_llm
+    assert shared_tool.callbacks is shared_callbacks
+    assert shared_tool.metadata == shared_metadata
+
+
+def test_bind_rejects_unknown_tools(tool_registry: ToolRegistry):
+    with pytest.raises(ValueError, match="unknown_tool"):
+        tool_registry.bind(["unknown_tool"])